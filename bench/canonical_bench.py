@@ -0,0 +1,73 @@
+# benchmark of the canonical metadata encoding on large snapshot metadata
+#   python -m bench.canonical_bench [entries]
+import copy
+import json
+import sys
+import time
+import uptane.crypto.hash
+from uptane.crypto.canonical import canonical_bytes, canonical_hash
+
+
+def legacy_sort_list(metadata: list) -> list:
+    for i in range(len(metadata)):
+        if type(metadata[i]) == type([]):
+            metadata[i] = legacy_sort_list(metadata[i])
+
+        if type(metadata[i]) == type({}):
+            metadata[i] = legacy_sort(metadata[i])
+
+    return metadata
+
+
+def legacy_sort(metadata: dict) -> dict:
+    '''
+    The recursive sort that signatures used to be computed with
+    '''
+    sorted_metadata = dict(sorted(metadata.items()))
+
+    for key in sorted_metadata:
+        if type(sorted_metadata[key]) == type({}):
+            sorted_metadata[key] = legacy_sort(sorted_metadata[key])
+
+        if type(sorted_metadata[key]) == type([]):
+            sorted_metadata[key] = legacy_sort_list(sorted_metadata[key])
+
+    return sorted_metadata
+
+
+def snapshot_tree(entries: int) -> dict:
+    targets = {}
+    for i in range(entries, 0, -1):
+        targets[f"0.0.{i}.image_{i}.targets.toml"] = {"hash": f"{i:064x}", "version": "0.0.1"}
+
+    return {"_type": "snapshot", "spec_version": "0.0.1", "bufsize": 65536,
+            "expires": "1700000000", "targets": targets, "ecus": [{"z": 1, "a": [2, {"y": 3, "b": 4}]}]}
+
+
+def timeit(func, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    return (time.perf_counter() - start) / rounds * 1000
+
+
+def main():
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    rounds = 10
+    tree = snapshot_tree(entries)
+
+    legacy = json.dumps(legacy_sort(copy.deepcopy(tree))).encode('utf-8')
+    assert legacy == canonical_bytes(tree), "canonical encoding differs from legacy encoding"
+    assert canonical_hash(tree, uptane.crypto.hash.HashFunc.sha256, stream=True) == \
+           canonical_hash(tree, uptane.crypto.hash.HashFunc.sha256)
+
+    sha256 = uptane.crypto.hash.HashFunc.sha256
+    print(f"snapshot with {entries} targets, {len(legacy) / 1024:.0f} KiB canonical")
+    print(f"legacy sort + dumps: {timeit(lambda: json.dumps(legacy_sort(tree)), rounds):.2f} ms")
+    print(f"canonical bytes:     {timeit(lambda: canonical_bytes(tree), rounds):.2f} ms")
+    print(f"canonical hash:      {timeit(lambda: canonical_hash(tree, sha256), rounds):.2f} ms")
+    print(f"streaming hash:      {timeit(lambda: canonical_hash(tree, sha256, True), rounds):.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# benchmark of metadata size and parse time, toml against msgpack
+#   python -m bench.codec_bench [targets in the snapshot]
+import sys
+import tempfile
+import timeit
+import uptane.codec
+import uptane.roles.snapshot
+import uptane.roles.targets
+import uptane.roles.timestamp
+import uptane.verify
+
+ROLE_CFG_DIR = 'ftest'
+
+
+def parse_us(codec: uptane.codec.Codec, data: bytes) -> float:
+    number = max(10, 20000 // max(len(data) // 100, 1))
+    return timeit.timeit(lambda: codec.loads(data), number=number) / number * 1e6
+
+
+def main():
+    targets_count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+
+    with tempfile.TemporaryDirectory() as dir_path:
+        targets_files = []
+        for i in range(targets_count):
+            targets_file = f'{dir_path}/0.0.1.image{i}.targets.toml'
+            uptane.roles.targets.TargetsOffline(f'{ROLE_CFG_DIR}/test_targetscfg.toml', \
+                f'{ROLE_CFG_DIR}/test_imagecfg.toml').gen_signed_metadata_file(targets_file)
+            targets_files.append(targets_file)
+        snapshot_file = f'{dir_path}/0.0.1.x.snapshot.toml'
+        uptane.roles.snapshot.SnapshotOffline(f'{ROLE_CFG_DIR}/test_snapshotcfg.toml', \
+            targets_files).gen_signed_metadata_file(snapshot_file)
+        timestamp_file = f'{dir_path}/0.0.1.x.timestamp.toml'
+        uptane.roles.timestamp.TimestampOffline(f'{ROLE_CFG_DIR}/test_timestampcfg.toml', \
+            snapshot_file).gen_signed_metadata_file(timestamp_file)
+
+        print(f"snapshot of {targets_count} targets, msgpack {'(msgpack package)' if uptane.codec.msgpack else '(pure python)'}")
+        print(f"{'role':<10} {'toml B':>9} {'msgpack B':>10} {'toml us':>10} {'msgpack us':>11}")
+        for role, path in (("targets", targets_files[0]), ("snapshot", snapshot_file),
+                           ("timestamp", timestamp_file)):
+            with open(path, 'rb') as f:
+                toml_data = f.read()
+            metadata = uptane.codec.TOML_CODEC.loads(toml_data)
+            msgpack_data = uptane.codec.MSGPACK_CODEC.dumps(metadata)
+
+            # same dict, so the same canonical signing bytes
+            assert uptane.codec.MSGPACK_CODEC.loads(msgpack_data) == metadata
+            keys = uptane.verify.RoleKeys([metadata["signature"]["keyid"]], 1)
+            uptane.verify.verify_signatures([uptane.verify.signature_item( \
+                uptane.codec.MSGPACK_CODEC.loads(msgpack_data), keys)])
+
+            print(f"{role:<10} {len(toml_data):>9} {len(msgpack_data):>10} "
+                  f"{parse_us(uptane.codec.TOML_CODEC, toml_data):>10.1f} "
+                  f"{parse_us(uptane.codec.MSGPACK_CODEC, msgpack_data):>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# concurrency stress test of the director, checks the signatures of every response
+#   python -m bench.director_stress [threads] [requests per thread]
+#   run from the repo root, the director serves a temporary fleet with one vehicle
+import concurrent.futures
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import zipfile
+import tomli
+import werkzeug.serving
+import uptane.crypto.hash
+import uptane.crypto.sign
+import uptane.repository.directorrepo
+import uptane.repository.fleetstore
+import uptane.roles.root
+
+ROOT_CFG = "ftest/test_rootcfg.toml"
+TARGETS_CFG = "ftest/test_targetscfg.toml"
+SNAPSHOT_CFG = "ftest/test_snapshotcfg.toml"
+TIMESTAMP_CFG = "ftest/test_timestampcfg.toml"
+
+VIN = "BENCHVIN0000000001"
+INSTALLED_HASH = "0" * 64
+# the images of the test repo, both ecus of the vehicle are upgraded to them
+IMAGES = [{"image_name": name, "image_url": f"http://autosec.com/repo/temp/{name}", "image_size": 47,
+           "image_hash": "813dad70c91f0756de80a76d91dbc986bdc1090c98cb37f9cf3b53709b0e3421",
+           "image_hash_func": "sha256", "image_buf_size": 65536, "image_sig_algo": "eddsa",
+           "image_version": "0.0.1"} for name in ("test_image", "test_image2")]
+
+
+def gen_fleet(fleet_db: str) -> None:
+    store = uptane.repository.fleetstore.FleetStore(fleet_db)
+    store.import_images(IMAGES)
+    store.import_upgrades([(INSTALLED_HASH, IMAGES[0]["image_hash"])])
+    store.import_ecus([(VIN, "ecu1", INSTALLED_HASH), (VIN, "ecu2", INSTALLED_HASH)])
+    store.close()
+
+
+def check_bundle(bundle: bytes, role_keys: dict) -> None:
+    '''
+    Checks the signatures and the hash chain of a metadata bundle, raises on any error
+    '''
+    files = {}
+    with zipfile.ZipFile(io.BytesIO(bundle)) as zipO:
+        for name in zipO.namelist():
+            files[name.split('/')[-1]] = zipO.read(name)
+
+    groups = []
+    snapshot, timestamp = None, None
+    for name in files:
+        toml_dict = tomli.loads(files[name].decode('utf-8'))
+        role = toml_dict["signed"]["_type"]
+        assert toml_dict["signature"]["keyid"] == role_keys[role], f"{name} signed with wrong key"
+        groups.append(uptane.crypto.sign.ThresholdGroup(toml_dict["signed"], \
+            [(toml_dict["signature"]["keyid"], toml_dict["signature"]["sig"])], 1))
+        if role == "snapshot":
+            snapshot = (name, toml_dict["signed"])
+        if role == "timestamp":
+            timestamp = toml_dict["signed"]
+
+    results = uptane.crypto.sign.verify_threshold_batch(groups, uptane.crypto.hash.HashFunc.sha256, \
+              uptane.crypto.sign.KeyType.ed25519)
+    assert all(result.valid for result in results), "invalid signature in bundle"
+
+    sha256 = uptane.crypto.hash.HashFunc.sha256
+    for targets_name, entry in snapshot[1]["targets"].items():
+        assert uptane.crypto.hash.get_bytes_hash(files[targets_name], sha256) == entry["hash"]
+    assert uptane.crypto.hash.get_bytes_hash(files[snapshot[0]], sha256) == \
+           timestamp["snapshot_metadata_file_hash"]
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    fleet_db = os.path.join(tempfile.mkdtemp(), "fleet.db")
+    gen_fleet(fleet_db)
+    uptane.repository.directorrepo.init_server(None, TIMESTAMP_CFG, SNAPSHOT_CFG, TARGETS_CFG, "",
+                                               fleet_db)
+    server = werkzeug.serving.make_server("127.0.0.1", 0, uptane.repository.directorrepo.directorrepo,
+                                          threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/manifest/"
+
+    roles = uptane.roles.root.Root(ROOT_CFG).signed_dict["roles"]
+    role_keys = {role: roles[role]["keys"][0]["keyid"] for role in roles}
+
+    def worker(_) -> int:
+        for _ in range(requests):
+            request = urllib.request.Request(url, data=json.dumps({"vin": VIN}).encode('utf-8'),
+                                             headers={"Content-Type": "application/json"}, method="POST")
+            with urllib.request.urlopen(request) as response:
+                check_bundle(response.read(), role_keys)
+        return requests
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        total = sum(executor.map(worker, range(threads)))
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    print(f"{total} responses from {threads} threads verified in {elapsed:.2f} s "
+          f"({total / elapsed:.0f} req/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# benchmark of single file hashing throughput: read() loop vs readinto vs mmap
+#   python -m bench.file_hash_bench [size in MB]
+import hashlib
+import os
+import sys
+import tempfile
+import time
+import uptane.crypto.hash
+
+BUFSIZE = 65536
+
+
+def legacy_file_hash(file_path: str, bufsize: int) -> str:
+    '''
+    The read() loop get_file_hash used before, allocates a new bytes object per read
+    '''
+    hashfunc = hashlib.sha256()
+    image_file = open(file_path, "rb")
+    while True:
+        data = image_file.read(bufsize)
+        if not data:
+            break
+        hashfunc.update(data)
+    image_file.close()
+    return hashfunc.hexdigest()
+
+
+def throughput(func, size_mb: int) -> float:
+    start = time.perf_counter()
+    func()
+    return size_mb / (time.perf_counter() - start)
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    sha256 = uptane.crypto.hash.HashFunc.sha256
+
+    with tempfile.TemporaryDirectory() as dir_path:
+        path = f'{dir_path}/image'
+        block = os.urandom(1024 * 1024)
+        with open(path, "wb") as f:
+            for _ in range(size_mb):
+                f.write(block)
+
+        expected = legacy_file_hash(path, BUFSIZE)
+        assert uptane.crypto.hash.get_file_hash(path, sha256) == expected
+        assert uptane.crypto.hash.get_file_hash(path, sha256, use_mmap=True) == expected
+
+        print(f"{size_mb} MB image")
+        print(f"read() loop:        {throughput(lambda: legacy_file_hash(path, BUFSIZE), size_mb):.0f} MB/s")
+        print(f"readinto:           {throughput(lambda: uptane.crypto.hash.get_file_hash(path, sha256, BUFSIZE), size_mb):.0f} MB/s")
+        print(f"readinto auto size: {throughput(lambda: uptane.crypto.hash.get_file_hash(path, sha256), size_mb):.0f} MB/s")
+        print(f"mmap:               {throughput(lambda: uptane.crypto.hash.get_file_hash(path, sha256, use_mmap=True), size_mb):.0f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
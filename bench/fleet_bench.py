@@ -0,0 +1,60 @@
+# benchmark of the director fleet store: streamed bulk import of vehicles and update
+# manifest lookups, peak memory stays flat whatever the fleet size
+#   python -m bench.fleet_bench [vehicles] [ecus per vehicle]
+import hashlib
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import uptane.repository.fleetstore
+
+IMAGE_VERSIONS = 8
+
+
+def image_hash(version: int) -> str:
+    return hashlib.sha256(f"image-{version}".encode('utf-8')).hexdigest()
+
+
+def gen_ecus(vehicles: int, ecus: int):
+    for vehicle in range(vehicles):
+        vin = f"VIN{vehicle:014d}"
+        for ecu in range(ecus):
+            yield vin, f"ecu{ecu}", image_hash((vehicle + ecu) % IMAGE_VERSIONS)
+
+
+def main():
+    vehicles = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    ecus = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    fleet_db = os.path.join(tempfile.mkdtemp(), "fleet.db")
+    store = uptane.repository.fleetstore.FleetStore(fleet_db)
+
+    store.import_images({"image_name": f"image-{version}", "image_url": f"http://repo/image-{version}",
+                         "image_size": 1 << 20, "image_hash": image_hash(version),
+                         "image_hash_func": "sha256", "image_buf_size": 65536,
+                         "image_sig_algo": "eddsa", "image_version": f"0.0.{version}"}
+                        for version in range(IMAGE_VERSIONS))
+    # every version upgrades to the next, the last one is up to date
+    store.import_upgrades((image_hash(version), image_hash(version + 1))
+                          for version in range(IMAGE_VERSIONS - 1))
+
+    start = time.perf_counter()
+    rows = store.import_ecus(gen_ecus(vehicles, ecus))
+    elapsed = time.perf_counter() - start
+    print(f"imported {rows} ecus of {vehicles} vehicles in {elapsed:.2f} s "
+          f"({rows / elapsed:.0f} rows/s), db {os.path.getsize(fleet_db) >> 20} MiB, "
+          f"peak rss {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss >> 10} MiB")
+
+    lookups = 20000
+    vins = [f"VIN{random.randrange(vehicles):014d}" for _ in range(lookups)]
+    start = time.perf_counter()
+    updates = sum(len(store.get_update_manifest(vin)) for vin in vins)
+    elapsed = time.perf_counter() - start
+    print(f"{lookups} update manifests ({updates} ecus to update) in {elapsed:.2f} s "
+          f"({elapsed / lookups * 1e6:.1f} us per vehicle)")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# benchmark of serial vs parallel hashing of many image files
+#   python -m bench.hash_bench [files] [size in MB] [workers]
+import os
+import sys
+import tempfile
+import time
+import uptane.crypto.hash
+
+BUFSIZE = 65536
+
+
+def make_files(dir_path: str, files: int, size_mb: int) -> list:
+    paths = []
+    block = os.urandom(1024 * 1024)
+    for i in range(files):
+        path = f'{dir_path}/image_{i}'
+        with open(path, "wb") as f:
+            for _ in range(size_mb):
+                f.write(block)
+        paths.append(path)
+    return paths
+
+
+def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    size_mb = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else os.cpu_count()
+    sha256 = uptane.crypto.hash.HashFunc.sha256
+
+    with tempfile.TemporaryDirectory() as dir_path:
+        paths = make_files(dir_path, files, size_mb)
+        total_mb = files * size_mb
+
+        start = time.perf_counter()
+        serial = {path: uptane.crypto.hash.get_file_hash(path, sha256, BUFSIZE) for path in paths}
+        serial_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        threads = uptane.crypto.hash.hash_files(paths, sha256, BUFSIZE, workers)
+        threads_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        processes = uptane.crypto.hash.hash_files(paths, sha256, BUFSIZE, workers, True)
+        processes_time = time.perf_counter() - start
+
+        assert serial == threads == processes
+
+    print(f"{files} files x {size_mb} MB, {workers} workers")
+    print(f"serial:       {serial_time:.2f} s ({total_mb / serial_time:.0f} MB/s)")
+    print(f"thread pool:  {threads_time:.2f} s ({total_mb / threads_time:.0f} MB/s)")
+    print(f"process pool: {processes_time:.2f} s ({total_mb / processes_time:.0f} MB/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+# load test of a running image or director repo, reports requests/sec and latency percentiles
+#   python -m bench.loadtest --url http://127.0.0.1:8082/manifest/ --method POST
+#   python -m bench.loadtest --url http://127.0.0.1:8080/repo/<reponame>/<filename>/
+import argparse
+import concurrent.futures
+import time
+import urllib.error
+import urllib.request
+
+
+def percentile(latencies: list, pct: float) -> float:
+    index = min(int(len(latencies) * pct / 100), len(latencies) - 1)
+    return latencies[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="loadtest")
+    parser.add_argument("--url", required=True, help="url to load test")
+    parser.add_argument("--method", default="GET", choices=["GET", "POST"])
+    parser.add_argument("--concurrency", type=int, default=32, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=2000, help="total requests")
+    args = parser.parse_args()
+
+    def request(_) -> tuple:
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(urllib.request.Request(args.url, method=args.method)) as response:
+                response.read()
+                ok = response.status < 400
+        except (urllib.error.URLError, ConnectionError):
+            ok = False
+        return time.perf_counter() - start, ok
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(request, range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(result[0] * 1000 for result in results)
+    errors = sum(1 for result in results if not result[1])
+    print(f"{args.method} {args.url}")
+    print(f"{args.requests} requests, {args.concurrency} clients, {errors} errors")
+    print(f"throughput: {args.requests / elapsed:.1f} req/s")
+    print(f"latency p50: {percentile(latencies, 50):.1f} ms, p99: {percentile(latencies, 99):.1f} ms, "
+          f"max: {latencies[-1]:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# benchmark of chunked merkle image hashing against whole file hashing, and of how soon a
+# corrupt download is caught
+#   python -m bench.merkle_bench [size in MB]
+import os
+import sys
+import tempfile
+import time
+import uptane.crypto.hash
+import uptane.error.general
+
+CHUNK_SIZE = uptane.crypto.hash.DEFAULT_CHUNK_SIZE
+RECV_SIZE = 16384  # bytes per network read of a simulated download
+
+
+def throughput(func, size_mb: int) -> float:
+    start = time.perf_counter()
+    func()
+    return size_mb / (time.perf_counter() - start)
+
+
+def download(path: str, verifier: uptane.crypto.hash.ChunkVerifier, corrupt_at: int = -1) -> int:
+    '''
+    Feeds the file to the verifier in network sized reads, returns the bytes received
+    '''
+    received = 0
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(RECV_SIZE)
+            if not data:
+                break
+            if received <= corrupt_at < received + len(data):
+                data = bytearray(data)
+                data[corrupt_at - received] ^= 0xff
+            received += len(data)
+            try:
+                verifier.feed(data)
+            except uptane.error.general.FileHashNoMatch:
+                break
+    return received
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    sha256 = uptane.crypto.hash.HashFunc.sha256
+
+    with tempfile.TemporaryDirectory() as dir_path:
+        path = f'{dir_path}/image'
+        with open(path, "wb") as f:
+            for _ in range(size_mb):
+                f.write(os.urandom(1024 * 1024))
+        size = os.path.getsize(path)
+
+        merkle_root, chunk_hashes = uptane.crypto.hash.get_file_merkle(path, sha256, CHUNK_SIZE)
+
+        def new_verifier():
+            return uptane.crypto.hash.ChunkVerifier(merkle_root, chunk_hashes, CHUNK_SIZE, size, sha256)
+
+        print(f"{size_mb} MB image, {CHUNK_SIZE // 1024} KB chunks")
+        print(f"whole file hash:      {throughput(lambda: uptane.crypto.hash.get_file_hash(path, sha256), size_mb):.0f} MB/s")
+        print(f"merkle hash:          {throughput(lambda: uptane.crypto.hash.get_file_merkle(path, sha256, CHUNK_SIZE), size_mb):.0f} MB/s")
+        print(f"streamed chunk check: {throughput(lambda: download(path, new_verifier()), size_mb):.0f} MB/s")
+
+        # a bit flipped 10% into the download
+        corrupt_at = size // 10
+        received = download(path, new_verifier(), corrupt_at)
+        print(f"corruption at {corrupt_at // 1024} KB caught after {received // 1024} KB, "
+              f"whole file hashing needs all {size // 1024} KB")
+
+
+if __name__ == "__main__":
+    main()
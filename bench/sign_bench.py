@@ -0,0 +1,46 @@
+# microbenchmark for signing/verifying metadata with and without the parsed key cache
+#   python -m bench.sign_bench [iterations]
+import sys
+import time
+import tomli
+import uptane.crypto.hash
+import uptane.crypto.sign
+
+ROLE_CFG = "ftest/test_targetscfg.toml"
+
+
+def run(iterations: int, private_key: str, public_key: str) -> float:
+    '''
+    Signs and verifies a small targets dict, returns signatures per second
+    '''
+    signed = {"_type": "targets", "spec_version": "0.0.1", "expires": "0",
+              "image_name": "test_image", "image_size": 47}
+    start = time.perf_counter()
+    for _ in range(iterations):
+        sig = uptane.crypto.sign.sign_metadata(signed, uptane.crypto.hash.HashFunc.sha256, \
+              uptane.crypto.sign.KeyType.ed25519, private_key)
+        uptane.crypto.sign.verify_sig_metadata(signed, uptane.crypto.hash.HashFunc.sha256, \
+              uptane.crypto.sign.KeyType.ed25519, public_key, sig)
+    return iterations / (time.perf_counter() - start)
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    with open(ROLE_CFG, "rb") as f:
+        cfg = tomli.load(f)
+
+    # maxsize 0 evicts every key right away, which is the uncached behaviour
+    uptane.crypto.sign.KEY_CACHE = uptane.crypto.sign.KeyCache(maxsize=0)
+    before = run(iterations, cfg["private_key"], cfg["public_key"])
+
+    uptane.crypto.sign.KEY_CACHE = uptane.crypto.sign.KeyCache()
+    after = run(iterations, cfg["private_key"], cfg["public_key"])
+
+    print(f"uncached: {before:.1f} sign+verify/s")
+    print(f"cached:   {after:.1f} sign+verify/s ({after / before:.2f}x)")
+    print(f"cache stats: {uptane.crypto.sign.KEY_CACHE.stats()}")
+
+
+if __name__ == "__main__":
+    main()
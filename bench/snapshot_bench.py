@@ -0,0 +1,70 @@
+# benchmark of snapshot generation over many targets metadata files: full parse of every
+# file (as the roles did before) against the builder that reads every file once, cold, with
+# unchanged files, and in a new run (empty memory) with the persistent hash cache
+#   python -m bench.snapshot_bench [targets files ...]
+import shutil
+import sys
+import tempfile
+import time
+import tomli
+import uptane.crypto.hash
+import uptane.roles.snapshot
+import uptane.roles.targets
+import uptane.time
+
+ROLE_CFG_DIR = 'ftest'
+
+
+def legacy_targets_entries(targets_metadata_files):
+    '''
+    What the snapshot roles did before, parse every file fully then hash every file again
+    '''
+    targets = {}
+    for targets_metadata_file in targets_metadata_files:
+        with open(targets_metadata_file, "rb") as f:
+            targets[targets_metadata_file] = tomli.load(f)
+    hashes = uptane.crypto.hash.hash_files(targets_metadata_files, \
+        uptane.crypto.hash.HashFunc.sha256, 65536)
+    for targets_metadata_file in targets_metadata_files:
+        uptane.time.fut_is_expired(int(targets[targets_metadata_file]["signed"]["expires"]))
+    return hashes
+
+
+def timed(func) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or [10000, 50000]
+    snapshot_cfg = f'{ROLE_CFG_DIR}/test_snapshotcfg.toml'
+
+    for count in counts:
+        with tempfile.TemporaryDirectory() as dir_path:
+            template = f'{dir_path}/template.targets.toml'
+            uptane.roles.targets.TargetsOffline(f'{ROLE_CFG_DIR}/test_targetscfg.toml', \
+                f'{ROLE_CFG_DIR}/test_imagecfg.toml').gen_signed_metadata_file(template)
+            targets_files = [f'{dir_path}/0.0.1.image{i}.targets.toml' for i in range(count)]
+            for targets_file in targets_files:
+                shutil.copyfile(template, targets_file)
+
+            uptane.roles.snapshot.TARGETS_ENTRIES.clear()
+            legacy = timed(lambda: legacy_targets_entries(targets_files))
+            cold = timed(lambda: uptane.roles.snapshot.SnapshotOffline(snapshot_cfg, targets_files))
+            warm = timed(lambda: uptane.roles.snapshot.SnapshotOffline(snapshot_cfg, targets_files))
+
+            hash_cache = uptane.crypto.hash.enable_hash_cache(f'{dir_path}/hashes.db', 2 * count)
+            uptane.roles.snapshot.TARGETS_ENTRIES.clear()
+            uptane.roles.snapshot.SnapshotOffline(snapshot_cfg, targets_files)
+            uptane.roles.snapshot.TARGETS_ENTRIES.clear()
+            next_run = timed(lambda: uptane.roles.snapshot.SnapshotOffline(snapshot_cfg, targets_files))
+            hash_cache.close()
+            uptane.crypto.hash.HASH_CACHE = None
+
+            print(f"{count} targets files: full parse {legacy:.2f}s, read once {cold:.2f}s, "
+                  f"unchanged files {warm:.2f}s, next run with the hash cache {next_run:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+# benchmark of k of n signature verification: every signature one after the other against
+# verify_threshold_batch, which checks them concurrently and stops at the threshold
+#   python -m bench.threshold_bench [keys]
+import sys
+import time
+from Crypto.PublicKey import ECC
+import uptane.crypto.hash
+import uptane.crypto.sign
+
+ROUNDS = 200
+
+
+def main():
+    keys_count = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    sha256 = uptane.crypto.hash.HashFunc.sha256
+    ed25519 = uptane.crypto.sign.KeyType.ed25519
+
+    keys = [ECC.generate(curve='ed25519') for _ in range(keys_count)]
+    private_keys = [key.export_key(format='PEM') for key in keys]
+    public_keys = [key.public_key().export_key(format='PEM') for key in keys]
+    signed = {"targets": {f"0.0.1.image{i}.targets.toml": {"hash": "0" * 64} for i in range(200)},
+              "expires": "1823860561", "_type": "snapshot"}
+    signatures = list(zip(public_keys, uptane.crypto.sign.sign_metadata_keys(signed, sha256, ed25519,
+                                                                             private_keys)))
+
+    print(f"{keys_count} signatures, {ROUNDS} rounds")
+    for threshold in sorted({1, keys_count // 2, keys_count}):
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            assert sum(uptane.crypto.sign.verify_sig_metadata(signed, sha256, ed25519, pub_key, sig)
+                       for pub_key, sig in signatures) >= threshold
+        serial = (time.perf_counter() - start) / ROUNDS * 1000
+
+        group = uptane.crypto.sign.ThresholdGroup(signed, signatures, threshold)
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            assert uptane.crypto.sign.verify_threshold_batch([group], sha256, ed25519)[0].valid
+        batch = (time.perf_counter() - start) / ROUNDS * 1000
+
+        print(f"threshold {threshold}: all signatures serially {serial:.2f} ms, "
+              f"threshold batch {batch:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
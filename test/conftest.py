@@ -0,0 +1,90 @@
+# fixtures shared by the tests, metadata is generated with the role and image cfgs of ftest/,
+# whose image paths are relative to the repo root
+import os
+import shutil
+import time
+import typing
+import pytest
+import uptane.roles.root
+import uptane.roles.snapshot
+import uptane.roles.targets
+import uptane.roles.timestamp
+import uptane.time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FTEST_DIR = os.path.join(REPO_ROOT, "ftest")
+IMAGE_CFGS = {"test_image": "test_imagecfg.toml", "test_image2": "test_imagecfg2.toml"}
+
+
+def ftest_path(name: str) -> str:
+    return os.path.join(FTEST_DIR, name)
+
+
+class MetadataSet(typing.NamedTuple):
+    '''
+    A directory of offline metadata: targets metadata with their images, snapshot and timestamp
+    '''
+    dir: str
+    snapshot: str
+    timestamp: str
+
+    def targets(self, image_name: str) -> str:
+        return os.path.join(self.dir, f'0.0.1.{image_name}.targets.toml')
+
+
+@pytest.fixture
+def root_metadata(tmp_path, monkeypatch) -> str:
+    '''
+    Root metadata signed with ftest/test_rootcfg.toml
+    '''
+    monkeypatch.chdir(REPO_ROOT)
+    root_path = str(tmp_path / "root.toml")
+    uptane.roles.root.Root(ftest_path("test_rootcfg.toml")).gen_signed_metadata_file(root_path)
+    return root_path
+
+
+@pytest.fixture
+def sign_metadata_set(monkeypatch, root_metadata) -> typing.Callable[..., MetadataSet]:
+    '''
+    Returns a function signing snapshot and timestamp metadata over the targets metadata files
+    of a dir, expiring at now + expires_in seconds
+    '''
+    def sign(out_dir: str, expires_in: int = 3600) -> MetadataSet:
+        targets_files = sorted(os.path.join(out_dir, name) for name in os.listdir(out_dir) \
+                               if name.endswith(".targets.toml"))
+        with monkeypatch.context() as patch:
+            patch.setattr(uptane.time, "get_fut365y_epoch_time", lambda: int(time.time()) + expires_in)
+            snapshot_file = os.path.join(out_dir, "0.0.1.x.snapshot.toml")
+            uptane.roles.snapshot.SnapshotOffline(ftest_path("test_snapshotcfg.toml"), targets_files) \
+                .gen_signed_metadata_file(snapshot_file)
+            timestamp_file = os.path.join(out_dir, "0.0.1.x.timestamp.toml")
+            uptane.roles.timestamp.TimestampOffline(ftest_path("test_timestampcfg.toml"), snapshot_file) \
+                .gen_signed_metadata_file(timestamp_file)
+        return MetadataSet(out_dir, snapshot_file, timestamp_file)
+
+    return sign
+
+
+@pytest.fixture
+def gen_metadata(tmp_path, monkeypatch, sign_metadata_set) -> typing.Callable[..., MetadataSet]:
+    '''
+    Returns a function generating a metadata set in tmp_path/<name>, its metadata expires at
+    now + expires_in seconds (the targets metadata at now + targets_expires_in when given), so
+    sets can be ordered without waiting for the clock
+    '''
+    def gen(name: str, expires_in: int = 3600, targets_expires_in: typing.Optional[int] = None,
+            targets_cfg: str = ftest_path("test_targetscfg.toml"),
+            images: typing.Iterable[str] = tuple(IMAGE_CFGS)) -> MetadataSet:
+        if targets_expires_in is None:
+            targets_expires_in = expires_in
+        out_dir = tmp_path / name
+        out_dir.mkdir()
+        with monkeypatch.context() as patch:
+            patch.setattr(uptane.time, "get_fut365y_epoch_time", lambda: int(time.time()) + targets_expires_in)
+            for image_name in images:
+                shutil.copy(os.path.join(REPO_ROOT, image_name), out_dir)
+                uptane.roles.targets.TargetsOffline(targets_cfg, ftest_path(IMAGE_CFGS[image_name])) \
+                    .gen_signed_metadata_file(str(out_dir / f'0.0.1.{image_name}.targets.toml'))
+        return sign_metadata_set(str(out_dir), expires_in)
+
+    return gen
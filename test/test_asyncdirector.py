@@ -0,0 +1,64 @@
+import asyncio
+import pytest
+import uptane.repository.asyncdirector
+import uptane.repository.fleetstore
+from test.conftest import REPO_ROOT, ftest_path
+from test.test_directorrepo import IMAGES, INSTALLED_HASH
+
+test_utils = pytest.importorskip("aiohttp.test_utils")
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    '''
+    Async director service of one worker and one pending bundle, serving a vehicle VIN1
+    upgraded to image0
+    '''
+    monkeypatch.chdir(REPO_ROOT)
+    store = uptane.repository.fleetstore.FleetStore(str(tmp_path / "fleet.db"))
+    store.import_images(IMAGES)
+    store.import_upgrades([(INSTALLED_HASH, IMAGES[0]["image_hash"])])
+    store.import_ecus([("VIN1", "ecu1", INSTALLED_HASH)])
+    return uptane.repository.asyncdirector.DirectorService(
+        (None, ftest_path("test_timestampcfg.toml"), ftest_path("test_snapshotcfg.toml"),
+         ftest_path("test_targetscfg.toml"), "", store.db_path), workers=1, max_pending=1)
+
+
+def run_client(service, requests):
+    '''
+    Runs the coroutine function requests with a test client of the app of the service
+    '''
+    async def run():
+        async with test_utils.TestClient(test_utils.TestServer(
+                uptane.repository.asyncdirector.create_app(service))) as client:
+            return await requests(client)
+    return asyncio.run(run())
+
+
+def test_manifest_is_rejected_with_retry_after_under_backpressure(service):
+    async def requests(client):
+        # a bundle of another vehicle holds the only slot
+        assert service.try_acquire()
+        busy = await client.post("/manifest/", json={"vin": "VIN1"})
+        busy_status, retry_after = busy.status, busy.headers.get("Retry-After")
+        service.pending -= 1
+
+        served = await client.post("/manifest/", json={"vin": "VIN1"})
+        return busy_status, retry_after, served.status, await served.read()
+
+    busy_status, retry_after, served_status, bundle = run_client(service, requests)
+    assert busy_status == 503
+    assert retry_after == str(uptane.repository.asyncdirector.RETRY_AFTER)
+    assert served_status == 200 and bundle.startswith(b"PK")
+    assert service.stats()["rejected"] == 1 and service.stats()["served"] == 1
+    assert service.stats()["pending"] == 0
+
+
+def test_bad_manifest_releases_its_slot(service):
+    async def requests(client):
+        bad = await client.post("/manifest/", data=b"[]")
+        up_to_date = await client.post("/manifest/", json={"vin": "VIN2"})
+        return bad.status, up_to_date.status
+
+    assert run_client(service, requests) == (400, 204)
+    assert service.stats()["pending"] == 0 and service.stats()["rejected"] == 0
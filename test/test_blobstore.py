@@ -0,0 +1,102 @@
+import hashlib
+import os
+import pytest
+import uptane.error.general
+import uptane.repository.blobstore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = uptane.repository.blobstore.BlobStore(str(tmp_path / "store"))
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def put(store, tmp_path):
+    '''
+    Returns a function putting bytes into the store, returns their hash
+    '''
+    def put_data(data: bytes, new: bool = True) -> str:
+        file_path = tmp_path / "upload"
+        file_path.write_bytes(data)
+        blob_hash = hashlib.sha256(data).hexdigest()
+        assert store.put_file(str(file_path), blob_hash) == new
+        assert not file_path.exists()
+        return blob_hash
+    return put_data
+
+
+def test_put_stores_a_blob_once(store, put):
+    blob_hash = put(b"image")
+    put(b"image", new=False)
+
+    with open(store.blob_path(blob_hash), "rb") as f:
+        assert f.read() == b"image"
+    assert not os.stat(store.blob_path(blob_hash)).st_mode & 0o222
+    assert store.stats() == {"blobs": 1, "blob_bytes": 5, "entries": 0, "published_bytes": 0}
+
+
+def test_put_rejects_a_blob_of_another_hash(store, tmp_path):
+    file_path = tmp_path / "upload"
+    file_path.write_bytes(b"image")
+    blob_hash = hashlib.sha256(b"other").hexdigest()
+
+    with pytest.raises(uptane.error.general.FileHashNoMatch):
+        store.put_file(str(file_path), blob_hash)
+    assert not os.path.exists(store.blob_path(blob_hash))
+    assert store.stats()["blobs"] == 0
+
+
+def test_blobs_are_counted_by_entry_and_collected_without_entries(store, put):
+    old_hash, new_hash = put(b"old image"), put(b"new image")
+    assert store.publish("repo1", {"image": old_hash}) == []
+    assert store.publish("repo2", {"image": old_hash, "copy": old_hash}) == []
+    assert store.stats()["published_bytes"] == 3 * len(b"old image")
+
+    # still referenced by repo2
+    assert store.publish("repo1", {"image": new_hash}) == []
+    assert store.publish("repo2", {"image": new_hash}) == []
+    assert store.publish("repo2", {"copy": new_hash}) == [old_hash]
+    assert store.lookup("repo2", "copy") == new_hash
+
+    # kept for uploads that put it and have not published yet
+    assert store.gc() == (0, 0)
+    assert store.gc(grace=-1) == (1, len(b"old image"))
+    assert not os.path.exists(store.blob_path(old_hash))
+    assert store.stats() == {"blobs": 1, "blob_bytes": len(b"new image"), "entries": 3,
+                             "published_bytes": 3 * len(b"new image")}
+
+
+def test_put_keeps_an_unreferenced_blob_from_gc(store, put, monkeypatch):
+    # released over the grace time ago
+    with monkeypatch.context() as patch:
+        patch.setattr(uptane.repository.blobstore.time, "time", lambda: 1000.0)
+        blob_hash = put(b"image")
+        store.publish("repo", {"image": blob_hash})
+        store.publish("repo", {"image": put(b"other")})
+
+    # the same image uploaded again, not published yet
+    put(b"image", new=False)
+    assert store.gc() == (0, 0)
+    assert os.path.exists(store.blob_path(blob_hash))
+
+
+def test_publish_of_a_missing_blob_publishes_nothing(store, put):
+    blob_hash = put(b"image")
+    with pytest.raises(KeyError):
+        store.publish("repo", {"image": blob_hash, "missing": "0" * 64})
+
+    assert store.lookup("repo", "image") is None
+    assert store.stats()["entries"] == 0
+    assert store.gc(grace=-1) == (1, len(b"image"))
+
+
+def test_materialize_links_the_blob(store, put, tmp_path):
+    blob_hash = put(b"image")
+    dst_path = str(tmp_path / "image")
+
+    assert store.materialize(blob_hash, dst_path) in ("hardlink", "reflink", "copy")
+    assert store.materialize(blob_hash, dst_path) in ("hardlink", "reflink", "copy")
+    with open(dst_path, "rb") as f:
+        assert f.read() == b"image"
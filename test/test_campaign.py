@@ -0,0 +1,108 @@
+import json
+import os
+import pytest
+import tomli
+import uptane.crypto.hash
+import uptane.repository.campaign
+import uptane.repository.fleetstore
+from test.conftest import REPO_ROOT, ftest_path
+from test.test_directorrepo import IMAGES, INSTALLED_HASH
+
+SHA256 = uptane.crypto.hash.HashFunc.sha256
+
+
+@pytest.fixture
+def campaign(tmp_path, monkeypatch):
+    '''
+    Returns a function creating a campaign over a fleet of three vehicles upgraded to image0
+    and one up to date vehicle, signed on one worker into tmp_path/out
+    '''
+    monkeypatch.chdir(REPO_ROOT)
+    store = uptane.repository.fleetstore.FleetStore(str(tmp_path / "fleet.db"))
+    store.import_images(IMAGES)
+    store.import_upgrades([(INSTALLED_HASH, IMAGES[0]["image_hash"])])
+    store.import_ecus([(f"VIN{i}", "ecu1", INSTALLED_HASH) for i in range(3)])
+    store.import_ecus([("VIN3", "ecu1", IMAGES[0]["image_hash"])])
+    store.close()
+    (tmp_path / "campaign.toml").write_text('name = "test"\n')
+
+    def new_campaign() -> uptane.repository.campaign.Campaign:
+        return uptane.repository.campaign.Campaign(
+            str(tmp_path / "campaign.toml"), store.db_path, str(tmp_path / "out"),
+            ftest_path("test_timestampcfg.toml"), ftest_path("test_snapshotcfg.toml"),
+            ftest_path("test_targetscfg.toml"), workers=1, chunk_size=2)
+    return new_campaign
+
+
+def journal_lines(out_dir: str) -> list:
+    with open(os.path.join(out_dir, uptane.repository.campaign.JOURNAL_FILE), 'r') as f:
+        return f.readlines()
+
+
+def test_campaign_signs_every_vehicle(campaign):
+    first = campaign()
+    first.run(progress=None)
+    shared, done = uptane.repository.campaign.load_journal(first.out_dir)
+
+    assert (first.signed, first.up_to_date, first.shared_signed) == (3, 1, 1)
+    assert sorted(done) == ["VIN0", "VIN1", "VIN2", "VIN3"]
+    assert done["VIN3"] == uptane.repository.campaign.VehicleEntry(None, None)
+    metadata = shared[done["VIN0"].digest]
+    snapshot = uptane.repository.campaign.get_object(first.out_dir, metadata.snapshot)
+
+    timestamps = {entry["vin"]: entry["timestamp"] for entry in map(json.loads, journal_lines(first.out_dir))
+                  if entry.get("timestamp")}
+    for vin in ("VIN0", "VIN1", "VIN2"):
+        timestamp = tomli.loads(uptane.repository.campaign.get_object(first.out_dir, timestamps[vin]).decode())
+        assert timestamp["signed"]["vin"] == vin
+        assert timestamp["signed"]["snapshot_metadata_file_hash"] == \
+            uptane.crypto.hash.get_bytes_hash(snapshot, SHA256)
+
+
+def test_interrupted_campaign_resumes_from_the_journal(campaign):
+    first = campaign()
+    first.run(progress=None)
+    lines = journal_lines(first.out_dir)
+    # the run was interrupted while writing the last vehicle
+    vehicle_line = next(line for line in reversed(lines) if '"timestamp"' in line)
+    lines.remove(vehicle_line)
+    with open(os.path.join(first.out_dir, uptane.repository.campaign.JOURNAL_FILE), 'w') as f:
+        f.writelines(lines + [vehicle_line[:len(vehicle_line) // 2]])
+    resumed_vin = json.loads(vehicle_line)["vin"]
+
+    shared, done = uptane.repository.campaign.load_journal(first.out_dir)
+    assert resumed_vin not in done and len(done) == 3 and len(shared) == 1
+
+    resumed = campaign()
+    resumed.run(progress=None)
+    # only the vehicle missing from the journal is signed, with the shared metadata it has
+    assert (resumed.signed, resumed.skipped, resumed.shared_signed, resumed.resigned) == (1, 3, 0, 0)
+    shared, done = uptane.repository.campaign.load_journal(first.out_dir)
+    assert len(done) == 4 and done[resumed_vin].digest in shared
+
+
+def test_campaign_signs_expiring_timestamps_again(campaign):
+    first = campaign()
+    first.run(progress=None)
+    # the timestamps in the journal have expired, the shared metadata has not
+    entries = [json.loads(line) for line in journal_lines(first.out_dir)]
+    with open(os.path.join(first.out_dir, uptane.repository.campaign.JOURNAL_FILE), 'w') as f:
+        for entry in entries:
+            if entry.get("timestamp"):
+                entry["expires"] = 0
+            f.write(json.dumps(entry) + "\n")
+
+    resumed = campaign()
+    resumed.run(progress=None)
+    assert (resumed.signed, resumed.resigned, resumed.skipped, resumed.shared_signed) == (3, 3, 1, 0)
+    _, done = uptane.repository.campaign.load_journal(first.out_dir)
+    assert all(not uptane.repository.campaign.is_expiring(done[vin].expires) for vin in ("VIN0", "VIN1", "VIN2"))
+
+
+@pytest.mark.parametrize("content, kept", [(b'{"a": 1}\n{"b": 2}\n', b'{"a": 1}\n{"b": 2}\n'),
+                                           (b'{"a": 1}\n{"b"', b'{"a": 1}\n'), (b'{"a"', b''),
+                                           (b'{"a": 1}\n' + b'x' * 100000, b'{"a": 1}\n'), (b'', b'')])
+def test_truncate_journal_drops_a_cut_short_line(tmp_path, content, kept):
+    (tmp_path / uptane.repository.campaign.JOURNAL_FILE).write_bytes(content)
+    uptane.repository.campaign.truncate_journal(str(tmp_path))
+    assert (tmp_path / uptane.repository.campaign.JOURNAL_FILE).read_bytes() == kept
@@ -0,0 +1,68 @@
+import json
+import typing
+import pytest
+import uptane.crypto.canonical
+import uptane.crypto.hash
+
+SHA256 = uptane.crypto.hash.HashFunc.sha256
+
+METADATA = [
+    {},
+    {"signed": {"_type": "targets", "expires": "1700000000", "version": 3,
+                "image_name": "test_image", "image_size": 47, "image_hash_func": "sha256"}},
+    {"b": [{"z": 1, "a": [{"y": None, "x": True}]}, [3, {"d": 1.5, "c": False}], "s"],
+     "a": {"nested": {"k2": [], "k1": {}}}, "c": -12},
+    {"ünïcode": "ключ ✓ \"quoted\" \\ \n", "emoji": "\U0001F697", "control": "\x00\x1f"},
+    {"targets": {f"0.0.{i}.image{i}.targets.toml": {"hash": f"{i:064x}"} for i in range(100, 0, -1)}},
+]
+
+
+def sort_metadata_list(metadata: list) -> list:
+    for i in range(len(metadata)):
+        if type(metadata[i]) == type([]):
+            metadata[i] = sort_metadata_list(metadata[i])
+
+        if type(metadata[i]) == type({}):
+            metadata[i] = sort_metadata(metadata[i])
+
+    return metadata
+
+
+def sort_metadata(metadata: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+    '''
+    The recursive sort the signatures were computed over before the canonical encoder
+    '''
+    sorted_metadata = dict(sorted(metadata.items()))
+
+    for key in sorted_metadata:
+        if type(sorted_metadata[key]) == type({}):
+            sorted_metadata[key] = sort_metadata(sorted_metadata[key])
+
+        if type(sorted_metadata[key]) == type([]):
+            sorted_metadata[key] = sort_metadata_list(sorted_metadata[key])
+
+    return sorted_metadata
+
+
+def old_canonical_bytes(metadata: typing.Dict[str, typing.Any]) -> bytes:
+    return bytes(json.dumps(sort_metadata(json.loads(json.dumps(metadata)))), 'utf-8')
+
+
+@pytest.mark.parametrize("metadata", METADATA)
+def test_canonical_bytes_match_the_sorted_json(metadata):
+    assert uptane.crypto.canonical.canonical_bytes(metadata) == old_canonical_bytes(metadata)
+
+
+@pytest.mark.parametrize("metadata", METADATA)
+@pytest.mark.parametrize("stream", [False, True])
+def test_canonical_hash_matches_the_sorted_json(metadata, stream):
+    assert uptane.crypto.canonical.canonical_hash(metadata, SHA256, stream) == \
+        uptane.crypto.hash.get_bytes_hash(old_canonical_bytes(metadata), SHA256)
+
+
+def test_canonical_hash_streams_large_metadata(monkeypatch):
+    # several chunks of the encoding are fed to the hasher
+    monkeypatch.setattr(uptane.crypto.canonical, "STREAM_CHUNK_SIZE", 64)
+    metadata = METADATA[-1]
+    assert uptane.crypto.canonical.canonical_hash(metadata, SHA256, stream=True) == \
+        uptane.crypto.hash.get_bytes_hash(old_canonical_bytes(metadata), SHA256)
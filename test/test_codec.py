@@ -0,0 +1,70 @@
+import pytest
+import uptane.codec
+import uptane.verify
+
+METADATA = {
+    "signed": {"_type": "targets", "expires": "1700000000", "image_size": 47, "image_hash_func": "sha256",
+               "ints": [0, 127, 128, 255, 256, 65535, 65536, 2**32, 2**64 - 1, -1, -32, -33, -129, -2**15 - 1,
+                        -2**31 - 1, -2**63],
+               "float": 1.5, "flags": [True, False], "unicode": "ключ ✓",
+               "str8": "s" * 40, "str16": "s" * 300, "str32": "s" * 70000,
+               "array16": list(range(20)), "map16": {f"k{i}": i for i in range(20)}},
+    "signatures": [{"keyid": "key", "sig": "c2ln"}],
+}
+
+
+@pytest.fixture(params=["native", "pure"])
+def msgpack_impl(request, monkeypatch):
+    '''
+    Runs a test with the msgpack package when it is installed, and with the pure python codec
+    '''
+    if request.param == "native":
+        pytest.importorskip("msgpack")
+    else:
+        monkeypatch.setattr(uptane.codec, "msgpack", None)
+    return request.param
+
+
+def test_msgpack_round_trip(msgpack_impl):
+    data = uptane.codec.MSGPACK_CODEC.dumps(METADATA)
+    assert uptane.codec.MSGPACK_CODEC.loads(data) == METADATA
+
+
+def test_msgpack_wire_format(monkeypatch):
+    monkeypatch.setattr(uptane.codec, "msgpack", None)
+    assert uptane.codec.MSGPACK_CODEC.dumps({"a": [1, -1, None, True, "bc", b"d"]}) == \
+        b"\x81\xa1a\x96\x01\xff\xc0\xc3\xa2bc\xc4\x01d"
+
+
+def test_codec_is_picked_by_extension(tmp_path):
+    for name in ("targets.toml", "targets.msgpack", "targets"):
+        uptane.codec.dump(METADATA, str(tmp_path / name))
+        assert uptane.codec.load(str(tmp_path / name)) == METADATA
+    assert (tmp_path / "targets").read_bytes() == (tmp_path / "targets.toml").read_bytes()
+    assert len((tmp_path / "targets.msgpack").read_bytes()) < len((tmp_path / "targets.toml").read_bytes())
+
+
+@pytest.mark.parametrize("data", [
+    b"",                       # nothing
+    b"\x81\xa1a",              # map cut short
+    b"\xda\x00\x05abc",        # str cut short
+    b"\x81\xa1a\x01\x00",      # trailing bytes
+    b"\x92\x01\x02",           # not a map
+    b"\x81\x01\x02",           # map key is not a string
+    b"\x81\xa1a\xc1",          # unused type
+    b"\x81\xa1a" + b"\x91" * 40 + b"\x00",  # nested too deep
+])
+def test_msgpack_rejects_invalid_metadata(msgpack_impl, data):
+    with pytest.raises(ValueError):
+        uptane.codec.MSGPACK_CODEC.loads(data)
+
+
+def test_signed_metadata_verifies_in_both_codecs(root_metadata, gen_metadata, tmp_path):
+    metadata = gen_metadata("v1")
+    targets_dict = uptane.codec.load(metadata.targets("test_image"))
+    uptane.codec.dump(targets_dict, str(tmp_path / "targets.msgpack"))
+
+    targets_keys = uptane.verify.get_trusted_state(root_metadata).snapshot().targets_keys
+    for toml_dict in (targets_dict, uptane.codec.load(str(tmp_path / "targets.msgpack"))):
+        uptane.verify.check_role_metadata(toml_dict, targets_keys)
+        uptane.verify.verify_signatures([uptane.verify.signature_item(toml_dict, targets_keys)])
@@ -0,0 +1,86 @@
+import os
+import random
+import pytest
+import tomli_w
+import uptane.delta
+import uptane.error.general
+import uptane.roles.targets
+from test.conftest import ftest_path
+
+
+@pytest.fixture
+def images(tmp_path):
+    '''
+    A base image and a new version of it with bytes changed, inserted and removed
+    '''
+    rng = random.Random(0)
+    base = rng.randbytes(1024 * 1024)
+    image = base[:100000] + rng.randbytes(5000) + base[100000:600000] + base[650000:] + b"tail"
+    image = image[:300000] + b"\xff" * 10 + image[300010:]
+    (tmp_path / "base").write_bytes(base)
+    (tmp_path / "image").write_bytes(image)
+    return tmp_path
+
+
+@pytest.fixture
+def targets_signed(images):
+    '''
+    Signed targets metadata of the new image with a delta from version 0.0.1
+    '''
+    with open(images / "imagecfg.toml", "wb") as f:
+        tomli_w.dump({"local_path": str(images / "image"), "_name": "image", "_url": "http://autosec.com/image",
+                      "_version": "0.0.2", "_delta_base_path": str(images / "base"),
+                      "_delta_base_version": "0.0.1"}, f)
+    return uptane.roles.targets.TargetsOffline(ftest_path("test_targetscfg.toml"),
+                                               str(images / "imagecfg.toml")).signed_dict
+
+
+def test_delta_update_round_trip(images, targets_signed):
+    delta = targets_signed["image_deltas"]["0.0.1"]
+    assert delta["delta_url"] == "http://autosec.com/image.0.0.1.delta"
+    assert delta["delta_size"] < os.path.getsize(images / "image") // 10
+
+    uptane.delta.apply_delta_update(targets_signed, "0.0.1", str(images / "base"),
+                                    str(images / "image.0.0.1.delta"), str(images / "out"))
+    assert (images / "out").read_bytes() == (images / "image").read_bytes()
+
+
+@pytest.mark.parametrize("block_size", [64, 2048])
+def test_delta_of_unrelated_images(images, block_size):
+    (images / "other").write_bytes(b"x" * 100 + random.Random(1).randbytes(10000))
+    uptane.delta.gen_delta(str(images / "base"), str(images / "other"), str(images / "delta"), block_size)
+    uptane.delta.apply_delta(str(images / "base"), str(images / "delta"), str(images / "out"))
+    assert (images / "out").read_bytes() == (images / "other").read_bytes()
+
+
+def test_delta_update_rejects_a_modified_delta(images, targets_signed):
+    delta_path = images / "image.0.0.1.delta"
+    delta = bytearray(delta_path.read_bytes())
+    delta[-1] ^= 1
+    delta_path.write_bytes(delta)
+
+    with pytest.raises(uptane.error.general.FileHashNoMatch):
+        uptane.delta.apply_delta_update(targets_signed, "0.0.1", str(images / "base"), str(delta_path),
+                                        str(images / "out"))
+    assert not (images / "out").exists()
+
+
+def test_delta_update_rejects_another_base(images, targets_signed):
+    base = bytearray((images / "base").read_bytes())
+    base[0] ^= 1
+    (images / "base").write_bytes(base)
+
+    with pytest.raises(uptane.error.general.FileHashNoMatch):
+        uptane.delta.apply_delta_update(targets_signed, "0.0.1", str(images / "base"),
+                                        str(images / "image.0.0.1.delta"), str(images / "out"))
+    assert not (images / "out").exists()
+
+
+def test_corrupt_delta_is_rejected(images):
+    uptane.delta.gen_delta(str(images / "base"), str(images / "image"), str(images / "delta"))
+    delta = (images / "delta").read_bytes()
+    (images / "delta").write_bytes(delta[:len(delta) // 2])
+
+    with pytest.raises(ValueError):
+        uptane.delta.apply_delta(str(images / "base"), str(images / "delta"), str(images / "out"))
+    assert not (images / "out").exists()
@@ -0,0 +1,78 @@
+import io
+import zipfile
+import pytest
+import tomli
+import uptane.crypto.hash
+import uptane.repository.directorrepo
+import uptane.repository.fleetstore
+import uptane.repository.metadatacache
+from test.conftest import REPO_ROOT, ftest_path
+
+SHA256 = uptane.crypto.hash.HashFunc.sha256
+INSTALLED_HASH = "0" * 64
+IMAGES = [{"image_name": f"image{i}", "image_url": f"http://autosec.com/repo/temp/image{i}", "image_size": i,
+           "image_hash": uptane.crypto.hash.get_bytes_hash(str(i).encode(), SHA256), "image_hash_func": "sha256",
+           "image_buf_size": 65536, "image_sig_algo": "eddsa", "image_version": f"0.0.{i}"} for i in range(3)]
+
+
+@pytest.fixture
+def director(tmp_path, monkeypatch):
+    '''
+    Director serving a fleet of two vehicles with two ecus, installed images are upgraded
+    to image0, the flask test client is returned
+    '''
+    monkeypatch.chdir(REPO_ROOT)
+    monkeypatch.setattr(uptane.repository.directorrepo, "METADATA_CACHE",
+                        uptane.repository.metadatacache.DirectorMetadataCache())
+    store = uptane.repository.fleetstore.FleetStore(str(tmp_path / "fleet.db"))
+    store.import_images(IMAGES)
+    store.import_upgrades([(INSTALLED_HASH, IMAGES[0]["image_hash"])])
+    store.import_ecus([(vin, ecu_id, INSTALLED_HASH) for vin in ("VIN1", "VIN2") for ecu_id in ("ecu1", "ecu2")])
+    uptane.repository.directorrepo.init_server(None, ftest_path("test_timestampcfg.toml"),
+                                               ftest_path("test_snapshotcfg.toml"),
+                                               ftest_path("test_targetscfg.toml"), "", store.db_path)
+    return uptane.repository.directorrepo.directorrepo.test_client()
+
+
+def bundle_files(response) -> dict:
+    with zipfile.ZipFile(io.BytesIO(response.data)) as zip_file:
+        return {name: zip_file.read(name) for name in zip_file.namelist()}
+
+
+def test_manifest_returns_the_bundle(director):
+    response = director.post("/manifest/", json={"vin": "VIN1"})
+
+    assert response.status_code == 200
+    assert response.mimetype == "application/zip"
+    files = bundle_files(response)
+    bundle_name = next(iter(files)).split("/")[0]
+    assert response.headers["Content-Disposition"] == f'attachment; filename={bundle_name}.zip'
+    assert sorted(name.split("/", 1)[1] for name in files) == \
+        ["0-0-1.12345.snapshot.toml", "0-0-1.12345.timestamp.toml", "0.0.0.image0.targets.toml"]
+
+    snapshot = files[f"{bundle_name}/0-0-1.12345.snapshot.toml"]
+    timestamp = tomli.loads(files[f"{bundle_name}/0-0-1.12345.timestamp.toml"].decode())
+    assert timestamp["signed"]["vin"] == "VIN1"
+    assert timestamp["signed"]["snapshot_metadata_file_hash"] == uptane.crypto.hash.get_bytes_hash(snapshot, SHA256)
+
+
+def test_vehicles_with_one_update_share_targets_and_snapshot(director):
+    files = [bundle_files(director.post("/manifest/", json={"vin": vin})) for vin in ("VIN1", "VIN2")]
+
+    contents = [{name.split("/", 1)[1]: data for name, data in bundle.items()} for bundle in files]
+    assert contents[0]["0-0-1.12345.snapshot.toml"] == contents[1]["0-0-1.12345.snapshot.toml"]
+    assert contents[0]["0-0-1.12345.timestamp.toml"] != contents[1]["0-0-1.12345.timestamp.toml"]
+    assert uptane.repository.directorrepo.METADATA_CACHE.stats()["hits"] == 1
+
+
+def test_manifest_does_not_change_the_fleet_store(director):
+    store = uptane.repository.directorrepo.FLEET_STORE
+    update_manifest = store.get_update_manifest("VIN1")
+    # unsigned, reports an image that was never installed
+    forged = {"vin": "VIN1", "ecu1": {"signed": {"image_hash": IMAGES[1]["image_hash"]}},
+              "ecu2": {"signed": {"image_hash": IMAGES[0]["image_hash"]}}}
+
+    assert director.post("/manifest/", json=forged).status_code == 200
+    assert list(store.ecus_with_image(IMAGES[1]["image_hash"])) == []
+    assert list(store.ecus_with_image(IMAGES[0]["image_hash"])) == []
+    assert store.get_update_manifest("VIN1") == update_manifest
@@ -0,0 +1,64 @@
+import pytest
+import uptane.repository.fleetstore
+from test.test_directorrepo import IMAGES, INSTALLED_HASH
+
+
+@pytest.fixture
+def store(tmp_path):
+    '''
+    Fleet of one vehicle with two ecus, installed images are upgraded to image0
+    '''
+    store = uptane.repository.fleetstore.FleetStore(str(tmp_path / "fleet.db"))
+    store.import_images(IMAGES)
+    store.import_upgrades([(INSTALLED_HASH, IMAGES[0]["image_hash"])])
+    store.import_ecus([("VIN1", "ecu1", INSTALLED_HASH), ("VIN1", "ecu2", INSTALLED_HASH)])
+    yield store
+    store.close()
+
+
+def write_csv(path, rows) -> str:
+    path.write_text("".join(",".join(row) + "\n" for row in rows))
+    return str(path)
+
+
+def test_upgrade_path(store):
+    assert store.get_update_manifest("VIN1") == {"ecu1": IMAGES[0], "ecu2": IMAGES[0]}
+    assert store.get_update_manifest("VIN2") == {}
+
+
+def test_assignment_wins_over_the_upgrade_path(store):
+    store.import_assignments([(IMAGES[2]["image_hash"], "VIN1", "ecu2")])
+    assert store.get_update_manifest("VIN1") == {"ecu1": IMAGES[0], "ecu2": IMAGES[2]}
+
+    # installed, the assignment is cleared and the upgrade path of the new image applies
+    store.set_installed("VIN1", {"ecu2": IMAGES[2]["image_hash"]})
+    assert store.get_update_manifest("VIN1") == {"ecu1": IMAGES[0]}
+
+
+def test_up_to_date_vehicle_gets_an_empty_manifest(store):
+    assert store.set_installed("VIN1", {"ecu1": IMAGES[0]["image_hash"], "ecu2": IMAGES[0]["image_hash"]}) == 2
+    assert store.get_update_manifest("VIN1") == {}
+    # the same state again is not written
+    assert store.set_installed("VIN1", {"ecu1": IMAGES[0]["image_hash"]}) == 0
+
+
+def test_import_csv_takes_columns_in_any_order(store, tmp_path):
+    ecus_csv = write_csv(tmp_path / "ecus.csv", [("installed_hash", "ecu_id", "vin"),
+                                                 (IMAGES[0]["image_hash"], "ecu1", "VIN2")])
+    upgrades_csv = write_csv(tmp_path / "upgrades.csv", [("to_hash", "from_hash"),
+                                                         (IMAGES[1]["image_hash"], IMAGES[0]["image_hash"])])
+
+    assert store.import_csv(ecus_csv=ecus_csv, upgrades_csv=upgrades_csv) == {"ecus": 1, "upgrades": 1}
+    assert store.get_update_manifest("VIN2") == {"ecu1": IMAGES[1]}
+    assert list(store.vins()) == ["VIN1", "VIN2"]
+
+
+def test_import_csv_rejects_a_header_without_a_column(store, tmp_path):
+    ecus_csv = write_csv(tmp_path / "ecus.csv", [("vin", "installed_hash"), ("VIN2", INSTALLED_HASH)])
+    with pytest.raises(ValueError, match="ecu_id"):
+        store.import_csv(ecus_csv=ecus_csv)
+    # a file without a header row
+    ecus_csv = write_csv(tmp_path / "ecus.csv", [("VIN2", "ecu1", INSTALLED_HASH)])
+    with pytest.raises(ValueError, match="misses the columns"):
+        store.import_csv(ecus_csv=ecus_csv)
+    assert list(store.vins()) == ["VIN1"]
@@ -0,0 +1,146 @@
+import hashlib
+import os
+import zipfile
+import pytest
+import uptane.crypto.hash
+import uptane.error.general
+
+SHA256 = uptane.crypto.hash.HashFunc.sha256
+
+
+def make_zip(path, members) -> str:
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        for name, data in members:
+            zip_file.writestr(name, data)
+    return str(path)
+
+
+@pytest.fixture
+def extract(tmp_path, recwarn):
+    '''
+    Extracts a zip archive of (name, data) members into a new dir, duplicate names warn
+    '''
+    def extract_members(members, **kwargs):
+        dest_dir = tmp_path / "out"
+        dest_dir.mkdir()
+        return str(dest_dir), uptane.crypto.hash.extract_zip_hashed(make_zip(tmp_path / "upload.zip", members),
+                                                                    str(dest_dir), SHA256, **kwargs)
+    return extract_members
+
+
+def test_extract_hashes_members(extract):
+    members = [("repo/image", b"image" * 1000), ("repo/sub/metadata.toml", b"metadata"), ("repo/empty/", b"")]
+    dest_dir, hashes = extract(members)
+
+    assert hashes == {os.path.join(dest_dir, name): hashlib.sha256(data).hexdigest()
+                      for name, data in members if not name.endswith("/")}
+    for name, data in members[:2]:
+        with open(os.path.join(dest_dir, name), "rb") as f:
+            assert f.read() == data
+    assert os.path.isdir(os.path.join(dest_dir, "repo/empty"))
+
+
+@pytest.mark.parametrize("names", [("repo/image", "repo/image"), ("repo/image", "repo/./image")])
+def test_extract_rejects_duplicate_members(extract, names):
+    with pytest.raises(ValueError, match="twice"):
+        extract([(names[0], b"first"), (names[1], b"second")])
+
+
+@pytest.mark.parametrize("names", [("repo/image", "repo/image/file"), ("repo/image/", "repo/image")])
+def test_extract_rejects_file_and_dir_conflicts(extract, names):
+    with pytest.raises(ValueError, match="both a file and a dir"):
+        extract([(names[0], b""), (names[1], b"data")])
+
+
+def test_extract_rejects_members_outside_of_the_dir(extract):
+    with pytest.raises(ValueError, match="outside"):
+        extract([("../image", b"data")])
+
+
+def test_extract_rejects_archives_over_max_size(extract):
+    with pytest.raises(uptane.error.general.FileSizeLimitExceeded):
+        extract([("repo/a", b"a" * 100), ("repo/b", b"b" * 100)], max_size=150)
+
+
+def test_extract_does_not_overwrite_files(tmp_path):
+    dest_dir = tmp_path / "out"
+    (dest_dir / "repo").mkdir(parents=True)
+    (dest_dir / "repo" / "image").write_bytes(b"existing")
+
+    with pytest.raises(FileExistsError):
+        uptane.crypto.hash.extract_zip_hashed(make_zip(tmp_path / "upload.zip", [("repo/image", b"new")]),
+                                              str(dest_dir), SHA256)
+    assert (dest_dir / "repo" / "image").read_bytes() == b"existing"
+
+
+@pytest.fixture
+def chunked_image(tmp_path):
+    '''
+    An image of 10 chunks of 1000 bytes, the last one short, with its merkle root and chunk hashes
+    '''
+    image_path = tmp_path / "image"
+    image_path.write_bytes(os.urandom(9500))
+    merkle_root, chunk_hashes = uptane.crypto.hash.get_file_merkle(str(image_path), SHA256, 1000)
+    return image_path, merkle_root, chunk_hashes
+
+
+def chunk_verifier(chunked_image):
+    image_path, merkle_root, chunk_hashes = chunked_image
+    return uptane.crypto.hash.ChunkVerifier(merkle_root, chunk_hashes, 1000, image_path.stat().st_size, SHA256)
+
+
+def test_chunk_verifier_accepts_the_image(chunked_image):
+    data = chunked_image[0].read_bytes()
+    verifier = chunk_verifier(chunked_image)
+
+    verified = b""
+    for start in range(0, len(data), 777):
+        verified += verifier.feed(data[start:start + 777])
+        # only whole chunks are handed out
+        assert len(verified) == verifier.verified_size
+    assert verifier.finished()
+    assert verified == data
+
+
+def test_chunk_verifier_rejects_a_corrupt_chunk(chunked_image):
+    data = bytearray(chunked_image[0].read_bytes())
+    data[2500] ^= 1
+    verifier = chunk_verifier(chunked_image)
+
+    assert len(verifier.feed(bytes(data[:2000]))) == 2000
+    with pytest.raises(uptane.error.general.FileHashNoMatch):
+        verifier.feed(bytes(data[2000:]))
+    assert verifier.verified_size == 2000 and not verifier.finished()
+
+
+def test_chunk_verifier_rejects_extra_data(chunked_image):
+    verifier = chunk_verifier(chunked_image)
+    with pytest.raises(uptane.error.general.FileHashNoMatch):
+        verifier.feed(chunked_image[0].read_bytes() + b"x")
+
+
+def test_chunk_verifier_rejects_chunk_hashes_of_another_root(chunked_image):
+    image_path, merkle_root, chunk_hashes = chunked_image
+    chunk_hashes = list(chunk_hashes)
+    chunk_hashes[3] = uptane.crypto.hash.get_chunk_hash(b"other", SHA256)
+    with pytest.raises(uptane.error.general.FileHashNoMatch):
+        uptane.crypto.hash.ChunkVerifier(merkle_root, chunk_hashes, 1000, image_path.stat().st_size, SHA256)
+    # the root passed off as the hash of one chunk of the whole image, leaves and nodes differ
+    verifier = uptane.crypto.hash.ChunkVerifier(merkle_root, [merkle_root], 9500, 9500, SHA256)
+    with pytest.raises(uptane.error.general.FileHashNoMatch):
+        verifier.feed(image_path.read_bytes())
+
+
+def test_chunk_verifier_resumes_after_the_last_good_chunk(chunked_image, tmp_path):
+    data = chunked_image[0].read_bytes()
+    part_path = tmp_path / "image.part"
+    # 3 good chunks, then half a chunk of garbage
+    part_path.write_bytes(data[:3000] + b"\x00" * 500)
+    verifier = chunk_verifier(chunked_image)
+
+    assert verifier.resume(str(part_path)) == 3000
+    assert part_path.read_bytes() == data[:3000]
+    with open(part_path, "ab") as f:
+        f.write(verifier.feed(data[3000:]))
+    assert verifier.finished()
+    assert part_path.read_bytes() == data
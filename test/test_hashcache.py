@@ -0,0 +1,105 @@
+import os
+import sqlite3
+import subprocess
+import sys
+import pytest
+import uptane.crypto.hash
+import uptane.crypto.hashcache
+from test.conftest import REPO_ROOT
+
+SHA256 = uptane.crypto.hash.HashFunc.sha256
+
+
+@pytest.fixture
+def hash_cache(tmp_path, monkeypatch):
+    cache = uptane.crypto.hashcache.HashCache(str(tmp_path / "hashes.db"), max_entries=3)
+    monkeypatch.setattr(uptane.crypto.hash, "HASH_CACHE", cache)
+    yield cache
+    cache.close()
+
+
+def write_files(tmp_path, count: int):
+    file_paths = []
+    for i in range(count):
+        file_paths.append(str(tmp_path / f"file{i}"))
+        with open(file_paths[-1], "wb") as f:
+            f.write(str(i).encode())
+    return file_paths
+
+
+def cached_paths(db_path: str):
+    with sqlite3.connect(db_path) as conn:
+        return {row[0] for row in conn.execute("SELECT path FROM hashes")}
+
+
+def test_unchanged_files_are_not_read_again(hash_cache, tmp_path):
+    file_path = write_files(tmp_path, 1)[0]
+    digest = uptane.crypto.hash.get_file_hash(file_path, SHA256)
+    assert uptane.crypto.hash.get_file_hash(file_path, SHA256) == digest
+    assert (hash_cache.hits, hash_cache.misses) == (1, 1)
+
+
+def test_modified_file_is_hashed_again(hash_cache, tmp_path):
+    file_path = write_files(tmp_path, 1)[0]
+    uptane.crypto.hash.get_file_hash(file_path, SHA256)
+    stat = os.stat(file_path)
+    # same size, the mtime alone tells the file apart
+    with open(file_path, "wb") as f:
+        f.write(b"x")
+    os.utime(file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+
+    assert uptane.crypto.hash.get_file_hash(file_path, SHA256) == \
+        uptane.crypto.hash.get_bytes_hash(b"x", SHA256)
+    assert (hash_cache.hits, hash_cache.misses) == (0, 2)
+
+
+def test_replaced_file_is_hashed_again(hash_cache, tmp_path):
+    file_path, other_path = write_files(tmp_path, 2)
+    uptane.crypto.hash.get_file_hash(file_path, SHA256)
+    stat = os.stat(file_path)
+    # another inode with the same size and times
+    with open(other_path, "wb") as f:
+        f.write(b"y")
+    os.utime(other_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    os.replace(other_path, file_path)
+
+    assert uptane.crypto.hash.get_file_hash(file_path, SHA256) == \
+        uptane.crypto.hash.get_bytes_hash(b"y", SHA256)
+    assert hash_cache.hits == 0
+
+
+def test_close_evicts_least_recently_used_entries(hash_cache, tmp_path):
+    file_paths = write_files(tmp_path, 5)
+    for file_path in file_paths:
+        uptane.crypto.hash.get_file_hash(file_path, SHA256)
+    # a hit makes the oldest entry the most recently used one
+    uptane.crypto.hash.get_file_hash(file_paths[0], SHA256)
+    hash_cache.close()
+
+    assert cached_paths(hash_cache.db_path) == {os.path.realpath(file_paths[i]) for i in (0, 3, 4)}
+
+
+def test_open_evicts_above_max_entries(tmp_path):
+    db_path = str(tmp_path / "hashes.db")
+    cache = uptane.crypto.hashcache.HashCache(db_path, max_entries=10)
+    for file_path in write_files(tmp_path, 5):
+        cache.put(file_path, os.stat(file_path), SHA256.name, "digest")
+    cache.close()
+
+    uptane.crypto.hashcache.HashCache(db_path, max_entries=2)
+    assert len(cached_paths(db_path)) == 2
+
+
+def test_enabled_cache_is_bounded_at_exit(tmp_path):
+    '''
+    The cli enables the cache and exits without closing it
+    '''
+    db_path = str(tmp_path / "hashes.db")
+    file_paths = write_files(tmp_path, 5)
+    subprocess.run([sys.executable, "-c", "import sys, uptane.crypto.hash\n"
+                    "uptane.crypto.hash.enable_hash_cache(sys.argv[1], max_entries=2)\n"
+                    "for file_path in sys.argv[2:]:\n"
+                    "    uptane.crypto.hash.get_file_hash(file_path, uptane.crypto.hash.HashFunc.sha256)\n",
+                    db_path] + file_paths, cwd=REPO_ROOT, check=True)
+
+    assert cached_paths(db_path) == {os.path.realpath(file_path) for file_path in file_paths[3:]}
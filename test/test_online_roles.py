@@ -0,0 +1,87 @@
+import concurrent.futures
+import threading
+import time
+import pytest
+import tomli
+import uptane.crypto.hash
+import uptane.error.general
+import uptane.roles.snapshot
+import uptane.roles.targets
+import uptane.roles.timestamp
+import uptane.verify
+from test.conftest import ftest_path
+
+VEHICLES = 200
+
+
+@pytest.fixture
+def timestamp():
+    return uptane.roles.timestamp.TimestampOnline(ftest_path("test_timestampcfg.toml"))
+
+
+def test_timestamp_takes_the_snapshot_expiry_of_the_caller(timestamp):
+    # the snapshot is only hashed, not parsed
+    snapshot_metadata = b"\x00 not toml"
+    timestamp_dict = tomli.loads(timestamp.sign_signed_dict(
+        timestamp.build_signed_dict(snapshot_metadata, "VIN1", int(time.time()) + 3600)).decode())
+
+    assert timestamp_dict["signed"]["vin"] == "VIN1"
+    assert timestamp_dict["signed"]["snapshot_metadata_file_hash"] == \
+        uptane.crypto.hash.get_bytes_hash(snapshot_metadata, uptane.crypto.hash.HashFunc.sha256)
+
+
+def test_timestamp_rejects_an_expired_snapshot(timestamp):
+    with pytest.raises(uptane.error.general.MetadataFileHasExpired):
+        timestamp.build_signed_dict(b"snapshot", "VIN1", int(time.time()) - 1)
+
+
+def image_cfg(i: int):
+    return {"image_name": f"image{i}", "image_url": f"http://autosec.com/repo/temp/image{i}",
+            "image_version": f"0.0.{i}", "image_size": i,
+            "image_hash": uptane.crypto.hash.get_bytes_hash(str(i).encode(), uptane.crypto.hash.HashFunc.sha256)}
+
+
+def test_concurrent_signing(root_metadata, timestamp):
+    '''
+    One object per online role signs the metadata of many vehicles from many threads, like
+    the director does, every vehicle must get metadata of its own update that verifies
+    '''
+    targets = uptane.roles.targets.TargetsOnline(ftest_path("test_targetscfg.toml"))
+    snapshot = uptane.roles.snapshot.SnapshotOnline(ftest_path("test_snapshotcfg.toml"))
+    barrier = threading.Barrier(8)
+
+    def sign_vehicle(i: int):
+        if i < 8:
+            # the first tasks start together
+            barrier.wait()
+        targets_name = f"0.0.{i}.image{i}.targets.toml"
+        targets_metadata = targets.sign_signed_dict(targets.build_signed_dict(image_cfg(i)))
+        snapshot_signed_dict = snapshot.build_signed_dict({targets_name: targets_metadata})
+        snapshot_metadata = snapshot.sign_signed_dict(snapshot_signed_dict)
+        timestamp_metadata = timestamp.sign_signed_dict(timestamp.build_signed_dict(
+            snapshot_metadata, f"VIN{i}", int(snapshot_signed_dict["expires"])))
+        return targets_name, targets_metadata, snapshot_metadata, timestamp_metadata
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        bundles = list(executor.map(sign_vehicle, range(VEHICLES)))
+
+    root_state = uptane.verify.get_trusted_state(root_metadata).snapshot()
+    groups = []
+    for i, (targets_name, targets_metadata, snapshot_metadata, timestamp_metadata) in enumerate(bundles):
+        targets_dict = tomli.loads(targets_metadata.decode())
+        snapshot_dict = tomli.loads(snapshot_metadata.decode())
+        timestamp_dict = tomli.loads(timestamp_metadata.decode())
+
+        assert {key: targets_dict["signed"][key] for key in image_cfg(i)} == image_cfg(i)
+        assert snapshot_dict["signed"]["targets"] == {targets_name: {"hash": uptane.crypto.hash.get_bytes_hash(
+            targets_metadata, uptane.crypto.hash.HashFunc.sha256)}}
+        assert timestamp_dict["signed"]["vin"] == f"VIN{i}"
+        assert timestamp_dict["signed"]["snapshot_metadata_file_hash"] == \
+            uptane.crypto.hash.get_bytes_hash(snapshot_metadata, uptane.crypto.hash.HashFunc.sha256)
+
+        for toml_dict, keys in ((targets_dict, root_state.targets_keys), (snapshot_dict, root_state.snapshot_keys),
+                                (timestamp_dict, root_state.timestamp_keys)):
+            uptane.verify.check_role_metadata(toml_dict, keys)
+            groups.append(uptane.verify.signature_item(toml_dict, keys))
+
+    uptane.verify.verify_signatures(groups)
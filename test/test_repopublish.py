@@ -0,0 +1,139 @@
+import hashlib
+import os
+import threading
+import pytest
+import uptane.error.general
+import uptane.repository.blobstore
+import uptane.repository.repopublish
+
+
+@pytest.fixture
+def publisher(tmp_path):
+    repo_root = tmp_path / "image_repo"
+    repo_root.mkdir()
+    blob_store = uptane.repository.blobstore.BlobStore(str(tmp_path / "blobs"))
+    return uptane.repository.repopublish.RepoPublisher(str(repo_root), blob_store)
+
+
+def publish(publisher, files, timestamp_expires, snapshot_expires, file_hashes=None):
+    '''
+    Stages files (name -> data) like an extracted upload and publishes them to repo "temp"
+    '''
+    staging_dir = publisher.staging_dir()
+    file_paths = {}
+    for name in files:
+        file_paths[name] = os.path.join(staging_dir, f'{threading.get_ident()}.{name}')
+        with open(file_paths[name], "wb") as f:
+            f.write(files[name])
+    if file_hashes is None:
+        file_hashes = {name: hashlib.sha256(files[name]).hexdigest() for name in files}
+    return publisher.publish("temp", file_paths, file_hashes, timestamp_expires, snapshot_expires)
+
+
+def read_repo(publisher):
+    '''
+    Reads every file of the published repo through one resolution of the repo symlink, like
+    a reader that started before a swap
+    '''
+    version_dir = os.path.realpath(os.path.join(publisher.repo_root, "temp"))
+    files = {}
+    for name in os.listdir(version_dir):
+        with open(os.path.join(version_dir, name), "rb") as f:
+            files[name] = f.read()
+    return files
+
+
+def test_publish_carries_files_over(publisher):
+    publish(publisher, {"image": b"v1", "timestamp.toml": b"t1"}, 100, 100)
+    version = publish(publisher, {"timestamp.toml": b"t2"}, 200, 100)
+
+    assert version == uptane.repository.repopublish.RepoVersion(2, 200, 100)
+    assert publisher.current("temp") == version
+    assert read_repo(publisher) == {"image": b"v1", "timestamp.toml": b"t2"}
+
+
+@pytest.mark.parametrize("timestamp_expires, snapshot_expires", [(100, 100), (50, 100), (200, 50)])
+def test_publish_rejects_rollback(publisher, timestamp_expires, snapshot_expires):
+    publish(publisher, {"image": b"v1"}, 100, 100)
+
+    with pytest.raises(uptane.error.general.MetadataRollback):
+        publish(publisher, {"image": b"old"}, timestamp_expires, snapshot_expires)
+    assert publisher.current("temp").version == 1
+    assert read_repo(publisher) == {"image": b"v1"}
+
+
+def test_rollback_check_spans_publishers(publisher):
+    publish(publisher, {"image": b"v1"}, 100, 100)
+    # another worker process, its index is loaded from the version info on disk
+    other = uptane.repository.repopublish.RepoPublisher(publisher.repo_root, publisher.blob_store)
+
+    with pytest.raises(uptane.error.general.MetadataRollback):
+        publish(other, {"image": b"old"}, 50, 100)
+    publish(other, {"image": b"v2"}, 200, 100)
+    with pytest.raises(uptane.error.general.MetadataRollback):
+        publish(publisher, {"image": b"v1 again"}, 150, 100)
+
+
+def test_failed_publish_leaves_the_repo_unchanged(publisher):
+    publish(publisher, {"image": b"v1", "metadata": b"m1"}, 100, 100)
+
+    with pytest.raises(uptane.error.general.FileHashNoMatch):
+        publish(publisher, {"image": b"v2", "metadata": b"m2"}, 200, 200,
+                {"image": hashlib.sha256(b"v2").hexdigest(), "metadata": hashlib.sha256(b"other").hexdigest()})
+    assert publisher.current("temp").version == 1
+    assert read_repo(publisher) == {"image": b"v1", "metadata": b"m1"}
+
+    # the failed upload did not count as published
+    publish(publisher, {"image": b"v2", "metadata": b"m2"}, 200, 200)
+    assert read_repo(publisher) == {"image": b"v2", "metadata": b"m2"}
+
+
+def test_readers_never_see_a_mix_of_versions(publisher):
+    publish(publisher, {"image": b"0", "metadata": b"0"}, 1, 1)
+    done = threading.Event()
+    mixed = []
+
+    def reader():
+        while not done.is_set():
+            files = read_repo(publisher)
+            if files["image"] != files["metadata"]:
+                mixed.append(files)
+
+    readers = [threading.Thread(target=reader) for _ in range(4)]
+    for thread in readers:
+        thread.start()
+    try:
+        for version in range(2, 40):
+            data = str(version).encode()
+            publish(publisher, {"image": data, "metadata": data}, version, version)
+    finally:
+        done.set()
+        for thread in readers:
+            thread.join()
+
+    assert mixed == []
+    assert read_repo(publisher) == {"image": b"39", "metadata": b"39"}
+
+
+def test_concurrent_publishes_are_serialized(publisher):
+    publish(publisher, {"image": b"0"}, 1, 1)
+    errors = []
+
+    def publisher_thread(first):
+        for expires in range(first, 60, 4):
+            try:
+                publish(publisher, {"image": str(expires).encode()}, expires, expires)
+            except uptane.error.general.MetadataRollback:
+                errors.append(expires)
+
+    threads = [threading.Thread(target=publisher_thread, args=(first,)) for first in range(2, 6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    current = publisher.current("temp")
+    # every publish got its own version, rolled back ones got none
+    assert current.version == 1 + len(range(2, 60)) - len(errors)
+    assert read_repo(publisher) == {"image": str(current.timestamp_expires).encode()}
+    assert current.timestamp_expires == 59
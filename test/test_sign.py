@@ -0,0 +1,73 @@
+import base64
+import hashlib
+from Crypto.PublicKey import ECC
+from Crypto.Signature import eddsa
+import pytest
+import uptane.crypto.hash
+import uptane.crypto.sign
+from test.test_canonical import old_canonical_bytes
+
+SHA256 = uptane.crypto.hash.HashFunc.sha256
+ED25519 = uptane.crypto.sign.KeyType.ed25519
+METADATA = {"signed": {"_type": "targets", "image_name": "test_image", "image_size": 47}}
+
+
+@pytest.fixture
+def key_pair():
+    key = ECC.generate(curve='ed25519')
+    return key.export_key(format='PEM'), key.public_key().export_key(format='PEM')
+
+
+@pytest.fixture
+def key_cache(monkeypatch):
+    cache = uptane.crypto.sign.KeyCache(maxsize=2)
+    monkeypatch.setattr(uptane.crypto.sign, "KEY_CACHE", cache)
+    return cache
+
+
+def test_keys_are_parsed_once(key_cache, key_pair):
+    private_key, public_key = key_pair
+    for _ in range(3):
+        signature = uptane.crypto.sign.sign_metadata(METADATA, SHA256, ED25519, private_key)
+        assert uptane.crypto.sign.verify_sig_metadata(METADATA, SHA256, ED25519, public_key, signature)
+
+    assert key_cache.stats() == {"hits": 4, "misses": 2, "size": 2, "maxsize": 2}
+
+
+def test_key_cache_evicts_the_least_recently_used_key(key_cache):
+    keys = [ECC.generate(curve='ed25519').export_key(format='PEM') for _ in range(3)]
+    key_cache.get(keys[0])
+    key_cache.get(keys[1])
+    key_cache.get(keys[0])
+    key_cache.get(keys[2])
+
+    key_cache.get(keys[0])
+    assert key_cache.stats()["hits"] == 2
+    key_cache.get(keys[1])
+    assert key_cache.stats() == {"hits": 2, "misses": 4, "size": 2, "maxsize": 2}
+
+
+def test_signatures_of_the_sorted_json_verify(key_cache, key_pair):
+    private_key, public_key = key_pair
+    # signed like before the key cache and the canonical encoder
+    hashed_payload = hashlib.sha256(old_canonical_bytes(METADATA)).hexdigest()
+    signature = base64.b64encode(eddsa.new(ECC.import_key(private_key), 'rfc8032')
+                                 .sign(bytes(hashed_payload, 'utf-8'))).decode('utf-8')
+
+    assert uptane.crypto.sign.sign_metadata(METADATA, SHA256, ED25519, private_key) == signature
+    assert uptane.crypto.sign.verify_sig_metadata(METADATA, SHA256, ED25519, public_key, signature)
+    assert not uptane.crypto.sign.verify_sig_metadata(dict(METADATA, extra=1), SHA256, ED25519, public_key,
+                                                      signature)
+
+
+@pytest.mark.parametrize("bad_key", ["not a pem key", b"\x00", None])
+def test_threshold_batch_reports_bad_keys_per_group(key_cache, key_pair, bad_key):
+    private_key, public_key = key_pair
+    signature = uptane.crypto.sign.sign_metadata(METADATA, SHA256, ED25519, private_key)
+    groups = [uptane.crypto.sign.ThresholdGroup(METADATA, [(bad_key, signature)], 1),
+              uptane.crypto.sign.ThresholdGroup(METADATA, [(bad_key, signature), (public_key, signature)], 1),
+              uptane.crypto.sign.ThresholdGroup(METADATA, [(bad_key, signature), (public_key, signature)], 2)]
+
+    results = uptane.crypto.sign.verify_threshold_batch(groups, SHA256, ED25519)
+    assert [result.valid for result in results] == [False, True, False]
+    assert results[0].error is not None
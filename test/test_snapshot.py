@@ -0,0 +1,85 @@
+import concurrent.futures
+import os
+import shutil
+import pytest
+import uptane.crypto.hash
+import uptane.crypto.hashcache
+import uptane.roles.snapshot
+from test.conftest import ftest_path
+
+
+@pytest.fixture
+def targets_files(gen_metadata, monkeypatch):
+    '''
+    Paths of signed targets metadata files, relative to the cwd, with no entries read before
+    '''
+    metadata_set = gen_metadata("repo")
+    monkeypatch.setattr(uptane.roles.snapshot, "TARGETS_ENTRIES", type(uptane.roles.snapshot.TARGETS_ENTRIES)())
+    monkeypatch.chdir(metadata_set.dir)
+    return sorted(os.path.basename(metadata_set.targets(name)) for name in ("test_image", "test_image2"))
+
+
+@pytest.fixture
+def hash_cache(tmp_path, monkeypatch):
+    cache = uptane.crypto.hashcache.HashCache(str(tmp_path / "hashes.db"))
+    monkeypatch.setattr(uptane.crypto.hash, "HASH_CACHE", cache)
+    yield cache
+    cache.close()
+
+
+def file_hash(path: str) -> str:
+    return uptane.crypto.hash.get_file_hash(path, uptane.crypto.hash.HashFunc.sha256)
+
+
+def fail_to_read(path: str):
+    raise AssertionError(f'{path} read again')
+
+
+def test_online_snapshot_keys_targets_by_the_given_path(targets_files):
+    snapshot = uptane.roles.snapshot.SnapshotOnline(ftest_path("test_snapshotcfg.toml"))
+    paths = [os.path.join(".", name) for name in targets_files]
+    snapshot.snapshotonline_reinit(paths)
+
+    assert snapshot.signed_dict["targets"] == {path: {"hash": file_hash(path)} for path in paths}
+
+
+def test_offline_snapshot_keys_targets_by_file_name(targets_files):
+    paths = [os.path.join(".", name) for name in targets_files]
+    snapshot = uptane.roles.snapshot.SnapshotOffline(ftest_path("test_snapshotcfg.toml"), paths)
+
+    assert snapshot.signed_dict["targets"] == {name: {"hash": file_hash(name)} for name in targets_files}
+
+
+def test_entries_of_unchanged_files_persist_in_the_hash_cache(targets_files, hash_cache, monkeypatch):
+    entries = uptane.roles.snapshot.build_targets_entries(targets_files)
+
+    # a new run: nothing in memory, only the hash cache
+    uptane.roles.snapshot.TARGETS_ENTRIES.clear()
+    monkeypatch.setattr(uptane.roles.snapshot, "read_targets_entry", fail_to_read)
+    assert uptane.roles.snapshot.build_targets_entries(targets_files) == entries
+
+
+def test_changed_files_are_read_again(targets_files, hash_cache, tmp_path):
+    entries = uptane.roles.snapshot.build_targets_entries(targets_files)
+    # replaced by the other file, same size and mtime
+    shutil.copy2(targets_files[1], tmp_path / "other")
+    os.replace(tmp_path / "other", targets_files[0])
+    uptane.roles.snapshot.TARGETS_ENTRIES.clear()
+
+    new_entries = uptane.roles.snapshot.build_targets_entries(targets_files)
+    assert new_entries[targets_files[0]] == entries[targets_files[1]]
+    assert new_entries[targets_files[1]] == entries[targets_files[1]]
+
+
+def test_only_the_offline_snapshot_reads_on_a_process_pool(targets_files, monkeypatch):
+    monkeypatch.setattr(uptane.roles.snapshot, "PROCESS_POOL_MIN_FILES", 2)
+    offline = uptane.roles.snapshot.SnapshotOffline(ftest_path("test_snapshotcfg.toml"), targets_files)
+
+    def no_fork(*args, **kwargs):
+        raise AssertionError("process pool in the online snapshot")
+
+    uptane.roles.snapshot.TARGETS_ENTRIES.clear()
+    monkeypatch.setattr(concurrent.futures, "ProcessPoolExecutor", no_fork)
+    online = uptane.roles.snapshot.SnapshotOnline(ftest_path("test_snapshotcfg.toml"))
+    online.snapshotonline_reinit(targets_files)
+    assert online.signed_dict["targets"] == offline.signed_dict["targets"]
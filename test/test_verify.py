@@ -0,0 +1,305 @@
+import json
+import os
+import shutil
+import threading
+import time
+import pytest
+import tomli
+import tomli_w
+from Crypto.PublicKey import ECC
+import uptane.crypto.hash
+import uptane.error.general
+import uptane.roles.root
+import uptane.roles.targets
+import uptane.time
+import uptane.verify
+from test.conftest import REPO_ROOT, ftest_path
+
+
+def test_verification(root_metadata, gen_metadata):
+    metadata = gen_metadata("v1")
+    uptane.verify.Verification(root_metadata, metadata.dir, metadata.snapshot, metadata.timestamp).verify()
+
+
+def test_verification_rejects_modified_image(root_metadata, gen_metadata):
+    metadata = gen_metadata("v1")
+    with open(os.path.join(metadata.dir, "test_image"), "ab") as f:
+        f.write(b"x")
+    with pytest.raises(uptane.error.general.FileHashNoMatch):
+        uptane.verify.Verification(root_metadata, metadata.dir, metadata.snapshot, metadata.timestamp).verify()
+
+
+def test_verification_rejects_two_targets_files_of_one_image(root_metadata, gen_metadata, sign_metadata_set):
+    metadata = gen_metadata("v1")
+    uptane.roles.targets.TargetsOffline(ftest_path("test_targetscfg.toml"), ftest_path("test_imagecfg.toml")) \
+        .gen_signed_metadata_file(os.path.join(metadata.dir, "0.0.1.copy.targets.toml"))
+    metadata = sign_metadata_set(metadata.dir)
+
+    with pytest.raises(uptane.error.general.DuplicateImageName):
+        uptane.verify.Verification(root_metadata, metadata.dir, metadata.snapshot, metadata.timestamp).verify()
+
+
+@pytest.fixture
+def threshold_repo(tmp_path, monkeypatch):
+    '''
+    Root trusting three targets keys with a threshold of two, and the cfgs of a targets
+    role signing with all three keys or with one of them
+    '''
+    monkeypatch.chdir(REPO_ROOT)
+    keys = [ECC.generate(curve='ed25519') for _ in range(3)]
+    private_keys = [key.export_key(format='PEM') for key in keys]
+    public_keys = [key.public_key().export_key(format='PEM') for key in keys]
+
+    with open(ftest_path("test_rootcfg.toml"), "rb") as f:
+        root_cfg = tomli.load(f)
+    root_cfg["targets"] = {"key_type": "ed25519", "public_key": public_keys[0],
+                           "public_keys": public_keys[1:], "threshold": 2}
+    with open(tmp_path / "rootcfg.toml", "wb") as f:
+        tomli_w.dump(root_cfg, f)
+    uptane.roles.root.Root(str(tmp_path / "rootcfg.toml")).gen_signed_metadata_file(str(tmp_path / "root.toml"))
+
+    with open(ftest_path("test_targetscfg.toml"), "rb") as f:
+        targets_cfg = tomli.load(f)
+    with open(tmp_path / "targets3.toml", "wb") as f:
+        tomli_w.dump(dict(targets_cfg, private_key=private_keys[0], public_key=public_keys[0],
+                          private_keys=private_keys[1:], public_keys=public_keys[1:]), f)
+    with open(tmp_path / "targets1.toml", "wb") as f:
+        tomli_w.dump(dict(targets_cfg, private_key=private_keys[0], public_key=public_keys[0]), f)
+
+    targets_dir = tmp_path / "targets"
+    targets_dir.mkdir()
+    shutil.copy(os.path.join(REPO_ROOT, "test_image"), targets_dir)
+    return tmp_path
+
+
+def verify_targets(repo, targets_cfg: str, tamper=None) -> None:
+    targets_file = str(repo / "targets" / "0.0.1.test_image.targets.toml")
+    uptane.roles.targets.TargetsOffline(str(repo / targets_cfg), ftest_path("test_imagecfg.toml")) \
+        .gen_signed_metadata_file(targets_file)
+    if tamper is not None:
+        with open(targets_file, "rb") as f:
+            metadata = tomli.load(f)
+        tamper(metadata)
+        with open(targets_file, "wb") as f:
+            tomli_w.dump(metadata, f)
+
+    uptane.verify.Verification(str(repo / "root.toml"), str(repo / "targets"), None, None).verify_target_file()
+
+
+def test_threshold_met(threshold_repo):
+    verify_targets(threshold_repo, "targets3.toml")
+
+
+def test_threshold_not_met(threshold_repo):
+    with pytest.raises(uptane.error.general.PublicKeysNoMatch):
+        verify_targets(threshold_repo, "targets1.toml")
+
+
+def test_threshold_met_with_one_bad_signature(threshold_repo):
+    def corrupt_first(metadata):
+        metadata["signatures"][0]["sig"] = metadata["signatures"][1]["sig"]
+    verify_targets(threshold_repo, "targets3.toml", corrupt_first)
+
+
+def test_threshold_not_met_with_two_bad_signatures(threshold_repo):
+    def corrupt_two(metadata):
+        metadata["signatures"][0]["sig"] = metadata["signatures"][2]["sig"]
+        metadata["signatures"][1]["sig"] = metadata["signatures"][2]["sig"]
+    with pytest.raises(uptane.error.general.MetadataFileInvalidSignature):
+        verify_targets(threshold_repo, "targets3.toml", corrupt_two)
+
+
+def test_threshold_counts_a_key_once(threshold_repo):
+    def repeat_first(metadata):
+        metadata["signatures"] = [metadata["signatures"][0]] * 3
+    with pytest.raises(uptane.error.general.PublicKeysNoMatch):
+        verify_targets(threshold_repo, "targets3.toml", repeat_first)
+
+
+def test_threshold_counts_a_key_in_another_pem_form_once(threshold_repo):
+    def repeat_first_reformatted(metadata):
+        signature = metadata["signatures"][0]
+        metadata["signatures"] = [signature, dict(signature, keyid=signature["keyid"].strip() + "\n\n")]
+    with pytest.raises(uptane.error.general.PublicKeysNoMatch):
+        verify_targets(threshold_repo, "targets3.toml", repeat_first_reformatted)
+
+
+def test_role_keys_rejects_threshold_below_one():
+    public_key = ECC.generate(curve='ed25519').public_key().export_key(format='PEM')
+    with pytest.raises(uptane.error.general.InvalidThreshold):
+        uptane.verify.role_keys({"keys": [{"keyid": public_key}], "threshold": 0})
+
+
+def test_root_lists_the_public_key_then_the_public_keys(threshold_repo):
+    with open(threshold_repo / "root.toml", "rb") as f:
+        roles = tomli.load(f)["signed"]["roles"]
+    with open(threshold_repo / "targets3.toml", "rb") as f:
+        targets_cfg = tomli.load(f)
+
+    assert roles["targets"] == {"keys": [{"keytype": "ed25519", "keyid": public_key} for public_key in
+                                         [targets_cfg["public_key"]] + targets_cfg["public_keys"]],
+                                "threshold": 2}
+    assert roles["snapshot"]["threshold"] == roles["timestamp"]["threshold"] == 1
+
+
+@pytest.mark.parametrize("threshold", [0, 4])
+def test_root_rejects_a_threshold_the_keys_can_not_meet(threshold_repo, threshold):
+    with open(threshold_repo / "rootcfg.toml", "rb") as f:
+        root_cfg = tomli.load(f)
+    root_cfg["targets"]["threshold"] = threshold
+    with open(threshold_repo / "rootcfg.toml", "wb") as f:
+        tomli_w.dump(root_cfg, f)
+
+    with pytest.raises(ValueError, match="can not be met"):
+        uptane.roles.root.Root(str(threshold_repo / "rootcfg.toml"))
+
+
+def test_incremental_verification(root_metadata, gen_metadata):
+    old = gen_metadata("old", expires_in=3600)
+    new = gen_metadata("new", expires_in=7200)
+    verifier = uptane.verify.IncrementalVerification(root_metadata)
+
+    assert verifier.verify(old.dir, old.snapshot, old.timestamp)
+    assert not verifier.verify(old.dir, old.snapshot, old.timestamp)
+    assert verifier.verify(new.dir, new.snapshot, new.timestamp)
+
+
+def test_incremental_verification_rejects_rollback(root_metadata, gen_metadata):
+    old = gen_metadata("old", expires_in=3600)
+    new = gen_metadata("new", expires_in=7200)
+    verifier = uptane.verify.IncrementalVerification(root_metadata)
+
+    assert verifier.verify(new.dir, new.snapshot, new.timestamp)
+    with pytest.raises(uptane.error.general.MetadataRollback):
+        verifier.verify(old.dir, old.snapshot, old.timestamp)
+    # the trusted state is kept
+    assert not verifier.verify(new.dir, new.snapshot, new.timestamp)
+
+
+def test_incremental_verification_rejects_targets_rollback(root_metadata, gen_metadata):
+    new = gen_metadata("new", expires_in=7200)
+    verifier = uptane.verify.IncrementalVerification(root_metadata)
+    assert verifier.verify(new.dir, new.snapshot, new.timestamp)
+
+    # newer snapshot and timestamp over targets metadata that expires before the trusted one
+    mixed = gen_metadata("mixed", expires_in=10800, targets_expires_in=3600)
+    with pytest.raises(uptane.error.general.MetadataRollback):
+        verifier.verify(mixed.dir, mixed.snapshot, mixed.timestamp)
+
+
+def test_incremental_verification_checks_changed_targets_only(root_metadata, gen_metadata, sign_metadata_set,
+                                                             tmp_path, monkeypatch):
+    old = gen_metadata("old", expires_in=3600)
+    verifier = uptane.verify.IncrementalVerification(root_metadata)
+    assert verifier.verify(old.dir, old.snapshot, old.timestamp)
+
+    shutil.copytree(old.dir, tmp_path / "new")
+    uptane.roles.targets.TargetsOffline(ftest_path("test_targetscfg.toml"), ftest_path("test_imagecfg2.toml")) \
+        .gen_signed_metadata_file(str(tmp_path / "new" / "0.0.1.test_image2.targets.toml"))
+    new = sign_metadata_set(str(tmp_path / "new"), expires_in=7200)
+
+    hashed = []
+    hash_files = uptane.crypto.hash.hash_files
+    monkeypatch.setattr(uptane.crypto.hash, "hash_files",
+                        lambda file_paths, *args: hashed.extend(file_paths) or hash_files(file_paths, *args))
+    assert verifier.verify(new.dir, new.snapshot, new.timestamp)
+    assert [os.path.basename(file_path) for file_path in hashed] == ["test_image2"]
+
+
+def test_incremental_verification_rejects_image_of_unchanged_targets(root_metadata, gen_metadata,
+                                                                     sign_metadata_set, tmp_path):
+    old = gen_metadata("old", expires_in=3600)
+    verifier = uptane.verify.IncrementalVerification(root_metadata)
+    assert verifier.verify(old.dir, old.snapshot, old.timestamp)
+
+    # only the targets file of test_image2 changes, it now names the image of the unchanged one
+    shutil.copytree(old.dir, tmp_path / "new")
+    uptane.roles.targets.TargetsOffline(ftest_path("test_targetscfg.toml"), ftest_path("test_imagecfg.toml")) \
+        .gen_signed_metadata_file(str(tmp_path / "new" / "0.0.1.test_image2.targets.toml"))
+    new = sign_metadata_set(str(tmp_path / "new"), expires_in=7200)
+
+    with pytest.raises(uptane.error.general.DuplicateImageName):
+        verifier.verify(new.dir, new.snapshot, new.timestamp)
+
+
+@pytest.fixture
+def state_file(tmp_path, monkeypatch) -> str:
+    '''
+    Persisted trusted state in tmp_path, roots are loaded again by every TrustedState
+    '''
+    monkeypatch.setattr(uptane.verify, "TRUSTED_STATES", {})
+    monkeypatch.setattr(uptane.verify, "TRUSTED_STATE_FILE_PATH", str(tmp_path / "state.json"))
+    return str(tmp_path / "state.json")
+
+
+def gen_root(root_path: str, monkeypatch, expires_in: int = 3600) -> str:
+    monkeypatch.chdir(REPO_ROOT)
+    with monkeypatch.context() as patch:
+        patch.setattr(uptane.time, "get_fut365y_epoch_time", lambda: int(time.time()) + expires_in)
+        uptane.roles.root.Root(ftest_path("test_rootcfg.toml")).gen_signed_metadata_file(root_path)
+    return root_path
+
+
+def test_trusted_state_keys_come_from_the_root(root_metadata, state_file):
+    root_state = uptane.verify.TrustedState(root_metadata).refresh().snapshot()
+    with open(state_file) as f:
+        states = json.load(f)
+    assert states == {root_metadata: {"root_hash": root_state.root_hash, "root_expires": root_state.root_expires}}
+
+    # keys written next to the persisted root are not read
+    other_key = ECC.generate(curve='ed25519').public_key().export_key(format='PEM')
+    states[root_metadata]["roles"] = {role: {"keys": [other_key], "threshold": 1} \
+                                      for role in ("root", "targets", "snapshot", "timestamp")}
+    with open(state_file, "w") as f:
+        json.dump(states, f)
+    assert uptane.verify.TrustedState(root_metadata).refresh().snapshot() == root_state
+
+
+def test_trusted_state_verifies_a_persisted_root(root_metadata, state_file):
+    uptane.verify.TrustedState(root_metadata).refresh()
+    # the root file is tampered with and the state file points at the tampered root
+    with open(root_metadata, "rb") as f:
+        root_dict = tomli.load(f)
+    root_dict["signed"]["roles"]["targets"]["keys"] = \
+        [{"keytype": "ed25519", "keyid": ECC.generate(curve='ed25519').public_key().export_key(format='PEM')}]
+    with open(root_metadata, "wb") as f:
+        tomli_w.dump(root_dict, f)
+    with open(root_metadata, "rb") as f:
+        root_hash = uptane.crypto.hash.get_bytes_hash(f.read(), uptane.crypto.hash.HashFunc.sha256)
+    with open(state_file) as f:
+        states = json.load(f)
+    states[root_metadata]["root_hash"] = root_hash
+    with open(state_file, "w") as f:
+        json.dump(states, f)
+
+    with pytest.raises(uptane.error.general.MetadataFileInvalidSignature):
+        uptane.verify.TrustedState(root_metadata).refresh()
+
+
+def test_trusted_state_rejects_an_older_root(tmp_path, state_file, monkeypatch):
+    root_path = gen_root(str(tmp_path / "root.toml"), monkeypatch, expires_in=7200)
+    uptane.verify.TrustedState(root_path).refresh()
+
+    gen_root(root_path, monkeypatch, expires_in=3600)
+    with pytest.raises(uptane.error.general.MetadataRollback):
+        uptane.verify.TrustedState(root_path).refresh()
+
+
+def test_trusted_state_file_keeps_concurrently_verified_roots(tmp_path, state_file, monkeypatch):
+    root_paths = [str(tmp_path / f"root{i}.toml") for i in range(16)]
+    for root_path in root_paths:
+        gen_root(root_path, monkeypatch)
+    barrier = threading.Barrier(len(root_paths))
+
+    def refresh(root_path: str) -> None:
+        barrier.wait()
+        uptane.verify.TrustedState(root_path).refresh()
+
+    threads = [threading.Thread(target=refresh, args=(root_path,)) for root_path in root_paths]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with open(state_file) as f:
+        assert sorted(json.load(f)) == sorted(root_paths)
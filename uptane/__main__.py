@@ -7,10 +7,17 @@ import uptane.roles.snapshot
 import uptane.roles.timestamp
 import uptane.repository.imagerepo
 import uptane.repository.directorrepo
+import uptane.repository.server
+import uptane.repository.asyncdirector
+import uptane.repository.fleetstore
+import uptane.repository.campaign
 import uptane.verify 
 import uptane.crypto.sign
 import uptane.crypto.hash
+import uptane.delta
+import uptane.download
 import subprocess
+import uptane.codec
 import json
 def exec_partial_verification(args)->None:
     '''
@@ -25,6 +32,43 @@ def exec_partial_verification(args)->None:
     verify = uptane.verify.Verification(root_metadata_file_path=args["rmetafile"], timestamp_metadata_file_path=None, snapshot_metadata_file_path=None, targets_files_dir_path=args["tmetadir"])
     verify.verify_target_file()
 
+def exec_apply_delta(args)->None:
+    '''
+    Rebuild an image from the installed image and a delta listed in targets metadata, the
+    targets metadata is verified against root first
+    '''
+    for arg in ("rmetafile", "tmetafile", "basefile", "basever", "deltafile", "out"):
+        if args[arg] is None:
+            print(f"--{arg} not given")
+            exit(1)
+
+    targets_keys = uptane.verify.get_trusted_state(args["rmetafile"]).snapshot().targets_keys
+    toml_dict = uptane.codec.load(args["tmetafile"][0])
+    uptane.verify.check_role_metadata(toml_dict, targets_keys)
+    uptane.verify.verify_signatures([uptane.verify.signature_item(toml_dict, targets_keys)])
+
+    uptane.delta.apply_delta_update(toml_dict["signed"], args["basever"], args["basefile"], \
+        args["deltafile"], args["out"])
+    print(f'{args["out"]} rebuilt and verified \u2713')
+
+def exec_download_image(args)->None:
+    '''
+    Download the image listed in targets metadata, the targets metadata is verified against
+    root first and the image while it downloads
+    '''
+    for arg in ("rmetafile", "tmetafile", "out"):
+        if args[arg] is None:
+            print(f"--{arg} not given")
+            exit(1)
+
+    targets_keys = uptane.verify.get_trusted_state(args["rmetafile"]).snapshot().targets_keys
+    toml_dict = uptane.codec.load(args["tmetafile"][0])
+    uptane.verify.check_role_metadata(toml_dict, targets_keys)
+    uptane.verify.verify_signatures([uptane.verify.signature_item(toml_dict, targets_keys)])
+
+    uptane.download.download_image(toml_dict["signed"], args["out"])
+    print(f'{args["out"]} downloaded and verified \u2713')
+
 def exec_send_to_image_repo(args)->None:
     '''
     Send to image repo using curl
@@ -136,9 +180,17 @@ def exec_server_gen(args: typing.Dict[str, typing.Any]):
         exit(1)
 
     # getting public key
-    authpubkey = open(args["authpubkey"], "r").read()
+    with open(args["authpubkey"], "r") as f:
+        authpubkey = f.read()
+
     if args["stype"] == "image":
-        uptane.repository.imagerepo.setup_server(args["rmetafile"], authpubkey)
+        if args["prod"]:
+            uptane.repository.server.serve(uptane.repository.imagerepo.imagerepo, \
+                lambda: uptane.repository.imagerepo.init_server(args["rmetafile"], authpubkey, args["blobdir"]), \
+                port=args["port"] or 8080, workers=args["workers"], threads=args["threads"], \
+                keepalive=args["keepalive"], max_request_size=args["maxreqsize"])
+        else:
+            uptane.repository.imagerepo.setup_server(args["rmetafile"], authpubkey, args["blobdir"])
 
     if args["stype"] == "director":
         if (args["ontscfg"] is None) or (args["onsnapcfg"] is
@@ -146,9 +198,53 @@ def exec_server_gen(args: typing.Dict[str, typing.Any]):
             print("--ontscfg --onsnapcfg --ontarcfg arguments not given")
             exit(1)
 
-        uptane.repository.directorrepo.setup_server(root_metadata_file=args["rmetafile"], \
+        if args["async_server"]:
+            uptane.repository.asyncdirector.setup_server(root_metadata_file=args["rmetafile"], \
+                timestamp_cfg=args["ontscfg"], snapshot_cfg=args["onsnapcfg"], \
+                targets_cfg=args["ontarcfg"], authpubkey=authpubkey, port=args["port"] or 8082, \
+                workers=args["workers"], max_pending=args["maxpending"], fleet_db=args["fleetdb"])
+        elif args["prod"]:
+            uptane.repository.server.serve(uptane.repository.directorrepo.directorrepo, \
+                lambda: uptane.repository.directorrepo.init_server(root_metadata_file=args["rmetafile"], \
                 timestamp_cfg=args["ontscfg"], snapshot_cfg=args["onsnapcfg"], \
-                targets_cfg=args["ontarcfg"], authpubkey=authpubkey)
+                targets_cfg=args["ontarcfg"], authpubkey=authpubkey, fleet_db=args["fleetdb"]), \
+                port=args["port"] or 8082, workers=args["workers"], threads=args["threads"], \
+                keepalive=args["keepalive"], max_request_size=args["maxreqsize"])
+        else:
+            uptane.repository.directorrepo.setup_server(root_metadata_file=args["rmetafile"], \
+                    timestamp_cfg=args["ontscfg"], snapshot_cfg=args["onsnapcfg"], \
+                    targets_cfg=args["ontarcfg"], authpubkey=authpubkey, fleet_db=args["fleetdb"])
+
+
+def exec_fleet_import(args: typing.Dict[str, typing.Any]):
+    '''
+    Import vehicles, images and upgrade paths into the fleet store of the director
+    '''
+    if args["fleetdb"] is None:
+        print("--fleetdb argument not given")
+        exit(1)
+
+    store = uptane.repository.fleetstore.FleetStore(args["fleetdb"])
+    counts = store.import_csv(ecus_csv=args["ecuscsv"], images_csv=args["imagescsv"], \
+                              upgrades_csv=args["upgradescsv"])
+    for table in counts:
+        print(f"imported {counts[table]} {table}")
+    store.close()
+
+
+def exec_campaign(args: typing.Dict[str, typing.Any]):
+    '''
+    Pre-sign the director metadata of every vehicle of a campaign
+    '''
+    for arg in ("campaign", "fleetdb", "out", "ontscfg", "onsnapcfg", "ontarcfg"):
+        if args[arg] is None:
+            print(f"--{arg} argument not given")
+            exit(1)
+
+    campaign = uptane.repository.campaign.Campaign(args["campaign"], args["fleetdb"], args["out"], \
+        timestamp_cfg=args["ontscfg"], snapshot_cfg=args["onsnapcfg"], targets_cfg=args["ontarcfg"], \
+        workers=args["workers"])
+    campaign.run()
 
 
 def exec_verify_metadata(args: typing.Dict[str, typing.Any]):
@@ -226,11 +322,33 @@ def main():
     parser.add_argument("--ontscfg", help="online cfg for timestamp role")
     parser.add_argument("--onsnapcfg", help="online cfg for snapshot role")
     parser.add_argument("--ontarcfg", help="online cfg for targets role")
+    parser.add_argument("--prod",
+                        help="serve with the multi-worker production server",
+                        action="store_true")
+    parser.add_argument("--async",
+                        dest="async_server",
+                        help="serve the director on an asyncio event loop",
+                        action="store_true")
+    parser.add_argument("--maxpending", type=int,
+                        default=uptane.repository.asyncdirector.DEFAULT_MAX_PENDING,
+                        help="bundles queued by the async director before it answers 503")
+    parser.add_argument("--blobdir",
+                        help="content addressed store of the image repo, on the filesystem of image_repo")
+    parser.add_argument("--port", type=int, help="port for the server")
+    parser.add_argument("--workers", type=int, default=uptane.repository.server.DEFAULT_WORKERS,
+                        help="worker processes of the production server or a campaign")
+    parser.add_argument("--threads", type=int, default=uptane.repository.server.DEFAULT_THREADS,
+                        help="threads per worker of the production server")
+    parser.add_argument("--keepalive", type=int, default=uptane.repository.server.DEFAULT_KEEPALIVE,
+                        help="seconds to keep idle connections open")
+    parser.add_argument("--maxreqsize", type=int,
+                        default=uptane.repository.server.DEFAULT_MAX_REQUEST_SIZE,
+                        help="largest request body accepted in bytes")
 
     parser.add_argument(
         "command",
         help=
-        "metadata - command for generating metadata, server - command for generating a server, verify - command for verifying metadata, send - command for sending to server, pverify - for partial verification in the ecu"
+        "metadata - command for generating metadata, server - command for generating a server, verify - command for verifying metadata, send - command for sending to server, pverify - for partial verification in the ecu, delta - for rebuilding an image from a delta, download - for downloading an image listed in targets metadata, fleet - for importing the director fleet inventory, campaign - for pre-signing the metadata of a rollout campaign"
     )
 
     # send arguments
@@ -240,11 +358,35 @@ def main():
     parser.add_argument('--repo', help="name of the repo to send to")
     # 5th argument for send is --authpubkey, defined in server arguments as well
     
+    parser.add_argument("--hashcache",
+                        help="sqlite file for caching file hashes between runs")
+    # delta arguments, -t and -r are used for the targets and root metadata file
+    parser.add_argument("--basefile", help="the installed image a delta is applied to")
+    parser.add_argument("--basever", help="version of the installed image")
+    parser.add_argument("--deltafile", help="the delta file")
+    parser.add_argument("--out", help="path of the rebuilt or downloaded image, or output dir of a campaign")
+
+    # fleet arguments, --fleetdb is also used by the director server
+    parser.add_argument("--fleetdb", help="sqlite file of the director fleet inventory")
+    parser.add_argument("--ecuscsv", help="csv of ecus to import, with a vin, ecu_id, installed_hash header row")
+    parser.add_argument("--imagescsv", help="csv of images to import, with a header row of the image columns")
+    parser.add_argument("--upgradescsv", help="csv of upgrade paths to import, with a from_hash, to_hash header row")
+    # campaign arguments, with --fleetdb, --out, --workers and the online role cfgs
+    parser.add_argument("--campaign", help="the campaign definition file")
+
+    parser.add_argument("--trustedstate",
+                        help="file recording the last verified roots, older roots are refused")
+
     # parsing args
     args = parser.parse_args()
     args = vars(args)
     print(args)
 
+    if args["hashcache"] is not None:
+        uptane.crypto.hash.enable_hash_cache(args["hashcache"])
+    if args["trustedstate"] is not None:
+        uptane.verify.enable_trusted_state(args["trustedstate"])
+
     if args["command"] == "metadata" and args["offline"] and args[
             "role"] is not None:
         exec_offline_metadata_gen(args)
@@ -257,6 +399,14 @@ def main():
         exec_send_to_image_repo(args)
     elif args["command"] == "pverify":
         exec_partial_verification(args)
+    elif args["command"] == "delta":
+        exec_apply_delta(args)
+    elif args["command"] == "download":
+        exec_download_image(args)
+    elif args["command"] == "fleet":
+        exec_fleet_import(args)
+    elif args["command"] == "campaign":
+        exec_campaign(args)
     else:
         print(f'{args["command"]} not recognized')
 
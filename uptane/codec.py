@@ -0,0 +1,272 @@
+# file for encoding and decoding metadata files, picked by file extension
+#   .toml    - toml, the default
+#   .msgpack - messagepack, compact and fast to parse on ECUs
+# signatures are computed over the canonical json of the signed portion, so the same
+# metadata verifies the same whatever codec it was stored in
+import struct
+import typing
+import tomli
+import tomli_w
+
+try:
+    import msgpack  # optional, the msgpack extra, the pure python codec below is used without it
+except ImportError:
+    msgpack = None
+
+MSGPACK_MAX_DEPTH = 32  # nesting of arrays and maps, metadata is a few levels deep
+
+
+class TomlCodec:
+    '''
+    Toml metadata codec
+    '''
+    name = "toml"
+    extension = ".toml"
+
+    @staticmethod
+    def dumps(metadata: typing.Dict[str, typing.Any]) -> bytes:
+        return tomli_w.dumps(metadata).encode('utf-8')
+
+    @staticmethod
+    def loads(data: bytes) -> typing.Dict[str, typing.Any]:
+        '''
+            Raises:
+                tomli.TOMLDecodeError
+        '''
+        return tomli.loads(data.decode('utf-8'))
+
+
+class MsgpackCodec:
+    '''
+    MessagePack metadata codec, uses the msgpack package when it is installed and a pure
+    python implementation of the subset of the format metadata needs otherwise, map keys
+    must be strings (or bytes) with both
+    '''
+    name = "msgpack"
+    extension = ".msgpack"
+
+    @staticmethod
+    def dumps(metadata: typing.Dict[str, typing.Any]) -> bytes:
+        if msgpack is not None:
+            return msgpack.packb(metadata, use_bin_type=True)
+        out = bytearray()
+        _msgpack_encode(metadata, out)
+        return bytes(out)
+
+    @staticmethod
+    def loads(data: bytes) -> typing.Dict[str, typing.Any]:
+        '''
+            Raises:
+                ValueError - when the data is not valid messagepack
+        '''
+        if msgpack is not None:
+            try:
+                metadata = msgpack.unpackb(data, raw=False, strict_map_key=True)
+            except Exception as e:
+                raise ValueError(f'invalid msgpack metadata: {e}') from e
+        else:
+            try:
+                metadata, pos = _msgpack_decode(data, 0, 0)
+            except (IndexError, struct.error) as e:
+                raise ValueError('truncated msgpack metadata') from e
+            if pos != len(data):
+                raise ValueError('trailing bytes after msgpack metadata')
+        if not isinstance(metadata, dict):
+            raise ValueError('msgpack metadata is not a map')
+        return metadata
+
+
+TOML_CODEC = TomlCodec()
+MSGPACK_CODEC = MsgpackCodec()
+CODECS = {codec.extension: codec for codec in (TOML_CODEC, MSGPACK_CODEC)}
+
+Codec = typing.Union[TomlCodec, MsgpackCodec]
+
+
+def get_codec(file_path: str) -> Codec:
+    '''
+    Returns the codec of a metadata file from its extension, toml when it is not known
+    '''
+    for extension in CODECS:
+        if file_path.endswith(extension):
+            return CODECS[extension]
+    return TOML_CODEC
+
+
+def load(file_path: str) -> typing.Dict[str, typing.Any]:
+    '''
+    Loads a metadata file with the codec of its extension
+
+        Raises:
+            FileNotFoundError - file not found
+            tomli.TOMLDecodeError - error in decoding toml file
+            ValueError - error in decoding msgpack file
+    '''
+    with open(file_path, 'rb') as f:
+        return get_codec(file_path).loads(f.read())
+
+
+def loads(data: bytes, file_path: str) -> typing.Dict[str, typing.Any]:
+    '''
+    Decodes metadata already read from file_path with the codec of its extension
+    '''
+    return get_codec(file_path).loads(data)
+
+
+def dump(metadata: typing.Dict[str, typing.Any], file_path: str) -> None:
+    '''
+    Writes a metadata file with the codec of its extension
+    '''
+    with open(file_path, 'wb') as f:
+        f.write(get_codec(file_path).dumps(metadata))
+
+
+def _msgpack_encode(obj: typing.Any, out: bytearray) -> None:
+    if obj is None:
+        out.append(0xc0)
+    elif obj is True:
+        out.append(0xc3)
+    elif obj is False:
+        out.append(0xc2)
+    elif isinstance(obj, int):
+        if 0 <= obj < 0x80:
+            out.append(obj)
+        elif -0x20 <= obj < 0:
+            out.append(obj & 0xff)
+        elif 0 <= obj < 2**64:
+            for marker, fmt, limit in ((0xcc, '>B', 2**8), (0xcd, '>H', 2**16),
+                                       (0xce, '>I', 2**32), (0xcf, '>Q', 2**64)):
+                if obj < limit:
+                    out.append(marker)
+                    out += struct.pack(fmt, obj)
+                    break
+        elif -2**63 <= obj < 0:
+            for marker, fmt, limit in ((0xd0, '>b', 2**7), (0xd1, '>h', 2**15),
+                                       (0xd2, '>i', 2**31), (0xd3, '>q', 2**63)):
+                if obj >= -limit:
+                    out.append(marker)
+                    out += struct.pack(fmt, obj)
+                    break
+        else:
+            raise TypeError(f'integer {obj} does not fit in msgpack')
+    elif isinstance(obj, float):
+        out.append(0xcb)
+        out += struct.pack('>d', obj)
+    elif isinstance(obj, str):
+        data = obj.encode('utf-8')
+        _msgpack_header(out, len(data), 0xa0, 32, (0xd9, 0xda, 0xdb))
+        out += data
+    elif isinstance(obj, (bytes, bytearray)):
+        _msgpack_header(out, len(obj), None, 0, (0xc4, 0xc5, 0xc6))
+        out += obj
+    elif isinstance(obj, (list, tuple)):
+        _msgpack_header(out, len(obj), 0x90, 16, (None, 0xdc, 0xdd))
+        for item in obj:
+            _msgpack_encode(item, out)
+    elif isinstance(obj, dict):
+        _msgpack_header(out, len(obj), 0x80, 16, (None, 0xde, 0xdf))
+        for key in obj:
+            _msgpack_encode(key, out)
+            _msgpack_encode(obj[key], out)
+    else:
+        raise TypeError(f'{type(obj).__name__} can not be stored in msgpack metadata')
+
+
+def _msgpack_header(out: bytearray, size: int, fix_marker: typing.Optional[int], fix_limit: int,
+                    markers: typing.Tuple[typing.Optional[int], int, int]) -> None:
+    '''
+    Writes the type and size header of a str, bin, array or map
+    '''
+    if fix_marker is not None and size < fix_limit:
+        out.append(fix_marker | size)
+    elif markers[0] is not None and size < 2**8:
+        out.append(markers[0])
+        out.append(size)
+    elif size < 2**16:
+        out.append(markers[1])
+        out += struct.pack('>H', size)
+    else:
+        out.append(markers[2])
+        out += struct.pack('>I', size)
+
+
+# fixed size types: marker -> (struct format, size)
+_MSGPACK_FIXED = {
+    0xca: ('>f', 4), 0xcb: ('>d', 8),
+    0xcc: ('>B', 1), 0xcd: ('>H', 2), 0xce: ('>I', 4), 0xcf: ('>Q', 8),
+    0xd0: ('>b', 1), 0xd1: ('>h', 2), 0xd2: ('>i', 4), 0xd3: ('>q', 8),
+}
+# sized types: marker -> (struct format of the size, kind)
+_MSGPACK_SIZED = {
+    0xd9: ('>B', 'str'), 0xda: ('>H', 'str'), 0xdb: ('>I', 'str'),
+    0xc4: ('>B', 'bin'), 0xc5: ('>H', 'bin'), 0xc6: ('>I', 'bin'),
+    0xdc: ('>H', 'array'), 0xdd: ('>I', 'array'),
+    0xde: ('>H', 'map'), 0xdf: ('>I', 'map'),
+}
+
+
+def _msgpack_decode(data: bytes, pos: int, depth: int) -> typing.Tuple[typing.Any, int]:
+    '''
+    Decodes the object at pos, depth is the number of arrays and maps it is nested in
+
+        Raises:
+            ValueError - the data is not valid metadata, nested deeper than MSGPACK_MAX_DEPTH
+            or a map key is not a string
+            IndexError, struct.error - the data is cut short
+    '''
+    marker = data[pos]
+    pos += 1
+
+    if marker < 0x80:
+        return marker, pos
+    if marker >= 0xe0:
+        return marker - 0x100, pos
+    if marker < 0x90:
+        return _msgpack_decode_sized('map', marker & 0x0f, data, pos, depth)
+    if marker < 0xa0:
+        return _msgpack_decode_sized('array', marker & 0x0f, data, pos, depth)
+    if marker < 0xc0:
+        return _msgpack_decode_sized('str', marker & 0x1f, data, pos, depth)
+    if marker == 0xc0:
+        return None, pos
+    if marker == 0xc2:
+        return False, pos
+    if marker == 0xc3:
+        return True, pos
+    if marker in _MSGPACK_FIXED:
+        fmt, size = _MSGPACK_FIXED[marker]
+        return struct.unpack_from(fmt, data, pos)[0], pos + size
+    if marker in _MSGPACK_SIZED:
+        fmt, kind = _MSGPACK_SIZED[marker]
+        size = struct.unpack_from(fmt, data, pos)[0]
+        return _msgpack_decode_sized(kind, size, data, pos + struct.calcsize(fmt), depth)
+
+    raise ValueError(f'unsupported msgpack type {marker:#x}')
+
+
+def _msgpack_decode_sized(kind: str, size: int, data: bytes, pos: int,
+                          depth: int) -> typing.Tuple[typing.Any, int]:
+    if kind == 'str' or kind == 'bin':
+        if pos + size > len(data):
+            raise ValueError('truncated msgpack metadata')
+        value = bytes(data[pos:pos + size])
+        # UnicodeDecodeError is a ValueError
+        return (value.decode('utf-8') if kind == 'str' else value), pos + size
+
+    if depth >= MSGPACK_MAX_DEPTH:
+        raise ValueError(f'msgpack metadata is nested deeper than {MSGPACK_MAX_DEPTH}')
+
+    if kind == 'array':
+        array = []
+        for _ in range(size):
+            item, pos = _msgpack_decode(data, pos, depth + 1)
+            array.append(item)
+        return array, pos
+
+    mapping = {}
+    for _ in range(size):
+        key, pos = _msgpack_decode(data, pos, depth + 1)
+        if not isinstance(key, (str, bytes)):
+            raise ValueError(f'msgpack map key of type {type(key).__name__}, keys must be strings')
+        mapping[key], pos = _msgpack_decode(data, pos, depth + 1)
+    return mapping, pos
@@ -0,0 +1,58 @@
+# canonical encoding of metadata used for signatures
+#   - keys of every dict are sorted, lists keep their order
+#   - output is byte-identical to json.dumps of the recursively sorted metadata, which is
+#     what existing signatures were computed over
+import json
+import typing
+import uptane.crypto.hash
+
+STREAM_CHUNK_SIZE = 65536
+
+__ENCODER = json.JSONEncoder(sort_keys=True)
+
+
+def canonical_bytes(metadata: typing.Dict[str, typing.Any]) -> bytes:
+    '''
+    Get the canonical bytes of metadata
+        Parameters:
+            metadata (Dict[str, Any]): metadata in the form of python dict
+
+        Returns:
+            bytes: canonical json encoding of the metadata in utf-8
+    '''
+    return __ENCODER.encode(metadata).encode('utf-8')
+
+
+def canonical_hash(metadata: typing.Dict[str, typing.Any],
+                   hashf: uptane.crypto.hash.HashFunc,
+                   stream: bool = False) -> str:
+    '''
+    Get the hash of the canonical encoding of metadata
+        Parameters:
+            metadata (Dict[str, Any]): metadata in the form of python dict
+            hashf (HashFunc): the hash function to be used
+            stream (bool) [Optional, Default: False]: feed the encoding to the hasher in
+            chunks instead of building the full string, for very large metadata
+
+        Returns:
+            str: the hex digest of the canonical encoding
+    '''
+    hashfunc = uptane.crypto.hash.new_hash(hashf)
+
+    if not stream:
+        hashfunc.update(canonical_bytes(metadata))
+        return hashfunc.hexdigest()
+
+    # iterencode yields many tiny strings, batch them before updating the hasher
+    chunks: typing.List[str] = []
+    size = 0
+    for chunk in __ENCODER.iterencode(metadata):
+        chunks.append(chunk)
+        size += len(chunk)
+        if size >= STREAM_CHUNK_SIZE:
+            hashfunc.update(''.join(chunks).encode('utf-8'))
+            chunks = []
+            size = 0
+
+    hashfunc.update(''.join(chunks).encode('utf-8'))
+    return hashfunc.hexdigest()
@@ -1,5 +1,26 @@
+import atexit
+import concurrent.futures
 import enum
 import hashlib
+import itertools
+import mmap
+import os
+import shutil
+import typing
+import zipfile
+from uptane.crypto.hashcache import HashCache
+import uptane.error.general
+
+AUTO_BUFSIZE = 0
+MIN_BUFSIZE = 65536
+MAX_BUFSIZE = 4 * 1024 * 1024
+MMAP_MIN_SIZE = 64 * 1024 * 1024  # files above this size are worth memory mapping
+DEFAULT_CHUNK_SIZE = 1024 * 1024  # chunk size of merkle image hashes
+DEFAULT_MAX_EXTRACT_SIZE = 8 * 1024 * 1024 * 1024  # 8 GiB, uncompressed size of a zip archive
+
+# domain separation of merkle leaves and nodes, a node can not be passed off as a chunk
+MERKLE_LEAF_PREFIX = b'\x00'
+MERKLE_NODE_PREFIX = b'\x01'
 
 
 class HashFunc(enum.Enum):
@@ -7,32 +28,443 @@ class HashFunc(enum.Enum):
     md5 = 2
 
 
-def get_file_hash(file_path: str, hashf: HashFunc, bufsize: int) -> str:
+# optional persistent hash cache, checked by get_file_hash before reading a file
+HASH_CACHE: typing.Optional[HashCache] = None
+
+
+def enable_hash_cache(db_path: str, max_entries: int = 100000) -> HashCache:
+    '''
+    Enable the persistent hash cache for all file hashing, the cache is closed (and bounded to
+    max_entries) at exit, or when another cache is enabled
+        Parameters:
+            db_path (str): path to the sqlite database file of the cache
+            max_entries (int) [Optional, Default: 100000]: size bound of the cache
+
+        Returns:
+            HashCache: the enabled cache
+    '''
+    global HASH_CACHE
+    if HASH_CACHE is not None:
+        atexit.unregister(HASH_CACHE.close)
+        HASH_CACHE.close()
+    HASH_CACHE = HashCache(db_path, max_entries)
+    atexit.register(HASH_CACHE.close)
+    return HASH_CACHE
+
+
+def new_hash(hashf: HashFunc) -> typing.Any:
+    '''
+    Get a new hashlib object for the hash function
+        Parameters:
+            hashf (HashFunc): the hash function to be used
+
+        Returns:
+            hashlib object, sha256 is used as default
     '''
-        Get hash of a file
+    if hashf == HashFunc.md5:
+        return hashlib.md5()
+
+    # ? add more hash functions ??
+    return hashlib.sha256()
+
+
+def get_bytes_hash(data: bytes, hashf: HashFunc) -> str:
+    '''
+        Get hash of data held in memory
+            Parameters:
+                data (bytes): the data to hash
+                hashf (HashFunc): the hash function to be used
+            Returns:
+                str: the hash of the data
+        '''
+    hashfunc = new_hash(hashf)
+    hashfunc.update(data)
+    return hashfunc.hexdigest()
+
+
+def get_buf_size(file_size: int, block_size: int) -> int:
+    '''
+    Get a buffer size for reading a file, picked from the file size and fs block size
+        Parameters:
+            file_size (int): size of the file in bytes
+            block_size (int): preferred block size of the filesystem (st_blksize)
+
+        Returns:
+            int: a multiple of the block size between MIN_BUFSIZE and MAX_BUFSIZE
+    '''
+    block_size = max(block_size, 512)
+    # aim for ~64 reads per file, larger files get larger reads
+    bufsize = min(max(file_size // 64, MIN_BUFSIZE), MAX_BUFSIZE)
+    return max(bufsize // block_size, 1) * block_size
+
+
+def get_file_hash(file_path: str, hashf: HashFunc, bufsize: int = AUTO_BUFSIZE,
+                  use_mmap: bool = False) -> str:
+    '''
+        Get hash of a file, reads into one reused buffer so no new bytes are allocated per read
             Parameters:
                 file_path (str): the path of the file to hash
                 hashf (HashFunc): the hash function to be used
-                bufsize (int): buffer read sizes
+                bufsize (int) [Optional, Default: AUTO_BUFSIZE]: buffer read sizes, picked from
+                the file size and fs block size when AUTO_BUFSIZE
+                use_mmap (bool) [Optional, Default: False]: hash a memory map of the file
+                instead of reading it, for large firmware images
             Retures:
                 str: the hash of the file 
         '''
-    hashfunc = hashlib.sha256()  # using sha256 as default
+    hashfunc = new_hash(hashf)
 
-    if hashf == HashFunc.sha256:
-        hashfunc = hashlib.sha256()
+    # a hit costs a stat and a read only lookup, the file is not opened
+    if HASH_CACHE is not None:
+        digest = HASH_CACHE.get(file_path, os.stat(file_path), hashf.name)
+        if digest is not None:
+            return digest
 
-    if hashf == HashFunc.md5:
-        hashfunc = hashlib.md5()
+    with open(file_path, "rb", buffering=0) as image_file:
+        stat = os.fstat(image_file.fileno())
 
-    # ? add more hash functions ??
+        if use_mmap and stat.st_size > 0:
+            with mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as image_map:
+                hashfunc.update(image_map)
+        else:
+            if bufsize <= 0:
+                bufsize = get_buf_size(stat.st_size, stat.st_blksize)
+
+            buffer = bytearray(bufsize)
+            view = memoryview(buffer)
+            while True:
+                size = image_file.readinto(buffer)
+                if not size:
+                    break
+                hashfunc.update(view[:size])
+
+        digest = hashfunc.hexdigest()
+
+        # only cache when the file was not written to while it was hashed
+        cur_stat = os.fstat(image_file.fileno())
+        if HASH_CACHE is not None and (cur_stat.st_size, cur_stat.st_mtime_ns, cur_stat.st_ctime_ns) \
+                == (stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns):
+            HASH_CACHE.put(file_path, stat, hashf.name, digest)
+
+    return digest
+
+
+def hash_files(paths: typing.Iterable[str],
+               hashf: HashFunc,
+               bufsize: int,
+               workers: typing.Optional[int] = None,
+               use_processes: bool = False) -> typing.Dict[str, str]:
+    '''
+        Get hashes of many files at once
+            Parameters:
+                paths (Iterable[str]): the paths of the files to hash
+                hashf (HashFunc): the hash function to be used
+                bufsize (int): buffer read sizes
+                workers (int) [Optional]: size of the pool, defaults to the executor default
+                use_processes (bool) [Optional, Default: False]: hash on a process pool instead
+                of a thread pool, for very large firmware sets
+
+            Returns:
+                Dict[str, str]: map of path to the hash of the file
+
+            Raises:
+                FileNotFoundError - when a file is not found
+        '''
+    paths = list(dict.fromkeys(paths))  # drop duplicates, keep order
+
+    if len(paths) <= 1:
+        return {path: get_file_hash(path, hashf, bufsize) for path in paths}
+
+    # hashlib releases the GIL while hashing large buffers, so threads scale
+    executor_class = concurrent.futures.ProcessPoolExecutor if use_processes \
+                     else concurrent.futures.ThreadPoolExecutor
+
+    with executor_class(max_workers=workers) as executor:
+        digests = executor.map(get_file_hash, paths, itertools.repeat(hashf),
+                               itertools.repeat(bufsize))
+        return dict(zip(paths, digests))
+
+
+def extract_zip_hashed(zip_file_path: str, dest_dir: str, hashf: HashFunc,
+                       workers: typing.Optional[int] = None,
+                       max_size: int = DEFAULT_MAX_EXTRACT_SIZE) -> typing.Dict[str, str]:
+    '''
+        Extract a zip archive and hash every member while it is written, members are extracted
+        in parallel on a thread pool, zlib and hashlib both release the GIL
+            Parameters:
+                zip_file_path (str): the path of the zip archive
+                dest_dir (str): directory to extract into, members never overwrite its files
+                hashf (HashFunc): the hash function to be used
+                workers (int) [Optional]: size of the pool, defaults to the executor default
+                max_size (int) [Optional, Default: DEFAULT_MAX_EXTRACT_SIZE]: largest total
+                uncompressed size of the members
+
+            Returns:
+                Dict[str, str]: map of extracted file path (dest_dir/member name) to its hash
+
+            Raises:
+                zipfile.BadZipFile - when the archive is corrupt
+                ValueError - when a member would be extracted outside of dest_dir, or two
+                members have the same path, or a path is both a file and a dir
+                FileExistsError - when a member would overwrite a file in dest_dir
+                uptane.error.general.FileSizeLimitExceeded - when the members are larger than
+                max_size
+        '''
+    dest_dir = os.path.normpath(dest_dir)
+
+    with zipfile.ZipFile(zip_file_path) as zipO:
+        members = []
+        file_paths: typing.Set[str] = set()
+        dir_paths: typing.Set[str] = set()
+        total_size = 0
+        for info in zipO.infolist():
+            member_path = os.path.normpath(os.path.join(dest_dir, info.filename))
+            if os.path.commonpath([os.path.abspath(dest_dir), os.path.abspath(member_path)]) \
+                    != os.path.abspath(dest_dir):
+                raise ValueError(f"zip member {info.filename} is outside of the archive dir")
+
+            # a second member with the same path would be extracted over the first one,
+            # while the hash of only one of them is returned
+            if member_path in file_paths:
+                raise ValueError(f"zip member {info.filename} is in the archive twice")
+
+            # every parent of a member is a dir
+            parent = member_path if info.is_dir() else os.path.dirname(member_path)
+            while parent != dest_dir and parent not in dir_paths:
+                dir_paths.add(parent)
+                parent = os.path.dirname(parent)
+
+            if not info.is_dir():
+                file_paths.add(member_path)
+                total_size += info.file_size
+                if total_size > max_size:
+                    raise uptane.error.general.FileSizeLimitExceeded
+                members.append((info, member_path))
+
+        if not file_paths.isdisjoint(dir_paths):
+            raise ValueError("zip archive has a path that is both a file and a dir")
+
+        for dir_path in sorted(dir_paths):
+            os.makedirs(dir_path, exist_ok=True)
 
-    image_file = open(file_path, "rb")
+    def extract_member(member: typing.Tuple[zipfile.ZipInfo, str]) -> str:
+        # every worker reads through its own handle, a shared ZipFile serialises reads
+        with zipfile.ZipFile(zip_file_path) as zipO, zipO.open(member[0]) as src, \
+             open(member[1], "xb") as dst:
+            # the declared size bounds the member, whatever the compressed stream holds
+            writer = HashingWriter(dst, hashf, member[0].file_size)
+            shutil.copyfileobj(src, writer, MIN_BUFSIZE)
+            return writer.hexdigest()
 
-    while True:
-        data = image_file.read(bufsize)
-        if not data:
-            break
-        hashfunc.update(data)
+    if len(members) <= 1:
+        return {member[1]: extract_member(member) for member in members}
 
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip((member[1] for member in members), executor.map(extract_member, members)))
+
+
+class HashingWriter:
+    '''
+    File-like wrapper that hashes everything written to the file it wraps, so data can be
+    hashed in the same pass that stores it
+        - raises FileSizeLimitExceeded when more than max_size bytes are written
+        - every other file method (seek, read, close, name) is passed to the wrapped file
+    '''
+
+    def __init__(self, file: typing.BinaryIO, hashf: HashFunc,
+                 max_size: typing.Optional[int] = None) -> None:
+        self.file = file
+        self.max_size = max_size
+        self.size = 0
+        self.__hashfunc = new_hash(hashf)
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            raise uptane.error.general.FileSizeLimitExceeded
+        self.__hashfunc.update(data)
+        return self.file.write(data)
+
+    def hexdigest(self) -> str:
+        '''
+        Returns the hash of everything written so far
+        '''
+        return self.__hashfunc.hexdigest()
+
+    def __getattr__(self, name: str) -> typing.Any:
+        return getattr(self.file, name)
+
+    def __iter__(self):
+        return iter(self.file)
+
+
+def get_chunk_hash(chunk: bytes, hashf: HashFunc) -> str:
+    '''
+    Get the merkle leaf hash of one chunk of a file
+    '''
+    hashfunc = new_hash(hashf)
+    hashfunc.update(MERKLE_LEAF_PREFIX)
+    hashfunc.update(chunk)
     return hashfunc.hexdigest()
+
+
+def get_merkle_root(chunk_hashes: typing.Sequence[str], hashf: HashFunc) -> str:
+    '''
+    Get the merkle root over chunk hashes, an odd node is promoted to the next level as is
+        Parameters:
+            chunk_hashes (Sequence[str]): the leaf hashes, in file order
+            hashf (HashFunc): the hash function to be used
+
+        Returns:
+            str: the merkle root, the hash of nothing for an empty file
+    '''
+    level = [bytes.fromhex(chunk_hash) for chunk_hash in chunk_hashes]
+    if len(level) == 0:
+        return get_chunk_hash(b'', hashf)
+
+    while len(level) > 1:
+        next_level = []
+        for i in range(0, len(level) - 1, 2):
+            hashfunc = new_hash(hashf)
+            hashfunc.update(MERKLE_NODE_PREFIX + level[i] + level[i + 1])
+            next_level.append(hashfunc.digest())
+        if len(level) % 2:
+            next_level.append(level[-1])
+        level = next_level
+
+    return level[0].hex()
+
+
+def get_file_chunk_hashes(file_path: str, hashf: HashFunc,
+                          chunk_size: int = DEFAULT_CHUNK_SIZE) -> typing.List[str]:
+    '''
+        Get the merkle leaf hashes of the fixed size chunks of a file
+            Parameters:
+                file_path (str): the path of the file to hash
+                hashf (HashFunc): the hash function to be used
+                chunk_size (int) [Optional, Default: DEFAULT_CHUNK_SIZE]: size of the chunks
+
+            Returns:
+                List[str]: the hash of every chunk, in file order
+        '''
+    chunk_hashes = []
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+
+    with open(file_path, "rb", buffering=0) as image_file:
+        while True:
+            size = image_file.readinto(buffer)
+            if not size:
+                break
+            # a raw read can come back short before the end of the file
+            while size < chunk_size:
+                more = image_file.readinto(view[size:])
+                if not more:
+                    break
+                size += more
+            chunk_hashes.append(get_chunk_hash(view[:size], hashf))
+
+    return chunk_hashes
+
+
+def get_file_merkle(file_path: str, hashf: HashFunc,
+                    chunk_size: int = DEFAULT_CHUNK_SIZE) -> typing.Tuple[str, typing.List[str]]:
+    '''
+        Get the merkle root and chunk hashes of a file, so it can be verified chunk by chunk
+        while it is downloaded (see ChunkVerifier)
+            Parameters:
+                file_path (str): the path of the file to hash
+                hashf (HashFunc): the hash function to be used
+                chunk_size (int) [Optional, Default: DEFAULT_CHUNK_SIZE]: size of the chunks
+
+            Returns:
+                Tuple[str, List[str]]: the merkle root and the hash of every chunk
+        '''
+    chunk_hashes = get_file_chunk_hashes(file_path, hashf, chunk_size)
+    return get_merkle_root(chunk_hashes, hashf), chunk_hashes
+
+
+class ChunkVerifier:
+    '''
+    Verifies a file chunk by chunk as it arrives, against chunk hashes that are checked
+    against a signed merkle root first
+        - feed() raises FileHashNoMatch on the first corrupt chunk, nothing after a bad
+          chunk is accepted
+        - resume() re-checks a partially downloaded file and keeps it up to its last good
+          chunk, so a download can continue from verified_size
+    '''
+
+    def __init__(self, merkle_root: str, chunk_hashes: typing.Sequence[str], chunk_size: int,
+                 file_size: int, hashf: HashFunc) -> None:
+        '''
+            Raises:
+                uptane.error.general.FileHashNoMatch - chunk hashes do not match the merkle root
+        '''
+        if get_merkle_root(chunk_hashes, hashf) != merkle_root or \
+                len(chunk_hashes) != -(-file_size // chunk_size):
+            raise uptane.error.general.FileHashNoMatch
+
+        self.chunk_hashes = list(chunk_hashes)
+        self.chunk_size = chunk_size
+        self.file_size = file_size
+        self.hashf = hashf
+        self.verified_size = 0
+        self.__pending = bytearray()
+
+    def __chunk_end(self) -> int:
+        return min(self.verified_size + self.chunk_size, self.file_size)
+
+    def feed(self, data: bytes) -> bytes:
+        '''
+        Feeds the next downloaded bytes
+            Returns:
+                bytes: the data of the chunks verified by this call, safe to write out
+
+            Raises:
+                uptane.error.general.FileHashNoMatch - a chunk is corrupt or the file is too long
+        '''
+        self.__pending += data
+        verified = bytearray()
+        while len(self.__pending) and self.verified_size < self.file_size:
+            size = self.__chunk_end() - self.verified_size
+            if len(self.__pending) < size:
+                break
+            chunk = self.__pending[:size]
+            if get_chunk_hash(chunk, self.hashf) != \
+                    self.chunk_hashes[self.verified_size // self.chunk_size]:
+                self.__pending.clear()
+                raise uptane.error.general.FileHashNoMatch
+            verified += chunk
+            del self.__pending[:size]
+            self.verified_size += size
+
+        if len(self.__pending) and self.verified_size == self.file_size:
+            raise uptane.error.general.FileHashNoMatch
+        return bytes(verified)
+
+    def resume(self, file_path: str) -> int:
+        '''
+        Verifies the chunks of a partially downloaded file and truncates it after the
+        last good chunk
+            Returns:
+                int: offset to continue the download from
+        '''
+        self.verified_size = 0
+        self.__pending.clear()
+        with open(file_path, "r+b") as part_file:
+            while self.verified_size < self.file_size:
+                chunk = part_file.read(self.__chunk_end() - self.verified_size)
+                if len(chunk) != self.__chunk_end() - self.verified_size or \
+                        get_chunk_hash(chunk, self.hashf) != \
+                        self.chunk_hashes[self.verified_size // self.chunk_size]:
+                    break
+                self.verified_size += len(chunk)
+            part_file.truncate(self.verified_size)
+
+        return self.verified_size
+
+    def finished(self) -> bool:
+        '''
+        Returns whether every chunk of the file was verified
+        '''
+        return self.verified_size == self.file_size
@@ -0,0 +1,187 @@
+# persistent content hash cache
+#   - entries are keyed by path and hash algorithm, and are only valid while the stat
+#     identity (size, mtime, ctime, inode, device) of the file is unchanged
+#   - bounded in size, least recently used entries are evicted first
+#   - a hit is a read only lookup, uses are recorded in batches and the size is bounded every
+#     EVICT_INTERVAL insertions, when the cache is opened and when it is closed, so short runs
+#     that insert less than EVICT_INTERVAL entries still keep the database bounded
+#   - the hit/miss counters are those of the current process, they are not stored
+import os
+import sqlite3
+import threading
+import typing
+
+DEFAULT_MAX_ENTRIES = 100000
+TOUCH_BATCH = 256  # hits recorded per write transaction
+EVICT_INTERVAL = 1024  # insertions between size checks, the cache may overshoot by this much
+
+# the clock of the least recently used order, kept in the table itself
+NEXT_CLOCK = "(SELECT COALESCE(MAX(last_used), 0) + 1 FROM hashes)"
+
+
+class HashCache:
+    '''
+    On-disk cache of file hashes stored in sqlite, so unchanged files are not re-read
+    '''
+
+    def __init__(self, db_path: str, max_entries: int = DEFAULT_MAX_ENTRIES) -> None:
+        '''
+        Opens or creates the hash cache database
+            Parameters:
+                db_path (str): path to the sqlite database file
+                max_entries (int) [Optional, Default: DEFAULT_MAX_ENTRIES]: entries kept before
+                least recently used ones are evicted
+
+            Raises:
+                sqlite3.Error - when the database can not be opened
+        '''
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.hits = 0  # lookups of this process only
+        self.misses = 0
+        self.closed = False
+        self.__lock = threading.Lock()
+        self.__touched: typing.Set[typing.Tuple[str, str]] = set()
+        self.__inserted = 0
+        self.__open()
+
+    def __open(self) -> None:
+        self.__pid = os.getpid()
+        self.__conn = sqlite3.connect(self.db_path, check_same_thread=False,
+                                      isolation_level=None)
+        self.__conn.execute("PRAGMA journal_mode=WAL")
+        self.__conn.execute("PRAGMA synchronous=NORMAL")
+        self.__conn.execute('''CREATE TABLE IF NOT EXISTS hashes (
+            path TEXT NOT NULL, algo TEXT NOT NULL, size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL, ctime_ns INTEGER NOT NULL, inode INTEGER NOT NULL,
+            device INTEGER NOT NULL, digest TEXT NOT NULL, last_used INTEGER NOT NULL,
+            PRIMARY KEY (path, algo))''')
+        self.__conn.execute(
+            "CREATE INDEX IF NOT EXISTS hashes_last_used ON hashes (last_used)")
+        if self.__conn.execute("SELECT COUNT(*) FROM hashes").fetchone()[0] > self.max_entries:
+            self.__evict()
+
+    def __check_pid(self) -> None:
+        # sqlite connections must not be shared with forked worker processes
+        if self.__pid != os.getpid():
+            # hits of the parent are recorded by the parent
+            self.__touched = set()
+            self.__inserted = 0
+            self.__open()
+
+    def __flush_touched(self) -> None:
+        '''
+        Records the batched hits as uses, in one write transaction
+        '''
+        if not len(self.__touched):
+            return
+        self.__conn.execute("BEGIN")
+        try:
+            self.__conn.executemany(f"UPDATE hashes SET last_used = {NEXT_CLOCK} WHERE path = ? AND algo = ?",
+                                    self.__touched)
+            self.__conn.execute("COMMIT")
+        except BaseException:
+            self.__conn.execute("ROLLBACK")
+            raise
+        self.__touched = set()
+
+    def __evict(self) -> None:
+        '''
+        Removes the least recently used entries above max_entries
+        '''
+        self.__conn.execute(
+            "DELETE FROM hashes WHERE rowid IN (SELECT rowid FROM hashes "
+            "ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (self.max_entries, ))
+
+    def get(self, path: str, stat: os.stat_result, algo: str) -> typing.Optional[str]:
+        '''
+        Get the cached hash of a file
+            Parameters:
+                path (str): path of the file
+                stat (os.stat_result): the current stat of the file
+                algo (str): name of the hash function
+
+            Returns:
+                str | None: the hash, or None when not cached or the file has changed
+        '''
+        path = os.path.realpath(path)
+        with self.__lock:
+            self.__check_pid()
+            row = self.__conn.execute(
+                "SELECT size, mtime_ns, ctime_ns, inode, device, digest FROM hashes "
+                "WHERE path = ? AND algo = ?", (path, algo)).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            if tuple(row[:5]) != (stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns,
+                                  stat.st_ino, stat.st_dev):
+                # file has changed since it was hashed
+                self.__conn.execute("DELETE FROM hashes WHERE path = ? AND algo = ?",
+                                    (path, algo))
+                self.misses += 1
+                return None
+
+            self.__touched.add((path, algo))
+            if len(self.__touched) >= TOUCH_BATCH:
+                self.__flush_touched()
+            self.hits += 1
+            return row[5]
+
+    def put(self, path: str, stat: os.stat_result, algo: str, digest: str) -> None:
+        '''
+        Store the hash of a file, evicts least recently used entries above max_entries
+            Parameters:
+                path (str): path of the file
+                stat (os.stat_result): the stat of the file when it was hashed
+                algo (str): name of the hash function
+                digest (str): the hash of the file
+        '''
+        path = os.path.realpath(path)
+        with self.__lock:
+            self.__check_pid()
+            cursor = self.__conn.execute(
+                "INSERT INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?, ?, " + NEXT_CLOCK + ") "
+                "ON CONFLICT (path, algo) DO UPDATE SET size = excluded.size, "
+                "mtime_ns = excluded.mtime_ns, ctime_ns = excluded.ctime_ns, inode = excluded.inode, "
+                "device = excluded.device, digest = excluded.digest, last_used = excluded.last_used",
+                (path, algo, stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns, stat.st_ino,
+                 stat.st_dev, digest))
+
+            self.__inserted += cursor.rowcount
+            if self.__inserted >= EVICT_INTERVAL:
+                self.__inserted = 0
+                self.__flush_touched()
+                self.__evict()
+
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        '''
+        Returns the hit/miss counters and hit rate of this process, and the current size of
+        the cache
+        '''
+        with self.__lock:
+            self.__check_pid()
+            lookups = self.hits + self.misses
+            size = self.__conn.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": size,
+                "max_entries": self.max_entries
+            }
+
+    def close(self) -> None:
+        '''
+        Records the batched hits, evicts least recently used entries above max_entries and
+        closes the database, closing a closed cache does nothing
+        '''
+        with self.__lock:
+            if self.closed:
+                return
+            self.__check_pid()
+            self.__flush_touched()
+            self.__evict()
+            self.__conn.close()
+            self.closed = True
@@ -1,72 +1,107 @@
 # Code related to generating signatures
 from enum import Enum
 from typing import Any, Dict
-import json
 from uptane.crypto.hash import HashFunc
+from uptane.crypto.canonical import canonical_hash
 from Crypto.Signature import eddsa
-import hashlib
 import base64
 from Crypto.PublicKey import ECC
+import collections
+import concurrent.futures
+import threading
+import typing
+
+KEY_CACHE_MAXSIZE = 128
 
 
 class KeyType(Enum):
     ed25519 = 1
 
 
-def __sort_metadata_list(metadata: list) -> list:
-    for i in range(len(metadata)):
-        if type(metadata[i]) == type([]):
-            metadata[i] = __sort_metadata_list(metadata[i])
+class KeyCache:
+    '''
+    Bounded LRU cache of parsed key objects, keyed by the key in pem format
+
+        - PEM parsing with ECC.import_key is costly and the same few role keys are
+          used for every sign/verify call on the servers
+
+        - hits and misses are counted for monitoring the cache
+    '''
 
-        if type(metadata[i]) == type({}):
-            metadata[i] = __sort_metadata(metadata[i])
+    def __init__(self, maxsize: int = KEY_CACHE_MAXSIZE) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.__keys: collections.OrderedDict = collections.OrderedDict()
+        self.__lock = threading.Lock()
 
-    return metadata
+    def get(self, key: str) -> ECC.EccKey:
+        '''
+        Get the parsed key object for a key in pem format, importing it on a miss
+            Parameters:
+                key (str): the public or private key in pem format
 
+            Returns:
+                ECC.EccKey: the parsed key object
+        '''
+        with self.__lock:
+            key_obj = self.__keys.get(key)
+            if key_obj is not None:
+                self.__keys.move_to_end(key)
+                self.hits += 1
+                return key_obj
+            self.misses += 1
 
-def __sort_metadata(metadata: Dict[str, Any]) -> Dict[str, Any]:
-    sorted_metadata = dict(sorted(metadata.items()))
+        key_obj = ECC.import_key(key)
 
-    for key in sorted_metadata:
-        if type(sorted_metadata[key]) == type({}):
-            sorted_metadata[key] = __sort_metadata(sorted_metadata[key])
+        with self.__lock:
+            self.__keys[key] = key_obj
+            self.__keys.move_to_end(key)
+            while len(self.__keys) > self.maxsize:
+                self.__keys.popitem(last=False)
 
-        if type(sorted_metadata[key]) == type([]):
-            sorted_metadata[key] = __sort_metadata_list(sorted_metadata[key])
+        return key_obj
 
-    return sorted_metadata
+    def clear(self) -> None:
+        '''
+        Remove all cached keys and reset the counters
+        '''
+        with self.__lock:
+            self.__keys.clear()
+            self.hits = 0
+            self.misses = 0
 
+    def stats(self) -> Dict[str, int]:
+        '''
+        Returns the hit/miss counters and the current size of the cache
+        '''
+        with self.__lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self.__keys),
+                "maxsize": self.maxsize
+            }
 
-def sign_metadata(metadata: Dict[str, Any], hashf: HashFunc, ktype: KeyType,
-                  key: str) -> str:
+
+KEY_CACHE = KeyCache()
+
+
+def sign_digest(hashed_payload: str, ktype: KeyType, key: str) -> str:
     '''
-    Sign metadata that is given in the form of a dictionary
+    Sign the canonical hash of metadata
         Parameters:
-            metadata (Dict[str, Any]): metadata in the form of python dict
-            hashf (uptane.crypto.hash.HashFunc): hash function to be used
+            hashed_payload (str): the canonical hash of the metadata (see canonical_hash)
             ktype (uptane.crypto.sign.KeyType): the ktype, this would determine the signing algo
             key (str): the private key in pem format
 
         Returns:
             str: signature in base64
     '''
-    metadata = __sort_metadata(metadata)
-    json_payload = json.dumps(metadata)
     signature = b''
 
-    hashed_payload: str = ''
-    if hashf == HashFunc.sha256:
-        s256 = hashlib.sha256()
-        s256.update(bytes(json_payload, 'utf-8'))
-        hashed_payload = s256.hexdigest()
-
-    if hashf == HashFunc.md5:
-        hmd5 = hashlib.md5()
-        hmd5.update(bytes(json_payload, 'utf-8'))
-        hashed_payload = hmd5.hexdigest()
-
     if ktype == KeyType.ed25519:
-        private_key = ECC.import_key(key)
+        private_key = KEY_CACHE.get(key)
         # the error shown here in the ide is wrongly displayed
         signor = eddsa.new(private_key, 'rfc8032')
         signature = signor.sign(bytes(hashed_payload, 'utf-8'))
@@ -75,33 +110,54 @@ def sign_metadata(metadata: Dict[str, Any], hashf: HashFunc, ktype: KeyType,
     return signature.decode('utf-8')
 
 
-def verify_sig_metadata(metadata: Dict[str, Any], hashf: HashFunc,
-                        ktype: KeyType, pub_key: str, signature: str) -> bool:
+def sign_metadata(metadata: Dict[str, Any], hashf: HashFunc, ktype: KeyType,
+                  key: str, stream: bool = False) -> str:
     '''
-    Verify signed metadata that is given in the form of a dictionary 
+    Sign metadata that is given in the form of a dictionary
         Parameters:
-            metadata (Dict[str, Any])" metadata in the form of a python dict 
+            metadata (Dict[str, Any]): metadata in the form of python dict
             hashf (uptane.crypto.hash.HashFunc): hash function to be used
-            ktype: (uptane.crypto.sign.Keytype): the ktype, determine signing algo used for verfication
-            key (str): the public key in pem format
-            signature (str): the signature received
+            ktype (uptane.crypto.sign.KeyType): the ktype, this would determine the signing algo
+            key (str): the private key in pem format
+            stream (bool) [Optional, Default: False]: stream the canonical encoding into the
+            hasher instead of building it in memory
+
+        Returns:
+            str: signature in base64
+    '''
+    return sign_digest(canonical_hash(metadata, hashf, stream), ktype, key)
+
+
+def sign_metadata_keys(metadata: Dict[str, Any], hashf: HashFunc, ktype: KeyType,
+                       keys: typing.Sequence[str], stream: bool = False) -> typing.List[str]:
     '''
-    metadata = __sort_metadata(metadata)
-    json_payload = json.dumps(metadata)
+    Sign metadata with several keys, the canonical hash is computed once for all of them
+        Parameters:
+            metadata (Dict[str, Any]): metadata in the form of python dict
+            hashf (uptane.crypto.hash.HashFunc): hash function to be used
+            ktype (uptane.crypto.sign.KeyType): the ktype, this would determine the signing algo
+            keys (Sequence[str]): the private keys in pem format
+            stream (bool) [Optional, Default: False]: stream the canonical encoding into the
+            hasher instead of building it in memory
 
-    hashed_payload: str = ''
-    if hashf == HashFunc.sha256:
-        s256 = hashlib.sha256()
-        s256.update(bytes(json_payload, 'utf-8'))
-        hashed_payload = s256.hexdigest()
+        Returns:
+            List[str]: signatures in base64, in the order of keys
+    '''
+    hashed_payload = canonical_hash(metadata, hashf, stream)
+    return [sign_digest(hashed_payload, ktype, key) for key in keys]
 
-    if hashf == HashFunc.md5:
-        hmd5 = hashlib.md5()
-        hmd5.update(bytes(json_payload, 'utf-8'))
-        hashed_payload = hmd5.hexdigest()
 
+def verify_sig_digest(hashed_payload: str, ktype: KeyType, pub_key: str, signature: str) -> bool:
+    '''
+    Verify a signature over the canonical hash of metadata
+        Parameters:
+            hashed_payload (str): the canonical hash of the metadata (see canonical_hash)
+            ktype: (uptane.crypto.sign.Keytype): the ktype, determine signing algo used for verfication
+            pub_key (str): the public key in pem format
+            signature (str): the signature received
+    '''
     if ktype == KeyType.ed25519:
-        public_key = ECC.import_key(pub_key)
+        public_key = KEY_CACHE.get(pub_key)
         # the error show here in the ide is wrongly displayed
         verifier = eddsa.new(public_key, 'rfc8032')
         try:
@@ -112,3 +168,126 @@ def verify_sig_metadata(metadata: Dict[str, Any], hashf: HashFunc,
             return False
 
     return False
+
+
+def verify_sig_metadata(metadata: Dict[str, Any], hashf: HashFunc,
+                        ktype: KeyType, pub_key: str, signature: str,
+                        stream: bool = False) -> bool:
+    '''
+    Verify signed metadata that is given in the form of a dictionary 
+        Parameters:
+            metadata (Dict[str, Any])" metadata in the form of a python dict 
+            hashf (uptane.crypto.hash.HashFunc): hash function to be used
+            ktype: (uptane.crypto.sign.Keytype): the ktype, determine signing algo used for verfication
+            key (str): the public key in pem format
+            signature (str): the signature received
+            stream (bool) [Optional, Default: False]: stream the canonical encoding into the
+            hasher instead of building it in memory
+    '''
+    return verify_sig_digest(canonical_hash(metadata, hashf, stream), ktype, pub_key, signature)
+
+
+class VerifyResult(typing.NamedTuple):
+    '''
+    Result of one item of a batch verification
+        valid (bool): whether the signature is valid
+        error (Exception | None): the error raised while verifying the item, if any
+    '''
+    valid: bool
+    error: typing.Optional[Exception]
+
+
+class ThresholdGroup(typing.NamedTuple):
+    '''
+    Signatures over one metadata dict, valid when threshold of them verify
+        metadata (Dict[str, Any]): the signed metadata
+        signatures (Sequence[Tuple[str, str]]): (public key in pem format, signature) of
+        distinct keys
+        threshold (int): how many signatures need to verify
+    '''
+    metadata: Dict[str, Any]
+    signatures: typing.Sequence[typing.Tuple[str, str]]
+    threshold: int
+
+
+def verify_threshold_batch(groups: typing.Sequence[ThresholdGroup],
+                           hashf: HashFunc,
+                           ktype: KeyType,
+                           workers: typing.Optional[int] = None) -> typing.List[VerifyResult]:
+    '''
+    Verify k of n signatures of many metadata dicts together, the signatures of all groups are
+    checked concurrently, but only threshold signatures of a group are in flight at a time and
+    the next one is only checked when one fails, so a group stops as soon as its threshold is
+    met and a higher n does not add latency
+        Parameters:
+            groups (Sequence[ThresholdGroup]): the metadata dicts with their signatures
+            hashf (uptane.crypto.hash.HashFunc): hash function to be used
+            ktype (uptane.crypto.sign.KeyType): the ktype, determine signing algo used for verfication
+            workers (int) [Optional]: size of the thread pool, defaults to the executor default
+
+        Returns:
+            List[VerifyResult]: one result per group, in the order of groups
+    '''
+    results: typing.List[typing.Optional[VerifyResult]] = [None] * len(groups)
+    for i, group in enumerate(groups):
+        if group.threshold <= 0 or len(group.signatures) < group.threshold:
+            results[i] = VerifyResult(False, None)
+
+    open_groups = [i for i in range(len(groups)) if results[i] is None]
+    if len(open_groups) == 0:
+        return typing.cast(typing.List[VerifyResult], results)
+
+    # every distinct key is parsed at most once, before the workers start
+    for pub_key in {signature[0] for i in open_groups for signature in groups[i].signatures}:
+        try:
+            KEY_CACHE.get(pub_key)
+        except Exception:
+            pass  # reported per signature below, like any error of verify_sig_digest
+
+    def verify_signature(hashed_payload: str, pub_key: str, signature: str) -> VerifyResult:
+        try:
+            return VerifyResult(verify_sig_digest(hashed_payload, ktype, pub_key, signature), None)
+        except Exception as e:
+            return VerifyResult(False, e)
+
+    valid_counts = [0] * len(groups)
+    in_flight = [0] * len(groups)
+    next_signature = [0] * len(groups)
+    errors: typing.List[typing.Optional[Exception]] = [None] * len(groups)
+    futures: Dict[concurrent.futures.Future, int] = {}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        # the canonical hash of every metadata dict is computed once for all of its signatures
+        digests = dict(zip(open_groups, executor.map(
+            lambda i: canonical_hash(groups[i].metadata, hashf), open_groups)))
+
+        def submit(i: int) -> concurrent.futures.Future:
+            pub_key, signature = groups[i].signatures[next_signature[i]]
+            next_signature[i] += 1
+            in_flight[i] += 1
+            future = executor.submit(verify_signature, digests[i], pub_key, signature)
+            futures[future] = i
+            return future
+
+        pending = {submit(i) for i in open_groups for _ in range(groups[i].threshold)}
+        while pending:
+            done, pending = concurrent.futures.wait(pending,
+                                                    return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                i = futures[future]
+                in_flight[i] -= 1
+                result = future.result()
+                if result.valid:
+                    valid_counts[i] += 1
+                else:
+                    errors[i] = result.error or errors[i]
+                    # replace the failed signature with the next one of the group
+                    if next_signature[i] < len(groups[i].signatures):
+                        pending.add(submit(i))
+
+                if valid_counts[i] >= groups[i].threshold:
+                    results[i] = VerifyResult(True, None)
+                elif in_flight[i] == 0:
+                    results[i] = VerifyResult(False, errors[i])
+
+    return typing.cast(typing.List[VerifyResult], results)
@@ -0,0 +1,307 @@
+# file for generating and applying binary deltas between image versions
+import array
+import contextlib
+import hashlib
+import itertools
+import mmap
+import operator
+import os
+import struct
+import typing
+import zlib
+import uptane.crypto.hash
+import uptane.error.general
+
+DELTA_MAGIC = b'UPTDELTA'
+DELTA_FORMAT_VERSION = 1
+DEFAULT_BLOCK_SIZE = 2048
+SEGMENT_SIZE = 256 * 1024  # windows scanned at once, and bytes of ops compressed at once
+
+OP_COPY = 0x43     # copy a range of the base image
+OP_LITERAL = 0x4c  # new bytes, carried in the delta
+
+__HEADER = struct.Struct('>BQ')        # format version, image size
+__COPY = struct.Struct('>QI')          # base offset, length
+__LITERAL = struct.Struct('>I')        # length
+
+# random 32 bit value of every byte value, summed by the weak checksum
+__WEAK_TABLE = [int.from_bytes(hashlib.blake2b(bytes([value]), digest_size=4).digest(), 'big')
+                for value in range(256)]
+
+
+def __weak_checksum(block: bytes) -> int:
+    '''
+    Weak checksum of a block, the sum of a random 32 bit value per byte, it rolls by adding the
+    value of the byte coming in and subtracting the one going out, like the rsync checksum
+    '''
+    return sum(map(__WEAK_TABLE.__getitem__, block))
+
+
+def __strong_checksum(block: bytes) -> bytes:
+    '''
+    Checksum confirming a weak checksum match
+    '''
+    return hashlib.blake2b(block, digest_size=16).digest()
+
+
+def __index_base(base: typing.Union[bytes, mmap.mmap],
+                 block_size: int) -> typing.Tuple[typing.Set[int], typing.Dict[bytes, int]]:
+    '''
+    Indexes the blocks of the base image
+        Returns:
+            Tuple[Set[int], Dict[bytes, int]]: weak checksums of the blocks, and strong
+            checksum -> offset of the first block with it
+    '''
+    weak_checksums = set()
+    offsets: typing.Dict[bytes, int] = {}
+    for offset in range(0, len(base) - block_size + 1, block_size):
+        block = base[offset:offset + block_size]
+        weak_checksums.add(__weak_checksum(block))
+        offsets.setdefault(__strong_checksum(block), offset)
+    return weak_checksums, offsets
+
+
+def __weak_matches(data: bytes, weak_checksums: typing.Set[int], block_size: int) -> typing.Iterator[int]:
+    '''
+    Positions of the block_size windows of data whose weak checksum is one of weak_checksums,
+    the checksums of all windows are differences of the prefix sums of data, computed and
+    looked up by C loops instead of rolled byte by byte in python
+    '''
+    windows = len(data) - block_size + 1
+    prefix = array.array('q', itertools.accumulate(map(__WEAK_TABLE.__getitem__, data), initial=0))
+    hits = bytes(map(weak_checksums.__contains__,
+                     map(operator.sub, prefix[block_size:block_size + windows], prefix[:windows])))
+    hit = hits.find(1)
+    while hit >= 0:
+        yield hit
+        hit = hits.find(1, hit + 1)
+
+
+def __encode_ops(image: typing.Union[bytes, mmap.mmap],
+                 index: typing.Tuple[typing.Set[int], typing.Dict[bytes, int]],
+                 block_size: int, write: typing.Callable[[bytes], typing.Any]) -> None:
+    '''
+    Encodes the image as COPY ops of base blocks and LITERAL ops of new bytes, ops are passed
+    to write as they are made, every window is matched at the first position after the last
+    copied block, as a byte by byte rolling scan does
+        - the block right after a copy is looked up by its strong checksum, runs of copied
+          blocks are never scanned
+        - otherwise the windows are scanned for a weak match in chunks, growing up to
+          SEGMENT_SIZE windows, long literals are split at the chunk boundaries
+    '''
+    weak_checksums, offsets = index
+    ops = bytearray()
+    last_copy: typing.List[int] = []  # [offset, length] of a COPY not yet encoded
+
+    def emit_copy(offset: int) -> None:
+        if last_copy and last_copy[0] + last_copy[1] == offset:
+            last_copy[1] += block_size
+            return
+        flush_copy()
+        last_copy.extend((offset, block_size))
+
+    def flush_copy() -> None:
+        if last_copy:
+            ops.append(OP_COPY)
+            ops.extend(__COPY.pack(last_copy[0], last_copy[1]))
+            last_copy.clear()
+        if len(ops) >= SEGMENT_SIZE:
+            write(bytes(ops))
+            ops.clear()
+
+    def emit_literal(data: bytes) -> None:
+        if len(data):
+            flush_copy()
+            ops.append(OP_LITERAL)
+            ops.extend(__LITERAL.pack(len(data)))
+            ops.extend(data)
+
+    image_size = len(image)
+    pos = 0
+    literal_start = 0
+    while pos + block_size <= image_size:
+        offset = offsets.get(__strong_checksum(image[pos:pos + block_size]))
+        if offset is None:
+            # no match at pos, scan the following windows
+            match = None
+            scan = pos + 1
+            chunk = 2 * block_size
+            while match is None and scan + block_size <= image_size:
+                scan_end = min(scan + chunk, image_size - block_size + 1)
+                for hit in __weak_matches(image[scan:scan_end + block_size - 1], weak_checksums, block_size):
+                    offset = offsets.get(__strong_checksum(image[scan + hit:scan + hit + block_size]))
+                    if offset is not None:
+                        match = scan + hit
+                        break
+                if match is None:
+                    scan = scan_end
+                    chunk = min(2 * chunk, SEGMENT_SIZE)
+                    if scan - literal_start >= SEGMENT_SIZE:
+                        emit_literal(image[literal_start:scan])
+                        literal_start = scan
+            if match is None:
+                break
+            pos = match
+
+        emit_literal(image[literal_start:pos])
+        emit_copy(offset)
+        pos += block_size
+        literal_start = pos
+
+    emit_literal(image[literal_start:image_size])
+    flush_copy()
+    write(bytes(ops))
+
+
+@contextlib.contextmanager
+def __map_file(file_path: str) -> typing.Iterator[typing.Union[bytes, mmap.mmap]]:
+    '''
+    Maps a file read only, empty files can not be mapped and are empty bytes
+    '''
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b''
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+
+def gen_delta(base_path: str, image_path: str, delta_path: str,
+              block_size: int = DEFAULT_BLOCK_SIZE) -> int:
+    '''
+    Generates a binary delta that rebuilds an image from an older version of it, blocks
+    of the base image found anywhere in the new image (rsync rolling checksum) are copied,
+    everything else is carried in the delta, the ops are zlib compressed
+        - both images are memory mapped and the ops are compressed as they are made, memory
+          is bounded by the index of the base blocks, not by the image sizes
+        Parameters:
+            base_path (str): the image the vehicle has installed
+            image_path (str): the new image
+            delta_path (str): path to write the delta to
+            block_size (int) [Optional, Default: 2048]: size of the matched blocks
+
+        Returns:
+            int: size of the delta file
+    '''
+    with __map_file(base_path) as base:
+        index = __index_base(base, block_size)
+
+    compressor = zlib.compressobj(9)
+    with __map_file(image_path) as image, open(delta_path, 'wb') as f:
+        f.write(DELTA_MAGIC)
+        f.write(__HEADER.pack(DELTA_FORMAT_VERSION, len(image)))
+        __encode_ops(image, index, block_size, lambda ops: f.write(compressor.compress(ops)))
+        f.write(compressor.flush())
+
+    return os.path.getsize(delta_path)
+
+
+def __inflater(f: typing.BinaryIO) -> typing.Callable[[int], bytes]:
+    '''
+    Reader of the zlib compressed ops of a delta, inflates no more than SEGMENT_SIZE bytes
+    beyond what is read
+
+        Raises:
+            zlib.error - the ops are corrupt
+    '''
+    decompressor = zlib.decompressobj()
+    pending = bytearray()
+
+    def read(size: int) -> bytes:
+        while len(pending) < size and not decompressor.eof:
+            data = decompressor.unconsumed_tail or f.read(SEGMENT_SIZE)
+            if not len(data):
+                raise zlib.error('the ops are cut short')
+            pending.extend(decompressor.decompress(data, SEGMENT_SIZE))
+        data = bytes(pending[:size])
+        del pending[:size]
+        return data
+
+    return read
+
+
+def apply_delta(base_path: str, delta_path: str, out_path: str) -> None:
+    '''
+    Rebuilds an image from its base image and a delta, the ops are inflated and applied as
+    they are read, memory does not grow with the image size
+        Parameters:
+            base_path (str): the image the delta was generated against
+            delta_path (str): the delta
+            out_path (str): path to write the rebuilt image to
+
+        Raises:
+            ValueError - the delta is corrupt or does not match the base image
+    '''
+    try:
+        with open(delta_path, 'rb') as f, open(base_path, 'rb') as base, open(out_path, 'wb') as out:
+            if f.read(len(DELTA_MAGIC)) != DELTA_MAGIC:
+                raise ValueError(f'{delta_path} is not a delta file')
+            version, image_size = __HEADER.unpack(f.read(__HEADER.size))
+            if version != DELTA_FORMAT_VERSION:
+                raise ValueError(f'unsupported delta format version {version}')
+
+            read_ops = __inflater(f)
+            while True:
+                op = read_ops(1)
+                if not len(op):
+                    break
+                if op[0] == OP_COPY:
+                    offset, length = __COPY.unpack(read_ops(__COPY.size))
+                    base.seek(offset)
+                    while length > 0:
+                        data = base.read(min(length, SEGMENT_SIZE))
+                        if not len(data):
+                            raise ValueError('delta copies past the end of the base image')
+                        out.write(data)
+                        length -= len(data)
+                elif op[0] == OP_LITERAL:
+                    (length,) = __LITERAL.unpack(read_ops(__LITERAL.size))
+                    while length > 0:
+                        data = read_ops(min(length, SEGMENT_SIZE))
+                        if not len(data):
+                            raise ValueError('delta literal is cut short')
+                        out.write(data)
+                        length -= len(data)
+                else:
+                    raise ValueError(f'unknown delta op {op[0]:#x}')
+
+                if out.tell() > image_size:
+                    raise ValueError('rebuilt image size does not match the delta')
+
+            if out.tell() != image_size:
+                raise ValueError('rebuilt image size does not match the delta')
+    except (ValueError, struct.error, zlib.error) as e:
+        if os.path.exists(out_path):
+            os.remove(out_path)
+        if isinstance(e, zlib.error):
+            raise ValueError(f'{delta_path} is corrupt') from e
+        raise ValueError(str(e)) from e
+
+
+def apply_delta_update(targets_signed: typing.Dict[str, typing.Any], base_version: str,
+                       base_path: str, delta_path: str, out_path: str) -> None:
+    '''
+    Applies a delta listed in verified targets metadata, the delta is checked against its
+    hash before it is applied and the rebuilt image against the full image hash
+        Parameters:
+            targets_signed (Dict[str, Any]): signed part of verified targets metadata
+            base_version (str): image version the vehicle has installed
+            base_path (str): the installed image
+            delta_path (str): the downloaded delta
+            out_path (str): path to write the rebuilt image to
+
+        Raises:
+            KeyError - the targets metadata has no delta from base_version
+            ValueError - the delta is corrupt
+            uptane.error.general.FileHashNoMatch
+    '''
+    delta = targets_signed["image_deltas"][base_version]
+    hashf = uptane.crypto.hash.HashFunc.sha256
+    if os.path.getsize(delta_path) != int(delta["delta_size"]) or \
+            uptane.crypto.hash.get_file_hash(delta_path, hashf) != delta["delta_hash"]:
+        raise uptane.error.general.FileHashNoMatch
+
+    apply_delta(base_path, delta_path, out_path)
+    if uptane.crypto.hash.get_file_hash(out_path, hashf) != targets_signed["image_hash"]:
+        os.remove(out_path)
+        raise uptane.error.general.FileHashNoMatch
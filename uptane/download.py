@@ -0,0 +1,116 @@
+# file for downloading the images listed in verified targets metadata
+#   - an image signed with a merkle root (image cfg _chunk_size) is verified chunk by chunk
+#     while it downloads, the download stops at the first corrupt chunk and a download that
+#     was cut off continues after its last good chunk
+#   - any other image is hashed while it downloads and checked against its image_hash
+import os
+import typing
+import urllib.request
+import uptane.crypto.hash
+import uptane.error.general
+
+DOWNLOAD_BUFSIZE = 65536
+DOWNLOAD_TIMEOUT = 60  # seconds without data before a download fails
+
+
+def __open_url(url: str, offset: int, timeout: float) -> typing.Any:
+    '''
+    Opens a url, from offset with a range request when offset is not 0
+    '''
+    request = urllib.request.Request(url)
+    if offset:
+        request.add_header("Range", f'bytes={offset}-')
+    return urllib.request.urlopen(request, timeout=timeout)
+
+
+def get_chunk_hashes(chunks_url: str, chunk_count: int,
+                     timeout: float = DOWNLOAD_TIMEOUT) -> typing.List[str]:
+    '''
+    Downloads the chunk hashes of an image, one hash per line, at most chunk_count are read
+        Returns:
+            List[str]: the hash of every chunk, in file order
+    '''
+    # a hex sha256 and its line break per chunk, a longer answer can not match the merkle root
+    with __open_url(chunks_url, 0, timeout) as response:
+        data = response.read(chunk_count * 65 + 1)
+    return data.decode('ascii').split()
+
+
+def download_image(targets_signed: typing.Dict[str, typing.Any], out_path: str,
+                   timeout: float = DOWNLOAD_TIMEOUT) -> None:
+    '''
+    Downloads the image of verified targets metadata, the download is kept in
+    <out_path>.part until it is verified and then renamed to out_path
+        Parameters:
+            targets_signed (Dict[str, Any]): signed part of verified targets metadata
+            out_path (str): path to write the image to
+            timeout (float) [Optional, Default: DOWNLOAD_TIMEOUT]: seconds without data before
+            the download fails
+
+        Raises:
+            uptane.error.general.FileHashNoMatch - the image or its chunk hashes do not match
+            the metadata
+            urllib.error.URLError
+    '''
+    part_path = f'{out_path}.part'
+    if "image_merkle_root" in targets_signed:
+        __download_chunked(targets_signed, part_path, timeout)
+    else:
+        __download_whole(targets_signed, part_path, timeout)
+    os.replace(part_path, out_path)
+
+
+def __download_chunked(targets_signed: typing.Dict[str, typing.Any], part_path: str, timeout: float) -> None:
+    '''
+    Downloads an image chunk by chunk, only verified chunks are written to part_path
+    '''
+    file_size = int(targets_signed["image_size"])
+    chunk_size = int(targets_signed["image_chunk_size"])
+    chunk_hashes = get_chunk_hashes(targets_signed["image_chunks_url"], -(-file_size // chunk_size), timeout)
+    verifier = uptane.crypto.hash.ChunkVerifier(targets_signed["image_merkle_root"], chunk_hashes, chunk_size,
+                                                file_size, uptane.crypto.hash.HashFunc.sha256)
+
+    offset = verifier.resume(part_path) if os.path.exists(part_path) else 0
+    with open(part_path, 'ab') as part_file:
+        if not verifier.finished():
+            with __open_url(targets_signed["image_url"], offset, timeout) as response:
+                if offset and response.status != 206:
+                    # the server sent the whole image, start over
+                    part_file.truncate(0)
+                    verifier.resume(part_path)
+                while not verifier.finished():
+                    data = response.read(DOWNLOAD_BUFSIZE)
+                    if not len(data):
+                        break
+                    part_file.write(verifier.feed(data))
+
+    if not verifier.finished():
+        # cut off, the verified chunks are kept for the next attempt
+        raise uptane.error.general.FileHashNoMatch
+
+
+def __download_whole(targets_signed: typing.Dict[str, typing.Any], part_path: str, timeout: float) -> None:
+    '''
+    Downloads an image to part_path while hashing it, the file is removed when it does
+    not match
+    '''
+    file_size = int(targets_signed["image_size"])
+    try:
+        with __open_url(targets_signed["image_url"], 0, timeout) as response, open(part_path, 'wb') as f:
+            part_file = uptane.crypto.hash.HashingWriter(f, uptane.crypto.hash.HashFunc.sha256, file_size)
+            while True:
+                data = response.read(DOWNLOAD_BUFSIZE)
+                if not len(data):
+                    break
+                part_file.write(data)
+    except uptane.error.general.FileSizeLimitExceeded as e:
+        os.remove(part_path)
+        raise uptane.error.general.FileHashNoMatch from e
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+
+    if part_file.size != file_size or part_file.hexdigest() != targets_signed["image_hash"]:
+        os.remove(part_path)
+        raise uptane.error.general.FileHashNoMatch
@@ -24,3 +24,27 @@ class MetadataFileInvalidSignature(Error):
     '''
     Raised when signature of metadata file is invalid
     '''
+
+
+class FileSizeLimitExceeded(Error):
+    '''
+    Raised when a file is larger than the allowed size
+    '''
+
+
+class MetadataRollback(Error):
+    '''
+    Raised when metadata is older than the metadata it replaces
+    '''
+
+
+class DuplicateImageName(Error):
+    '''
+    Raised when two targets metadata files describe the same image
+    '''
+
+
+class InvalidThreshold(Error):
+    '''
+    Raised when a role in root metadata needs fewer than one signature
+    '''
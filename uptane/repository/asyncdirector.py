@@ -0,0 +1,181 @@
+# asyncio director repo
+#   - one event loop serves all vehicle connections, no thread per connection
+#   - signing, hashing and zipping of bundles run on a bounded process pool, the roles and
+#     keys are loaded once in every worker process
+#   - at most max_pending bundles are queued for the pool, vehicles polling above that get
+#     a 503 with Retry-After instead of piling up on the loop
+#   - a manifest that is not a json object gets a 400, an up to date vehicle a 204, a failed
+#     bundle a 500, and a 503 while a pool whose worker died is replaced
+#   - the server does not start when the workers can not load the roles
+import asyncio
+import concurrent.futures
+import concurrent.futures.process
+import json
+import os
+import typing
+import uptane.repository.directorrepo
+
+DEFAULT_MAX_PENDING = 256
+RETRY_AFTER = 5  # seconds, sent to vehicles turned away by backpressure
+
+try:
+    from aiohttp import web  # optional, only needed for the async director
+except ImportError:
+    web = None
+
+
+class DirectorService:
+    '''
+    Bundle generation for the async director, runs gen_vehicle_bundle of the director repo
+    on a process pool and bounds how many requests wait for it
+    '''
+
+    def __init__(self, init_args: typing.Tuple, workers: typing.Optional[int] = None,
+                 max_pending: int = DEFAULT_MAX_PENDING) -> None:
+        '''
+            Parameters:
+                init_args (Tuple): arguments of directorrepo.init_server, called in every worker
+                workers (int) [Optional]: worker processes, defaults to the cpu count
+                max_pending (int) [Optional, Default: DEFAULT_MAX_PENDING]: bundles queued for
+                the workers before requests are rejected
+        '''
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self.served = 0
+        self.restarts = 0
+        self.init_args = init_args
+        self.__executor = self.__new_executor()
+
+    def __new_executor(self) -> concurrent.futures.ProcessPoolExecutor:
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers, initializer=uptane.repository.directorrepo.init_server,
+            initargs=self.init_args)
+
+    async def start(self) -> None:
+        '''
+        Starts the workers, one task per worker has to run
+
+            Raises:
+                concurrent.futures.process.BrokenProcessPool - a worker could not load the roles
+        '''
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.__executor, os.getpid) for _ in range(self.workers)))
+
+    def try_acquire(self) -> bool:
+        '''
+        Takes a slot for a bundle, False when max_pending bundles are already queued
+        '''
+        # only called from the event loop thread, no lock needed
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            return False
+        self.pending += 1
+        return True
+
+    async def gen_vehicle_bundle(self, vehicle_manifest: typing.Dict[str, typing.Any]) -> typing.Tuple[str, bytes]:
+        '''
+        Generates the bundle of a vehicle on the pool, a slot must be held (try_acquire)
+
+            Raises:
+                uptane.repository.directorrepo.UpToDate - the vehicle has nothing to install
+                concurrent.futures.process.BrokenProcessPool - a worker died, the pool is
+                replaced for the next requests
+        '''
+        executor = self.__executor
+        try:
+            loop = asyncio.get_running_loop()
+            bundle = await loop.run_in_executor(executor, \
+                     uptane.repository.directorrepo.gen_vehicle_bundle, vehicle_manifest)
+            self.served += 1
+            return bundle
+        except concurrent.futures.process.BrokenProcessPool:
+            # every request of the broken pool fails, only the first one replaces it
+            if executor is self.__executor:
+                self.__executor = self.__new_executor()
+                self.restarts += 1
+                executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        finally:
+            self.pending -= 1
+
+    def stats(self) -> typing.Dict[str, int]:
+        return {"workers": self.workers, "pending": self.pending, "max_pending": self.max_pending,
+                "served": self.served, "rejected": self.rejected, "restarts": self.restarts}
+
+    def close(self) -> None:
+        self.__executor.shutdown(wait=True, cancel_futures=True)
+
+
+def create_app(service: DirectorService) -> "web.Application":
+    '''
+    Creates the aiohttp app of the director, with the routes of the flask director repo
+
+        Raises:
+            ImportError - when aiohttp is not installed
+    '''
+    if web is None:
+        raise ImportError("the async director needs aiohttp, pip install aiohttp")
+
+    async def manifest(request: web.Request) -> web.Response:
+        if not service.try_acquire():
+            return web.json_response({"error": {"type": "busy"}}, status=503,
+                                     headers={"Retry-After": str(RETRY_AFTER)})
+        try:
+            body = await request.read()
+            vehicle_manifest = json.loads(body) if len(body) else {}
+            if not isinstance(vehicle_manifest, dict):
+                raise ValueError("the vehicle manifest is not a json object")
+        except Exception as e:
+            service.pending -= 1
+            return web.json_response({"error": {"type": str(e)}}, status=400)
+
+        try:
+            bundle_name, bundle = await service.gen_vehicle_bundle(vehicle_manifest)
+        except uptane.repository.directorrepo.UpToDate:
+            return web.Response(status=204)
+        except concurrent.futures.process.BrokenProcessPool:
+            return web.json_response({"error": {"type": "busy"}}, status=503,
+                                     headers={"Retry-After": str(RETRY_AFTER)})
+        except Exception as e:
+            return web.json_response({"error": {"type": str(e)}}, status=500)
+
+        return web.Response(body=bundle, content_type="application/zip", headers={
+            "Content-Disposition": f'attachment; filename={bundle_name}.zip'})
+
+    async def metrics(request: web.Request) -> web.Response:
+        # the caches of the roles live in the worker processes
+        return web.json_response({"service": service.stats()})
+
+    async def on_startup(app: web.Application) -> None:
+        # a broken pool fails the startup instead of every request
+        await service.start()
+
+    async def on_cleanup(app: web.Application) -> None:
+        service.close()
+
+    app = web.Application()
+    app.router.add_post('/manifest/', manifest)
+    app.router.add_get('/metrics/', metrics)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+def setup_server(root_metadata_file: str, timestamp_cfg: str, snapshot_cfg: str,
+                 targets_cfg: str, authpubkey: str, port: int = 8082,
+                 workers: typing.Optional[int] = None, max_pending: int = DEFAULT_MAX_PENDING,
+                 fleet_db: typing.Optional[str] = None):
+    '''
+    Serves the async director until interrupted
+
+        Raises:
+            ImportError - when aiohttp is not installed
+    '''
+    if web is None:
+        raise ImportError("the async director needs aiohttp, pip install aiohttp")
+
+    service = DirectorService((root_metadata_file, timestamp_cfg, snapshot_cfg, targets_cfg,
+                               authpubkey, fleet_db), workers, max_pending)
+    web.run_app(create_app(service), port=port)
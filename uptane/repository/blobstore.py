@@ -0,0 +1,258 @@
+# content addressed storage of the image repo
+#   - every file is stored once as a blob, objects/<hash[:2]>/<hash>, keyed by its sha256
+#     (the image_hash of the targets metadata), whatever repo or name it is published under
+#   - repo/name entries point at blobs, blobs count their entries and are garbage collected
+#     when no entry is left
+#   - published files are materialized in the repo tree as hardlinks of the blobs, reflinks
+#     when hardlinks are not possible, copies as a last resort, so publishing a release moves
+#     no data
+import errno
+import fcntl
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import typing
+import uptane.crypto.hash
+import uptane.error.general
+
+OBJECTS_DIR = "objects"
+DB_FILE = "blobs.db"
+# unreferenced blobs are kept this long, an upload putting a blob publishes it within this time
+GC_GRACE = 60 * 60  # seconds
+FICLONE = 0x40049409  # linux ioctl, reflink of a whole file
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY, size INTEGER NOT NULL, refcount INTEGER NOT NULL DEFAULT 0,
+    touched REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS blobs_refcount ON blobs (refcount);
+CREATE TABLE IF NOT EXISTS entries (
+    repo TEXT NOT NULL, name TEXT NOT NULL, hash TEXT NOT NULL,
+    PRIMARY KEY (repo, name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entries_hash ON entries (hash);
+'''
+
+
+def link_or_copy(src_path: str, dst_path: str) -> str:
+    '''
+    Materializes a file, a hardlink, else a reflink, else a copy
+        Returns:
+            str: "hardlink", "reflink" or "copy"
+    '''
+    try:
+        os.link(src_path, dst_path)
+        return "hardlink"
+    except OSError as e:
+        # other filesystem, link count limit or links not supported
+        if e.errno not in (errno.EXDEV, errno.EMLINK, errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP):
+            raise
+
+    with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return "reflink"
+        except OSError:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+            return "copy"
+
+
+class BlobStore:
+    '''
+    Content addressed blob store with reference counted repo/name entries, safe to share
+    between threads and worker processes
+    '''
+
+    def __init__(self, root: str) -> None:
+        '''
+        Opens or creates a blob store
+            Parameters:
+                root (str): directory of the store, should be on the filesystem of the repo
+                tree so blobs can be hardlinked into it
+        '''
+        self.root = root
+        os.makedirs(os.path.join(root, OBJECTS_DIR), exist_ok=True)
+        self.__local = threading.local()
+        self.__conn().executescript(SCHEMA)
+
+    def __conn(self) -> sqlite3.Connection:
+        conn = getattr(self.__local, "conn", None)
+        # sqlite connections must not be shared with forked worker processes
+        if conn is None or self.__local.pid != os.getpid():
+            conn = sqlite3.connect(os.path.join(self.root, DB_FILE), isolation_level=None, timeout=60)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.__local.conn = conn
+            self.__local.pid = os.getpid()
+        return conn
+
+    def blob_path(self, blob_hash: str) -> str:
+        return os.path.join(self.root, OBJECTS_DIR, blob_hash[:2], blob_hash)
+
+    def put_file(self, file_path: str, blob_hash: str) -> bool:
+        '''
+        Moves a file into the store, the file is dropped when the blob is already stored
+            Parameters:
+                file_path (str): file to store, it is moved or removed
+                blob_hash (str): sha256 of the file
+
+            Returns:
+                bool: True when the blob was new, False when it was deduplicated
+
+            Raises:
+                uptane.error.general.FileHashNoMatch - a new blob does not hash to blob_hash
+        '''
+        conn = self.__conn()
+        blob_path = self.blob_path(blob_hash)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        # the file is moved out of the caller's reach before it is hashed, a new blob is
+        # stored under the hash of its bytes, whatever the caller says it is
+        tmp_path = f'{blob_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            try:
+                os.replace(file_path, tmp_path)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                shutil.move(file_path, tmp_path)
+            # blobs are shared by every hardlink, they must never be written in place
+            os.chmod(tmp_path, 0o444)
+
+            verified = False
+            if not os.path.exists(blob_path):
+                self.__verify_blob(tmp_path, blob_hash)
+                verified = True
+
+            # serialized with gc, a blob being put is never collected
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("INSERT INTO blobs (hash, size, touched) VALUES (?, ?, ?) "
+                             "ON CONFLICT (hash) DO UPDATE SET touched = excluded.touched",
+                             (blob_hash, os.path.getsize(tmp_path), time.time()))
+                new = not os.path.exists(blob_path)
+                if new:
+                    # collected since it was checked
+                    if not verified:
+                        self.__verify_blob(tmp_path, blob_hash)
+                    os.replace(tmp_path, blob_path)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return new
+
+    @staticmethod
+    def __verify_blob(file_path: str, blob_hash: str) -> None:
+        if uptane.crypto.hash.get_file_hash(file_path, uptane.crypto.hash.HashFunc.sha256) != blob_hash:
+            raise uptane.error.general.FileHashNoMatch(f'{file_path} does not hash to {blob_hash}')
+
+    def publish(self, repo: str, entries: typing.Dict[str, str]) -> typing.List[str]:
+        '''
+        Points repo/name entries at stored blobs in one transaction, the whole upload is
+        published or nothing is
+            Parameters:
+                repo (str): name of the sub repo
+                entries (Dict[str, str]): file name -> blob hash
+
+            Returns:
+                List[str]: hashes of the blobs that are no longer referenced
+
+            Raises:
+                KeyError - a blob is not in the store
+        '''
+        conn = self.__conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            released = []
+            for name in entries:
+                blob_hash = entries[name]
+                if conn.execute("UPDATE blobs SET refcount = refcount + 1 WHERE hash = ?",
+                                (blob_hash,)).rowcount != 1:
+                    raise KeyError(f'blob {blob_hash} is not stored')
+                row = conn.execute("SELECT hash FROM entries WHERE repo = ? AND name = ?",
+                                   (repo, name)).fetchone()
+                if row is not None:
+                    conn.execute("UPDATE blobs SET refcount = refcount - 1, touched = ? WHERE hash = ?",
+                                 (time.time(), row[0]))
+                    released.append(row[0])
+                conn.execute("INSERT OR REPLACE INTO entries (repo, name, hash) VALUES (?, ?, ?)",
+                             (repo, name, blob_hash))
+            unreferenced = [blob_hash for blob_hash in released if conn.execute(
+                "SELECT refcount FROM blobs WHERE hash = ?", (blob_hash,)).fetchone()[0] == 0]
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return unreferenced
+
+    def materialize(self, blob_hash: str, dst_path: str) -> str:
+        '''
+        Replaces dst_path with the blob, readers see the old or the new file, never a partial one
+            Returns:
+                str: "hardlink", "reflink" or "copy"
+        '''
+        blob_path = self.blob_path(blob_hash)
+        # rename does nothing when both paths are links of the same file
+        if os.path.exists(dst_path) and os.path.samefile(blob_path, dst_path):
+            return "hardlink"
+
+        tmp_path = f'{dst_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            method = link_or_copy(blob_path, tmp_path)
+            os.replace(tmp_path, dst_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return method
+
+    def lookup(self, repo: str, name: str) -> typing.Optional[str]:
+        '''
+        Get the blob hash of a published file, None when it was not published to the store
+        '''
+        row = self.__conn().execute("SELECT hash FROM entries WHERE repo = ? AND name = ?",
+                                    (repo, name)).fetchone()
+        return None if row is None else row[0]
+
+    def gc(self, grace: float = GC_GRACE) -> typing.Tuple[int, int]:
+        '''
+        Removes blobs without entries that were not used for grace seconds
+            Returns:
+                Tuple[int, int]: number of blobs removed and bytes freed
+        '''
+        conn = self.__conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute("SELECT hash, size FROM blobs WHERE refcount = 0 AND touched < ?",
+                                (time.time() - grace,)).fetchall()
+            for blob_hash, _ in rows:
+                try:
+                    os.remove(self.blob_path(blob_hash))
+                except FileNotFoundError:
+                    pass
+            conn.executemany("DELETE FROM blobs WHERE hash = ?", ((row[0],) for row in rows))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return len(rows), sum(row[1] for row in rows)
+
+    def stats(self) -> typing.Dict[str, int]:
+        blobs, size = self.__conn().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        entries, published = self.__conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries JOIN blobs USING (hash)").fetchone()
+        return {"blobs": blobs, "blob_bytes": size, "entries": entries, "published_bytes": published}
+
+    def close(self) -> None:
+        '''
+        Closes the connection of the calling thread
+        '''
+        conn = getattr(self.__local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self.__local.conn = None
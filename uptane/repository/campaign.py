@@ -0,0 +1,344 @@
+# rollout campaigns of the director: the metadata of every vehicle of a campaign is signed
+# ahead of time instead of per request
+#   - vehicles are resolved against the fleet store, vehicles that resolve to the same update
+#     manifest share one set of signed targets and snapshot metadata, only the timestamp is
+#     signed per vehicle
+#   - signing runs on a process pool, the online roles are loaded once per worker
+#   - metadata is written to a content addressed store, objects/<hash[:2]>/<hash>
+#   - journal.jsonl records every signed set of shared metadata and every finished vehicle
+#     with the expiry of its timestamp, a campaign that was interrupted resumes from it, and
+#     vehicles whose timestamp or shared metadata is about to expire are signed again
+#
+# campaign definition (toml)
+#   name = "campaign name"
+#   vins_file = "vins.txt"   # optional, one vin per line, every vehicle of the fleet otherwise
+#   [assign]                 # optional, ecu id -> image hash installed by the campaign
+#   ecu1 = "813dad70..."
+import concurrent.futures
+import json
+import os
+import time
+import typing
+import tomli
+import uptane.crypto.hash
+import uptane.repository.directorrepo
+import uptane.repository.fleetstore
+import uptane.repository.metadatacache
+
+DEFAULT_CHUNK_SIZE = 256  # vehicles resolved at once, and timestamps signed per task
+PROGRESS_INTERVAL = 5  # seconds
+JOURNAL_FILE = "journal.jsonl"
+OBJECTS_DIR = "objects"
+
+
+class VehicleEntry(typing.NamedTuple):
+    '''
+    Finished vehicle of the journal
+        digest (str | None): update manifest digest of its shared metadata, None when the
+        vehicle is up to date
+        expires (int | None): expiry epoch of its timestamp, None when the vehicle is up to date
+    '''
+    digest: typing.Optional[str]
+    expires: typing.Optional[int]
+
+
+class SharedMetadata(typing.NamedTuple):
+    '''
+    Signed targets and snapshot metadata of one update manifest in the object store
+        targets (Dict[str, str]): targets metadata file name -> object hash
+        snapshot_name (str): snapshot metadata file name
+        snapshot (str): object hash of the snapshot
+        expires (int): earliest expiry epoch of the targets and snapshot metadata
+    '''
+    targets: typing.Dict[str, str]
+    snapshot_name: str
+    snapshot: str
+    expires: int
+
+
+def object_path(out_dir: str, object_hash: str) -> str:
+    return os.path.join(out_dir, OBJECTS_DIR, object_hash[:2], object_hash)
+
+
+def put_object(out_dir: str, data: bytes) -> str:
+    '''
+    Writes data to the object store of a campaign, an object that exists is not rewritten
+        Returns:
+            str: sha256 hash of the data, its name in the store
+    '''
+    object_hash = uptane.crypto.hash.get_bytes_hash(data, uptane.crypto.hash.HashFunc.sha256)
+    path = object_path(out_dir, object_hash)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # workers may write the same object, the rename is atomic
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    return object_hash
+
+
+def get_object(out_dir: str, object_hash: str) -> bytes:
+    with open(object_path(out_dir, object_hash), 'rb') as f:
+        return f.read()
+
+
+# state of a worker process
+WORKER_OUT_DIR: str
+
+
+def init_worker(out_dir: str, timestamp_cfg: str, snapshot_cfg: str, targets_cfg: str,
+                fleet_db: str) -> None:
+    '''
+    Loads the online roles in a worker process
+    '''
+    global WORKER_OUT_DIR
+    WORKER_OUT_DIR = out_dir
+    uptane.repository.directorrepo.init_server(None, timestamp_cfg, snapshot_cfg, targets_cfg, "",
+                                               fleet_db)
+
+
+def sign_shared(update_manifest: typing.Dict[str, typing.Any]) -> SharedMetadata:
+    '''
+    Signs the targets and snapshot metadata of an update manifest, runs in a worker
+    '''
+    cached_metadata = uptane.repository.directorrepo.gen_targets_snapshot_metadata(update_manifest)
+    targets = {name: put_object(WORKER_OUT_DIR, cached_metadata.targets[name])
+               for name in cached_metadata.targets}
+    return SharedMetadata(targets=targets, snapshot_name=cached_metadata.snapshot_name,
+                          snapshot=put_object(WORKER_OUT_DIR, cached_metadata.snapshot),
+                          expires=cached_metadata.expires)
+
+
+def sign_timestamps(snapshot_hash: str, snapshot_expires: int,
+                    vins: typing.List[str]) -> typing.List[typing.Tuple[str, str, int]]:
+    '''
+    Signs the timestamps of vehicles sharing a snapshot, runs in a worker
+        Returns:
+            List[Tuple[str, str, int]]: (vin, object hash of the timestamp, its expiry epoch)
+    '''
+    timestamp_role = uptane.repository.directorrepo.TIMESTAMP
+    snapshot = get_object(WORKER_OUT_DIR, snapshot_hash)
+    timestamps = []
+    for vin in vins:
+        signed_dict = timestamp_role.build_signed_dict(snapshot, vin, snapshot_expires)
+        timestamps.append((vin, put_object(WORKER_OUT_DIR, timestamp_role.sign_signed_dict(signed_dict)),
+                           int(signed_dict["expires"])))
+    return timestamps
+
+
+def load_journal(out_dir: str) -> typing.Tuple[typing.Dict[str, SharedMetadata], typing.Dict[str, VehicleEntry]]:
+    '''
+    Reads the journal of a campaign, the last entry of a vehicle signed more than once wins
+        Returns:
+            Tuple[Dict[str, SharedMetadata], Dict[str, VehicleEntry]]: shared metadata by
+            update manifest digest, and the vehicles that are done by vin
+    '''
+    shared = {}
+    done = {}
+    journal_path = os.path.join(out_dir, JOURNAL_FILE)
+    if not os.path.exists(journal_path):
+        return shared, done
+
+    with open(journal_path, 'r') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # the last line of an interrupted run may be cut short
+                continue
+            if "shared" in entry:
+                shared[entry["shared"]] = SharedMetadata(entry["targets"], entry["snapshot_name"],
+                                                         entry["snapshot"], entry["expires"])
+            elif entry["digest"] is None:
+                done[entry["vin"]] = VehicleEntry(None, None)
+            else:
+                # journals written before timestamp expiries were recorded are signed again
+                done[entry["vin"]] = VehicleEntry(entry["digest"], entry.get("expires", 0))
+    return shared, done
+
+
+def truncate_journal(out_dir: str) -> None:
+    '''
+    Drops the last line of the journal when an interrupted run cut it short, entries appended
+    after it would be lost with it
+    '''
+    journal_path = os.path.join(out_dir, JOURNAL_FILE)
+    if not os.path.exists(journal_path):
+        return
+
+    with open(journal_path, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        size = end
+        while end > 0:
+            start = max(0, end - 65536)
+            f.seek(start)
+            block = f.read(end - start)
+            if end == size and block.endswith(b"\n"):
+                return
+            newline = block.rfind(b"\n")
+            if newline != -1:
+                f.truncate(start + newline + 1)
+                return
+            end = start
+        f.truncate(0)
+
+
+def is_expiring(expires: int) -> bool:
+    '''
+    True when metadata expires within the expiry margin of the metadata cache
+    '''
+    return expires - uptane.repository.metadatacache.EXPIRY_MARGIN <= time.time()
+
+
+class Campaign:
+    '''
+    Pre-signs the metadata of every vehicle of a campaign
+    '''
+
+    def __init__(self, campaign_cfg: str, fleet_db: str, out_dir: str, timestamp_cfg: str,
+                 snapshot_cfg: str, targets_cfg: str, workers: typing.Optional[int] = None,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE) -> None:
+        '''
+            Parameters:
+                campaign_cfg (str): path to the campaign definition
+                fleet_db (str): path to the fleet store of the director
+                out_dir (str): output store, reused to resume a campaign
+                timestamp_cfg, snapshot_cfg, targets_cfg (str): online role configs
+                workers (int) [Optional]: worker processes, defaults to the cpu count
+                chunk_size (int) [Optional, Default: DEFAULT_CHUNK_SIZE]: vehicles per task
+
+            Raises:
+                FileNotFoundError
+                tomli.TOMLDecodeError
+        '''
+        with open(campaign_cfg, 'rb') as f:
+            cfg = tomli.load(f)
+        self.name = cfg.get("name", os.path.basename(campaign_cfg))
+        self.vins_file = cfg.get("vins_file")
+        self.assign = cfg.get("assign", {})
+
+        self.fleet_db = fleet_db
+        self.out_dir = out_dir
+        self.role_cfgs = (timestamp_cfg, snapshot_cfg, targets_cfg)
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+
+        self.signed = 0
+        self.up_to_date = 0
+        self.skipped = 0
+        self.resigned = 0
+        self.shared_signed = 0
+
+    def __vins(self) -> typing.Iterator[str]:
+        if self.vins_file is None:
+            yield from uptane.repository.fleetstore.FleetStore(self.fleet_db).vins()
+            return
+        with open(self.vins_file, 'r') as f:
+            for line in f:
+                if len(line.strip()):
+                    yield line.strip()
+
+    def __chunks(self, done: typing.Dict[str, VehicleEntry],
+                 shared: typing.Dict[str, SharedMetadata]) -> typing.Iterator[typing.List[str]]:
+        chunk = []
+        for vin in self.__vins():
+            entry = done.get(vin)
+            if entry is not None:
+                # up to date, or signed with metadata that is still valid
+                if entry.digest is None or (entry.digest in shared and not is_expiring(entry.expires)):
+                    self.skipped += 1
+                    continue
+                self.resigned += 1
+            chunk.append(vin)
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if len(chunk):
+            yield chunk
+
+    def run(self, progress: typing.Optional[typing.Callable[[str], None]] = print) -> float:
+        '''
+        Signs the metadata of every vehicle of the campaign not yet in the journal, or whose
+        timestamp or shared metadata in the journal is about to expire
+            Parameters:
+                progress (Callable[[str], None]) [Optional, Default: print]: progress output
+
+            Returns:
+                float: vehicle bundles signed per second
+        '''
+        os.makedirs(os.path.join(self.out_dir, OBJECTS_DIR), exist_ok=True)
+        shared, done = load_journal(self.out_dir)
+        truncate_journal(self.out_dir)
+        # shared metadata about to expire is signed again
+        shared = {digest: shared[digest] for digest in shared if not is_expiring(shared[digest].expires)}
+        store = uptane.repository.fleetstore.FleetStore(self.fleet_db)
+
+        start = time.perf_counter()
+        last_progress = start
+        with open(os.path.join(self.out_dir, JOURNAL_FILE), 'a') as journal, \
+             concurrent.futures.ProcessPoolExecutor(max_workers=self.workers,
+                 initializer=init_worker, initargs=(self.out_dir, *self.role_cfgs, self.fleet_db)) as executor:
+            pending: typing.Dict[concurrent.futures.Future, str] = {}
+
+            def journal_done(futures: typing.Iterable[concurrent.futures.Future]) -> None:
+                for future in futures:
+                    digest = pending.pop(future)
+                    for vin, timestamp_hash, expires in future.result():
+                        journal.write(json.dumps({"vin": vin, "digest": digest,
+                                                  "timestamp": timestamp_hash, "expires": expires}) + "\n")
+                        self.signed += 1
+                journal.flush()
+
+            for chunk in self.__chunks(done, shared):
+                if len(self.assign):
+                    store.import_assignments((self.assign[ecu_id], vin, ecu_id)
+                                             for vin in chunk for ecu_id in self.assign)
+
+                # group the vehicles of the chunk by update manifest
+                groups: typing.Dict[str, typing.List[str]] = {}
+                manifests = {}
+                for vin in chunk:
+                    update_manifest = store.get_update_manifest(vin)
+                    if not len(update_manifest):
+                        journal.write(json.dumps({"vin": vin, "digest": None}) + "\n")
+                        self.up_to_date += 1
+                        continue
+                    digest = uptane.repository.metadatacache.manifest_digest(update_manifest)
+                    groups.setdefault(digest, []).append(vin)
+                    manifests[digest] = update_manifest
+
+                # every update manifest is signed once for the whole campaign
+                new_digests = [digest for digest in groups if digest not in shared]
+                for digest, metadata in zip(new_digests, executor.map(sign_shared,
+                                            [manifests[digest] for digest in new_digests])):
+                    shared[digest] = metadata
+                    journal.write(json.dumps({"shared": digest, **metadata._asdict()}) + "\n")
+                    self.shared_signed += 1
+                journal.flush()
+
+                for digest in groups:
+                    pending[executor.submit(sign_timestamps, shared[digest].snapshot, shared[digest].expires,
+                                            groups[digest])] = digest
+
+                # bound the queued work so the vins are streamed, not loaded at once
+                while len(pending) > 2 * self.workers:
+                    finished, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    journal_done(finished)
+
+                if progress is not None and time.perf_counter() - last_progress >= PROGRESS_INTERVAL:
+                    last_progress = time.perf_counter()
+                    progress(f"{self.signed} bundles signed "
+                             f"({self.signed / (last_progress - start):.0f} bundles/s)")
+
+            journal_done(list(concurrent.futures.as_completed(pending)))
+
+        store.close()
+        elapsed = time.perf_counter() - start
+        rate = self.signed / elapsed if elapsed > 0 else 0.0
+        if progress is not None:
+            progress(f"campaign {self.name}: {self.signed} bundles signed in {elapsed:.2f} s "
+                     f"({rate:.0f} bundles/s), {self.shared_signed} shared targets/snapshot sets, "
+                     f"{self.up_to_date} vehicles up to date, {self.skipped} done before, "
+                     f"{self.resigned} signed again")
+        return rate
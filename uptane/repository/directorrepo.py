@@ -1,29 +1,46 @@
 import flask
-import os
 import json
 import uptane.verify
 import uptane.roles.targets
 import uptane.roles.snapshot
 import uptane.roles.timestamp
+import uptane.repository.metadatacache
+import uptane.repository.fleetstore
+import uptane.crypto.sign
+import uptane.time
 import typing
 import uuid
-import shutil
-import subprocess
+import io
+import zipfile
 
 directorrepo = flask.Flask(__name__)
-directorrepo.config["MANIFEST_JSON"] = "manifest.json"
-# read json file -> dict
-MANIFEST_DICT:typing.Dict[str, typing.Any]
+directorrepo.config["FLEET_DB"] = "fleet.db"
+# fleet inventory, what every vehicle has installed and should install next
+FLEET_STORE: uptane.repository.fleetstore.FleetStore
 
-def get_update_manifest(manifest: typing.Any):
+
+class UpToDate(Exception):
+    '''
+    Raised when a vehicle has nothing to install
     '''
-    Function that returns the next manifest by reading the manifest.json file
-        - if no new update is present, returns False, else true
-        - updates manifest in place
+
+    def __str__(self) -> str:
+        return "up-to-date"
+
+
+def get_update_manifest(vehicle_manifest: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Dict[str, typing.Any]]:
+    '''
+    Function that returns the next manifest of a vehicle from the fleet store, the images the
+    manifest reports installed are not recorded, its ecu signatures are not verified
+        Parameters:
+            vehicle_manifest (Dict[str, Any]): the manifest sent by the vehicle, with its vin
+
+        Returns:
+            Dict[str, Dict[str, Any]]: ecu id -> image to install, empty when up to date
     '''
     # manifest return structure
     #   {
-    #       ecu1-image-hash:{
+    #       ecu1:{
     #       image_name:
     #       image_url: http://ip:port/repo/reponame/image
     #       image_size:
@@ -33,41 +50,13 @@ def get_update_manifest(manifest: typing.Any):
     #       image_sig_algo:
     #       image_version:
     #       },
-    #       ecu2-image-hash:{}
+    #       ecu2:{}
     #
     #   }
-    #for ecu_hash in manifest:
-    #    if not MANIFEST_DICT.get(ecu_hash, False):
-    #        return False
-    #    manifest[ecu_hash] = MANIFEST_DICT[ecu_hash]
-
-    #return True
-    ret_dict = {}
-    ret_dict_ecu1 = {}
-    ret_dict_ecu1["image_name"] = "test_image"
-    ret_dict_ecu1["image_url"] = "http://autosec.com/repo/temp/test_image"
-    ret_dict_ecu1["image_size"] = 47
-    ret_dict_ecu1["image_hash"] = "813dad70c91f0756de80a76d91dbc986bdc1090c98cb37f9cf3b53709b0e3421"
-    ret_dict_ecu1["image_hash_func"] = "sha256"
-    ret_dict_ecu1["image_buf_size"] = 65536
-    ret_dict_ecu1["image_sig_algo"] = "eddsa"
-    ret_dict_ecu1["image_version"] = "0.0.1"
-
-    ret_dict_ecu2 = {}
-    ret_dict_ecu2["image_name"] = "test_image2"
-    ret_dict_ecu2["image_url"] = "http://autosec.com/repo/remp/test_image2"
-    ret_dict_ecu2["image_size"] = 47
-    ret_dict_ecu2["image_hash"] = "813dad70c91f0756de80a76d91dbc986bdc1090c98cb37f9cf3b53709b0e3421"
-    ret_dict_ecu2["image_hash_func"] = "sha256"
-    ret_dict_ecu2["image_buf_size"] = 65536
-    ret_dict_ecu2["image_sig_algo"] = "eddsa"
-    ret_dict_ecu2["image_version"] = "0.0.1"
-
-    ret_dict["ecu1"] = ret_dict_ecu1
-    ret_dict["ecu2"] = ret_dict_ecu2
-    print(ret_dict)
-
-    return ret_dict
+    vin = vehicle_manifest.get("vin")
+    if vin is None:
+        return {}
+    return FLEET_STORE.get_update_manifest(vin)
 
 
 # setting up the various roles
@@ -75,6 +64,89 @@ TARGETS: uptane.roles.targets.TargetsOnline
 SNAPSHOT: uptane.roles.snapshot.SnapshotOnline
 TIMESTAMP: uptane.roles.timestamp.TimestampOnline
 AUTH_PUB_ED25519_KEY: str
+METADATA_CACHE = uptane.repository.metadatacache.DirectorMetadataCache()
+
+
+def gen_targets_snapshot_metadata(update_manifest: typing.Dict[str, typing.Any]) -> uptane.repository.metadatacache.CachedMetadata:
+    '''
+    Generates the signed targets and snapshot metadata for an update manifest in memory
+        Parameters:
+            update_manifest (Dict[str, Any]): the manifest returned by get_update_manifest
+
+        Returns:
+            CachedMetadata: the signed metadata, ready to be stored in METADATA_CACHE
+    '''
+    # the role objects only hold the keys, every request builds its own signed dicts so
+    # requests can run concurrently
+
+    #TARGETS
+    targets_metadata = {}
+    expires = uptane.time.get_fut24_epoch_time()
+    for key in update_manifest:
+        targets_signed_dict = TARGETS.build_signed_dict(update_manifest[key])
+        imn = update_manifest[key]["image_name"]
+        imv = update_manifest[key]["image_version"]
+        targets_metadata[f'{imv}.{imn}.targets.toml'] = TARGETS.sign_signed_dict(targets_signed_dict)
+        expires = min(expires, int(targets_signed_dict["expires"]))
+
+    # SNAPSHOT
+    snapshot_signed_dict = SNAPSHOT.build_signed_dict(targets_metadata)
+    snapshot_metadata = SNAPSHOT.sign_signed_dict(snapshot_signed_dict)
+    expires = min(expires, int(snapshot_signed_dict["expires"]))
+
+    return uptane.repository.metadatacache.CachedMetadata(targets=targets_metadata, \
+           snapshot_name='0-0-1.12345.snapshot.toml', snapshot=snapshot_metadata, expires=expires)
+
+
+def gen_metadata_bundle(cached_metadata: uptane.repository.metadatacache.CachedMetadata,
+                        timestamp_metadata: bytes, bundle_name: str) -> bytes:
+    '''
+    Zips the metadata of a vehicle in memory, all files are put in the bundle_name folder
+        Returns:
+            bytes: the zip archive
+    '''
+    bundle = io.BytesIO()
+    with zipfile.ZipFile(bundle, "w", compression=zipfile.ZIP_DEFLATED) as zipO:
+        for targets_metadata_name in cached_metadata.targets:
+            zipO.writestr(f'{bundle_name}/{targets_metadata_name}',
+                          cached_metadata.targets[targets_metadata_name])
+        zipO.writestr(f'{bundle_name}/{cached_metadata.snapshot_name}', cached_metadata.snapshot)
+        zipO.writestr(f'{bundle_name}/0-0-1.12345.timestamp.toml', timestamp_metadata)
+
+    return bundle.getvalue()
+
+
+def gen_vehicle_bundle(vehicle_manifest_json_dict: typing.Dict[str, typing.Any]) -> typing.Tuple[str, bytes]:
+    '''
+    Generates the metadata bundle of a vehicle, targets and snapshot are shared by every
+    vehicle that resolves to the same update manifest, the timestamp is signed per vehicle
+        Parameters:
+            vehicle_manifest_json_dict (Dict[str, Any]): the manifest sent by the vehicle
+
+        Returns:
+            Tuple[str, bytes]: the name of the bundle and the zip archive
+
+        Raises:
+            UpToDate - the vehicle has nothing to install
+    '''
+    update_manifest = get_update_manifest(vehicle_manifest_json_dict)
+    if not len(update_manifest):
+        raise UpToDate
+
+    digest = uptane.repository.metadatacache.manifest_digest(update_manifest)
+    cached_metadata = METADATA_CACHE.get(digest)
+    if cached_metadata is None:
+        cached_metadata = gen_targets_snapshot_metadata(update_manifest)
+        METADATA_CACHE.put(digest, cached_metadata)
+
+    # TIMESTAMP
+    timestamp_metadata = TIMESTAMP.sign_signed_dict(
+        TIMESTAMP.build_signed_dict(cached_metadata.snapshot, vehicle_manifest_json_dict["vin"],
+                                    cached_metadata.expires))
+
+    bundle_name = uuid.uuid4().hex
+    return bundle_name, gen_metadata_bundle(cached_metadata, timestamp_metadata, bundle_name)
+
 
 # the car should send a json in the format
 # {
@@ -92,77 +164,42 @@ AUTH_PUB_ED25519_KEY: str
 #@directorrepo.route('/manifest/upload', methods=["POST"])
 
 
+@directorrepo.route('/metrics/', methods=["GET"])
+def metrics():
+    return json.dumps({"metadata_cache": METADATA_CACHE.stats(),
+                       "key_cache": uptane.crypto.sign.KEY_CACHE.stats()})
+
+
 # -- this is an ad-hoc implementation [need to change it]
 @directorrepo.route('/manifest/', methods=["POST"])
 def manifest():
     try:
-        #request_json = flask.request.json
-        vehicle_manifest_json_dict = {} # json.load(request_json)
+        vehicle_manifest_json_dict = flask.request.get_json(force=True, silent=True) or {}
         print("received vehicle manifest json \u2713")
-        #vin = vehicle_manifest_json_dict["vin"]
         #verifier = uptane.verify.ECUVerification(vehicle_manifest_json_dict)
         #verifier.verify_ecus()
         print("ecus have been verified \u2713")
 
-        #if not get_update_manifest(vehicle_manifest_json_dict):
-        #    raise Exception("up-to-date")
-        
-        vehicle_manifest_json_dict = get_update_manifest(vehicle_manifest_json_dict)
-        print("vehicle update manifest calculated \u2713")
-        # make a temporary directory to put all the metadata files
-        temp_dir = str(uuid.uuid4())
-
-        if not os.path.exists(f'director_met_repo/{temp_dir}'):
-            os.mkdir(f'director_met_repo/{temp_dir}')
-        else:
-            os.rmdir(f'director_met_repo/{temp_dir}')
-            os.mkdir(f'director_met_repo/{temp_dir}')
-
-        # creating the metadata
-
-        #TARGETS
-        target_files = []
-        for key in vehicle_manifest_json_dict:
-            TARGETS.targetsoneline_reinit(vehicle_manifest_json_dict[key])
-            imn = vehicle_manifest_json_dict[key]["image_name"]
-            imv = vehicle_manifest_json_dict[key]["image_version"]
-            metadata_file_name = f'director_met_repo/{temp_dir}/{imv}.{imn}.targets.toml'
-            TARGETS.gen_signed_metadata_file(metadata_file_name)
-            target_files.append(metadata_file_name)
-        print("vehicle targets metadata generated \u2713")
-
-        # SNAPSHOT
-        SNAPSHOT.snapshotonline_reinit(target_files)
-        snp_metadata_file_name = f'director_met_repo/{temp_dir}/0-0-1.{12345}.snapshot.toml'
-        SNAPSHOT.gen_signed_metadata_file(snp_metadata_file_name)
-        print("vehicle snapshot metadata generated \u2713")
-
-        # TIMESTAMP
-        TIMESTAMP.timestamponline_reinit(snp_metadata_file_name, "12345")
-        tms_metadata_file_name = f'director_met_repo/{temp_dir}/0-0-1.12345.timestamp.toml'
-        TIMESTAMP.gen_signed_metadata_file(tms_metadata_file_name)
-        print("vehicle timestamp metadata generated \u2713")
-
-        # create the zip file
-        print("files zipped \u2713")
-        subprocess.call(['zip', '-r', f'director_met_repo/{temp_dir}.zip', f'director_met_repo/{temp_dir}'])
-     
+        # update manifest, targets, snapshot and timestamp metadata, zipped
+        bundle_name, bundle = gen_vehicle_bundle(vehicle_manifest_json_dict)
+        print("vehicle metadata generated and zipped \u2713")
+
         # send the file
-        flask.send_from_directory(os.path.join(os.getcwd(), 'director_met_repo'), f'{temp_dir}.zip', as_attachment=True)
         print("files sent to vehicle \u2713")
+        return flask.Response(bundle, mimetype="application/zip", headers={
+            "Content-Disposition": f'attachment; filename={bundle_name}.zip'})
 
     except Exception as e:
         return json.dumps({"error": {"type": str(e)}})
 
 
-def setup_server(root_metadata_file: str, timestamp_cfg: str, snapshot_cfg: str,
-                 targets_cfg: str, authpubkey: str):
-    global TARGETS, SNAPSHOT, TIMESTAMP, AUTH_PUB_ED25519_KEY
-
-    # make python open up a specific directory in the filesystem
-    # the temporary repo will be used to generate metadata files
-    if not os.path.exists('director_met_repo'):
-        os.mkdir('director_met_repo')
+def init_server(root_metadata_file: typing.Optional[str], timestamp_cfg: str, snapshot_cfg: str,
+                targets_cfg: str, authpubkey: str, fleet_db: typing.Optional[str] = None):
+    '''
+    Loads the online roles and their keys and opens the fleet store, shared by all requests,
+    root_metadata_file is not read and is None in campaign workers
+    '''
+    global TARGETS, SNAPSHOT, TIMESTAMP, AUTH_PUB_ED25519_KEY, FLEET_STORE
 
     # setting up the various roles
     TARGETS = uptane.roles.targets.TargetsOnline(targets_cfg)
@@ -170,9 +207,12 @@ def setup_server(root_metadata_file: str, timestamp_cfg: str, snapshot_cfg: str,
     TIMESTAMP = uptane.roles.timestamp.TimestampOnline(timestamp_cfg)
     AUTH_PUB_ED25519_KEY = authpubkey
 
-    # ad-hoc setup of manifest
-    with open(directorrepo.config["MANIFEST_JSON"], "r") as f:
-        MANIFEST_DICT = json.loads(f.read())
-    directorrepo.run(port=8082, debug=True)
+    if fleet_db is not None:
+        directorrepo.config["FLEET_DB"] = fleet_db
+    FLEET_STORE = uptane.repository.fleetstore.FleetStore(directorrepo.config["FLEET_DB"])
 
 
+def setup_server(root_metadata_file: str, timestamp_cfg: str, snapshot_cfg: str,
+                 targets_cfg: str, authpubkey: str, fleet_db: typing.Optional[str] = None):
+    init_server(root_metadata_file, timestamp_cfg, snapshot_cfg, targets_cfg, authpubkey, fleet_db)
+    directorrepo.run(port=8082, debug=True, threaded=True)
@@ -0,0 +1,265 @@
+# fleet inventory of the director repo
+#   - vehicles and their ecus with the image installed on every ecu
+#   - images that can be installed, and upgrades: the image that follows an installed image
+#     (or an image assigned to a single ecu, which wins over the upgrade path)
+#   - stored in sqlite, every lookup is an index lookup, imports stream rows in batches so
+#     millions of vehicles are never held in memory
+import csv
+import os
+import sqlite3
+import threading
+import typing
+
+DEFAULT_BATCH_SIZE = 10000
+
+# image metadata sent to vehicles, as the targets role expects it in the update manifest
+IMAGE_COLUMNS = ("image_name", "image_url", "image_size", "image_hash", "image_hash_func",
+                 "image_buf_size", "image_sig_algo", "image_version")
+# columns of the ecus and upgrades csv files
+ECU_CSV_COLUMNS = ("vin", "ecu_id", "installed_hash")
+UPGRADE_CSV_COLUMNS = ("from_hash", "to_hash")
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS vehicles (
+    vin TEXT PRIMARY KEY
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS ecus (
+    vin TEXT NOT NULL, ecu_id TEXT NOT NULL, installed_hash TEXT NOT NULL,
+    assigned_hash TEXT,
+    PRIMARY KEY (vin, ecu_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ecus_ecu_id ON ecus (ecu_id);
+CREATE INDEX IF NOT EXISTS ecus_installed_hash ON ecus (installed_hash);
+CREATE TABLE IF NOT EXISTS images (
+    image_hash TEXT PRIMARY KEY, image_name TEXT NOT NULL, image_url TEXT NOT NULL,
+    image_size INTEGER NOT NULL, image_hash_func TEXT NOT NULL, image_buf_size INTEGER NOT NULL,
+    image_sig_algo TEXT NOT NULL, image_version TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS upgrades (
+    from_hash TEXT PRIMARY KEY, to_hash TEXT NOT NULL
+) WITHOUT ROWID;
+'''
+
+# next image of every ecu of a vehicle: (vin, ecu_id) primary key, then image primary keys
+UPDATE_MANIFEST_QUERY = '''
+SELECT ecus.ecu_id, images.image_name, images.image_url, images.image_size, images.image_hash,
+       images.image_hash_func, images.image_buf_size, images.image_sig_algo, images.image_version
+FROM ecus
+LEFT JOIN upgrades ON upgrades.from_hash = ecus.installed_hash
+JOIN images ON images.image_hash = COALESCE(ecus.assigned_hash, upgrades.to_hash)
+WHERE ecus.vin = ? AND images.image_hash != ecus.installed_hash
+ORDER BY ecus.ecu_id
+'''
+
+
+def read_csv(f: typing.TextIO, columns: typing.Sequence[str]) -> typing.Iterator[typing.Tuple[str, ...]]:
+    '''
+    Yields the columns of every row of a csv file with a header row, in the order of columns
+
+        Raises:
+            ValueError - the header misses a column
+    '''
+    reader = csv.reader(f)
+    header = next(reader, [])
+    missing = [column for column in columns if column not in header]
+    if len(missing):
+        raise ValueError(f'csv file {getattr(f, "name", "")} misses the columns {", ".join(missing)}')
+    indexes = [header.index(column) for column in columns]
+    for row in reader:
+        yield tuple(row[index] for index in indexes)
+
+
+class FleetStore:
+    '''
+    SQLite fleet inventory, safe to share between threads, every thread (and every forked
+    worker process) gets its own connection
+    '''
+
+    def __init__(self, db_path: str) -> None:
+        '''
+        Opens or creates the fleet database
+            Parameters:
+                db_path (str): path to the sqlite database file
+
+            Raises:
+                sqlite3.Error - when the database can not be opened
+        '''
+        self.db_path = db_path
+        self.__local = threading.local()
+        self.__conn().executescript(SCHEMA)
+
+    def __conn(self) -> sqlite3.Connection:
+        conn = getattr(self.__local, "conn", None)
+        # sqlite connections must not be shared with forked worker processes
+        if conn is None or self.__local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.__local.conn = conn
+            self.__local.pid = os.getpid()
+        return conn
+
+    def get_update_manifest(self, vin: str) -> typing.Dict[str, typing.Dict[str, typing.Any]]:
+        '''
+        Get what a vehicle should install next
+            Parameters:
+                vin (str): the vin of the vehicle
+
+            Returns:
+                Dict[str, Dict[str, Any]]: ecu id -> metadata of the image to install, only ecus
+                with a newer image are listed, empty when the vehicle is up to date or unknown
+        '''
+        update_manifest = {}
+        for row in self.__conn().execute(UPDATE_MANIFEST_QUERY, (vin,)):
+            update_manifest[row[0]] = dict(zip(IMAGE_COLUMNS, row[1:]))
+        return update_manifest
+
+    def set_installed(self, vin: str, installed: typing.Dict[str, str]) -> int:
+        '''
+        Records the images a vehicle reports installed on its ecus, only from manifests whose
+        ecu signatures were verified, an assignment that was installed is cleared, only ecus of
+        the vehicle in the store whose image changed are written, so vehicles reporting the
+        same state never take the write lock
+            Parameters:
+                vin (str): the vin of the vehicle
+                installed (Dict[str, str]): ecu id -> hash of the installed image
+
+            Returns:
+                int: number of ecus updated
+        '''
+        conn = self.__conn()
+        changed = []
+        for ecu_id, installed_hash in conn.execute("SELECT ecu_id, installed_hash FROM ecus WHERE vin = ?",
+                                                   (vin,)).fetchall():
+            image_hash = installed.get(ecu_id)
+            if image_hash is not None and image_hash != installed_hash:
+                changed.append((image_hash, image_hash, vin, ecu_id))
+        if not len(changed):
+            return 0
+        return self.__import_batch(conn, ("UPDATE ecus SET installed_hash = ?, assigned_hash = CASE "
+                                          "WHEN assigned_hash = ? THEN NULL ELSE assigned_hash END "
+                                          "WHERE vin = ? AND ecu_id = ?",), changed)
+
+    def ecus_with_image(self, image_hash: str) -> typing.Iterator[typing.Tuple[str, str]]:
+        '''
+        Yields the (vin, ecu id) of every ecu that has an image installed
+        '''
+        return self.__conn().execute("SELECT vin, ecu_id FROM ecus WHERE installed_hash = ?",
+                                     (image_hash,))
+
+    def vins(self) -> typing.Iterator[str]:
+        '''
+        Yields the vin of every vehicle, without loading them all
+        '''
+        return (row[0] for row in self.__conn().execute("SELECT vin FROM vehicles ORDER BY vin"))
+
+    def __import(self, statements: typing.Sequence[str], rows: typing.Iterable[typing.Sequence[typing.Any]],
+                 batch_size: int) -> int:
+        '''
+        Runs the insert statements over rows in transactions of batch_size rows
+        '''
+        conn = self.__conn()
+        count = 0
+        batch = []
+        for row in rows:
+            batch.append(tuple(row))
+            if len(batch) >= batch_size:
+                count += self.__import_batch(conn, statements, batch)
+                batch = []
+        if len(batch):
+            count += self.__import_batch(conn, statements, batch)
+        return count
+
+    def __import_batch(self, conn: sqlite3.Connection, statements: typing.Sequence[str],
+                       batch: typing.List[typing.Tuple]) -> int:
+        conn.execute("BEGIN")
+        try:
+            for statement in statements:
+                # every statement takes the leading columns of the row it needs
+                params = statement.count("?")
+                conn.executemany(statement, (row[:params] for row in batch))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return len(batch)
+
+    def import_ecus(self, rows: typing.Iterable[typing.Sequence[str]],
+                    batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+        '''
+        Imports vehicles and their ecus, existing ecus get the new installed image
+            Parameters:
+                rows (Iterable[Sequence[str]]): (vin, ecu id, installed image hash) rows
+                batch_size (int) [Optional, Default: DEFAULT_BATCH_SIZE]: rows per transaction
+
+            Returns:
+                int: number of rows imported
+        '''
+        return self.__import(("INSERT OR IGNORE INTO vehicles (vin) VALUES (?)",
+                              "INSERT INTO ecus (vin, ecu_id, installed_hash) VALUES (?, ?, ?) "
+                              "ON CONFLICT (vin, ecu_id) DO UPDATE SET installed_hash = excluded.installed_hash"),
+                             rows, batch_size)
+
+    def import_images(self, rows: typing.Iterable[typing.Dict[str, typing.Any]],
+                      batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+        '''
+        Imports image metadata, rows are dicts with IMAGE_COLUMNS keys
+        '''
+        columns = ", ".join(IMAGE_COLUMNS)
+        return self.__import((f"INSERT OR REPLACE INTO images ({columns}) VALUES "
+                              f"({', '.join('?' * len(IMAGE_COLUMNS))})",),
+                             ([row[column] for column in IMAGE_COLUMNS] for row in rows), batch_size)
+
+    def import_upgrades(self, rows: typing.Iterable[typing.Sequence[str]],
+                        batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+        '''
+        Imports upgrade paths, (installed image hash, next image hash) rows
+        '''
+        return self.__import(("INSERT OR REPLACE INTO upgrades (from_hash, to_hash) VALUES (?, ?)",),
+                             rows, batch_size)
+
+    def import_assignments(self, rows: typing.Iterable[typing.Sequence[str]],
+                           batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+        '''
+        Assigns images to many ecus, (image hash, vin, ecu id) rows, an assigned image is
+        installed next instead of the upgrade path
+        '''
+        return self.__import(("UPDATE ecus SET assigned_hash = ? WHERE vin = ? AND ecu_id = ?",),
+                             rows, batch_size)
+
+    def import_csv(self, ecus_csv: typing.Optional[str] = None, images_csv: typing.Optional[str] = None,
+                   upgrades_csv: typing.Optional[str] = None) -> typing.Dict[str, int]:
+        '''
+        Imports csv files, the files are streamed, every file starts with a header row naming
+        its columns, in any order
+            - ecus_csv: ECU_CSV_COLUMNS
+            - images_csv: IMAGE_COLUMNS
+            - upgrades_csv: UPGRADE_CSV_COLUMNS
+
+            Returns:
+                Dict[str, int]: rows imported per table
+
+            Raises:
+                ValueError - a file misses a column
+        '''
+        counts = {}
+        if ecus_csv is not None:
+            with open(ecus_csv, newline='') as f:
+                counts["ecus"] = self.import_ecus(read_csv(f, ECU_CSV_COLUMNS))
+        if images_csv is not None:
+            with open(images_csv, newline='') as f:
+                counts["images"] = self.import_images(dict(zip(IMAGE_COLUMNS, row))
+                                                      for row in read_csv(f, IMAGE_COLUMNS))
+        if upgrades_csv is not None:
+            with open(upgrades_csv, newline='') as f:
+                counts["upgrades"] = self.import_upgrades(read_csv(f, UPGRADE_CSV_COLUMNS))
+        return counts
+
+    def close(self) -> None:
+        '''
+        Closes the connection of the calling thread
+        '''
+        conn = getattr(self.__local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self.__local.conn = None
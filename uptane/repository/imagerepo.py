@@ -1,40 +1,74 @@
 import flask
 import os
 import json
-import zipfile
 import uptane.verify
 import uptane.crypto.sign
 import uptane.crypto.hash
-import tomli
 import typing
+import tempfile
+import threading
+import shutil
+import werkzeug.security
+import uptane.error.general
+import uptane.repository.blobstore
+import uptane.repository.repopublish
+
+
+class UploadRequest(flask.Request):
+    '''
+    Request that hashes uploaded files while they are streamed to disk
+        - the upload is written once, to a temporary file in the upload folder, and hashed
+          in the same pass, so it never has to be read back for hashing
+        - uploads larger than MAX_UPLOAD_SIZE are refused while they are streamed
+    '''
+
+    def __init__(self, *args, **kwargs) -> None:
+        flask.Request.__init__(self, *args, **kwargs)
+        self.upload_file_paths: typing.List[str] = []
+
+    def _get_file_stream(self, total_content_length: typing.Optional[int], content_type: typing.Optional[str],
+                         filename: typing.Optional[str] = None,
+                         content_length: typing.Optional[int] = None) -> typing.Any:
+        max_size = imagerepo.config["MAX_UPLOAD_SIZE"]
+        if total_content_length is not None and total_content_length > max_size:
+            raise uptane.error.general.FileSizeLimitExceeded
+
+        upload_file = tempfile.NamedTemporaryFile(dir=imagerepo.config["UPLOAD_FOLDER"],
+                                                  prefix=".upload-", delete=False)
+        # removed after the request by remove_upload_files unless it has been moved
+        self.upload_file_paths.append(upload_file.name)
+        return uptane.crypto.hash.HashingWriter(upload_file, uptane.crypto.hash.HashFunc.sha256,
+                                                max_size)
+
 
 imagerepo = flask.Flask(__name__)
+imagerepo.request_class = UploadRequest
 imagerepo.config["UPLOAD_FOLDER"] = "image_repo"
+imagerepo.config["MAX_UPLOAD_SIZE"] = 1024 * 1024 * 1024  # 1 GiB
+# total uncompressed size of the members of an upload
+imagerepo.config["MAX_EXTRACT_SIZE"] = 4 * 1024 * 1024 * 1024  # 4 GiB
+# content addressed store of the published files, on the filesystem of UPLOAD_FOLDER
+imagerepo.config["BLOB_FOLDER"] = "image_blobs"
 
-ROOT_METADATA_FILE_PATH: str
-AUTH_PUB_ED25519_KEY: str
 
-def __compare_latest_timestamp_to_verified(reponame:str, latest_timestamp_file_path:str)->bool:
+@imagerepo.teardown_request
+def remove_upload_files(_) -> None:
     '''
-    Checks if the latest timestamp received, has been signed at greater time than current
-        Parameters:
-            reponame: name of the sub repo to store in
-            latest_timestamp_file_path (str):
+    Removes temporary upload files of a request that were not moved into the repo
     '''
-    latest_timestamp_file_dict:typing.Dict[str,typing.Any]
-    stored_timestamp_file_dict:typing.Dict[str, typing.Any]
-    with open(latest_timestamp_file_path, "rb") as f:
-        latest_timestamp_file_dict = tomli.load(f)
- 
-    # check if timestamp file exists
-    if not os.path.exists('image_repo/{}/timestamp.toml'.format(reponame)):
-        return True
+    for upload_file_path in getattr(flask.request, "upload_file_paths", []):
+        if os.path.exists(upload_file_path):
+            os.remove(upload_file_path)
 
-    with open('image_repo/{}/timestamp.toml'.format(reponame), "rb") as f:
-        stored_timestamp_file_dict = tomli.load(f)
 
-    return int(latest_timestamp_file_dict["signed"]["expires"]) > int(stored_timestamp_file_dict["signed"]["expires"])
-        
+ROOT_METADATA_FILE_PATH: str
+AUTH_PUB_ED25519_KEY: str
+# reponame -> (version dir, filename -> etag), the etags of the last version of every repo
+# served by this process, version dirs never change so the cache is valid in every worker
+ETAG_CACHE: typing.Dict[str, typing.Tuple[str, typing.Dict[str, str]]] = {}
+ETAG_CACHE_LOCK = threading.Lock()
+BLOB_STORE: uptane.repository.blobstore.BlobStore
+PUBLISHER: uptane.repository.repopublish.RepoPublisher
 
 # metadatafile verification lib functions
 def __snapshot_metadata_file_filter(value) -> bool:
@@ -81,14 +115,66 @@ def get_timestamp_file_from_dirlist(file_list: list) -> str:
     return timestamp_files[0]
 
 
-def remove_timestamp_file_from_repo(reponame: str) -> None:
+def get_file_etag(reponame: str, filename: str) -> typing.Optional[typing.Tuple[str, str]]:
     '''
-    removes latest timestamp file from repo for the new latest timestamp file
+    Resolves a file of the repo to the version directory it is served from and its strong etag,
+    the sha256 of its content
+        - the repo symlink is resolved once, so the etag and the bytes sent are of the same
+          version, whatever worker published in between
+        - for images this is the image_hash of the verified targets metadata
+        - etags are read from the version info written when the version was published, files
+          of versions without one are hashed once on their first request
+        - a repo that was not published since versioning is not a symlink, its files may
+          change and are hashed on every request (through the hash cache when it is enabled)
+
+        Returns:
+            Tuple[str, str] | None: the version directory and the etag, None when the file does
+            not exist
     '''
-    try:
-        os.remove('image_repo/{}/timestamp.toml'.format(reponame))
-    except FileNotFoundError:
-        pass
+    repo_path = werkzeug.security.safe_join(os.path.abspath(imagerepo.config["UPLOAD_FOLDER"]), reponame)
+    if repo_path is None:
+        return None
+    version_dir = os.path.realpath(repo_path)
+    file_path = werkzeug.security.safe_join(version_dir, filename)
+    if file_path is None or not os.path.isfile(file_path):
+        return None
+
+    if not os.path.islink(repo_path):
+        return version_dir, uptane.crypto.hash.get_file_hash(file_path, uptane.crypto.hash.HashFunc.sha256)
+
+    with ETAG_CACHE_LOCK:
+        cached = ETAG_CACHE.get(reponame)
+        if cached is not None and cached[0] == version_dir and filename in cached[1]:
+            return version_dir, cached[1][filename]
+
+    etags = uptane.repository.repopublish.get_version_file_hashes(version_dir)
+    if filename not in etags:
+        etags[filename] = uptane.crypto.hash.get_file_hash(file_path, uptane.crypto.hash.HashFunc.sha256)
+    with ETAG_CACHE_LOCK:
+        cached = ETAG_CACHE.get(reponame)
+        if cached is not None and cached[0] == version_dir:
+            cached[1][filename] = etags[filename]
+        else:
+            ETAG_CACHE[reponame] = (version_dir, etags)
+    return version_dir, etags[filename]
+
+
+def publish_files(reponame: str, file_paths: typing.Dict[str, str], file_hashes: typing.Dict[str, str],
+                  timestamp_expires: int, snapshot_expires: int) -> None:
+    '''
+    Publishes verified files as the next version of the repo, the files are moved into the
+    blob store (identical files are stored once) and the version is swapped in atomically
+        Parameters:
+            reponame (str): name of the sub repo
+            file_paths (Dict[str, str]): published file name -> path of the verified file
+            file_hashes (Dict[str, str]): published file name -> sha256 of the file
+            timestamp_expires (int): expiry epoch of the uploaded timestamp metadata
+            snapshot_expires (int): expiry epoch of the uploaded snapshot metadata
+
+        Raises:
+            uptane.error.general.MetadataRollback
+    '''
+    PUBLISHER.publish(reponame, file_paths, file_hashes, timestamp_expires, snapshot_expires)
 
 
 # setting up different routes
@@ -96,23 +182,34 @@ def remove_timestamp_file_from_repo(reponame: str) -> None:
 def repo(reponame: str, filename: str):
     global ROOT_METADATA_FILE_PATH
     try:
-        if not os.path.exists('image_repo/{}'.format(reponame)):
-            os.mkdir("image_repo/{}".format(reponame))
+        # the staging and version dirs are not repos
+        if reponame.startswith("."):
+            return '{"error":{"type":"file_not_found"}}'
 
         if flask.request.method == "GET":
 
-            if not os.path.isfile(f'image_repo/{reponame}/{filename}'):
+            resolved = get_file_etag(reponame, filename)
+            if resolved is None:
                 return '{"error":{"type":"file_not_found"}}'
             else:
-                return flask.send_from_directory(
-                    imagerepo.config["UPLOAD_FOLDER"],
-                    '{}/{}'.format(reponame, filename))
+                version_dir, etag = resolved
+                # conditional serves 304 on a matching If-None-Match and 206 for Range
+                # requests, the file is sent with the server's file_wrapper (sendfile)
+                return flask.send_from_directory(version_dir, filename, etag=etag, conditional=True,
+                    max_age=0 if filename == "timestamp.toml" else None)
         else:
             # auth json will be of the form
             # {"signed":{"hash":"hash of zip file", "bufsize":int, "repo":"name of the sub repo"}, "keyid":"KNaCaMgAlZnFePbHCuHgAgAuPt", "signature":"some_signature"}
-            auth_recv_dict = json.loads(flask.request.form["auth_json"])
+            # reading the form streams the upload to a temporary file and hashes it
+            try:
+                auth_recv_dict = json.loads(flask.request.form["auth_json"])
+                file = flask.request.files["file"]
+            except uptane.error.general.FileSizeLimitExceeded:
+                return "", 413
+            upload_file_path = file.stream.name
+            file.stream.close()
             print("auth recv: ", auth_recv_dict)
-            
+
             # -----
             # authentication
             if auth_recv_dict["keyid"] != AUTH_PUB_ED25519_KEY:
@@ -126,55 +223,66 @@ def repo(reponame: str, filename: str):
                 pub_key=AUTH_PUB_ED25519_KEY, signature=auth_recv_dict["signature"]):
                 return "", 401
             print("signature verified \u2713")
-            file = flask.request.files["file"]
-            # the file sent has to be a folder that has been zipped, not a files that have been zipped
 
-            file.save('image_repo/{}/{}'.format(reponame, filename))
-            # now checking the file hash
-            if not uptane.crypto.hash.get_file_hash('image_repo/{}/{}'.format(reponame, filename), \
-                hashf=uptane.crypto.hash.HashFunc.sha256, bufsize=auth_recv_dict["signed"]["bufsize"]):
-                return "", 401
-            print("image hash compared \u2713") 
-            # --- 
-            # unzipping the file
-            with zipfile.ZipFile('image_repo/{}/{}'.format(reponame,
-                                                            filename)) as zipO:
-                zipO.extractall('image_repo/{}'.format(reponame))
-            print("zipped files unzipped\u2713") 
-            # removing the zip file
-            os.remove('image_repo/{}/{}'.format(reponame, filename))
-
-            # the directory that contains all files
-            verify_dir = 'image_repo/{}/{}'.format(reponame,
-                                                    filename.split('.')[0])
-            recv_file_list = os.listdir(verify_dir)
-            
-            snapshot_file = get_snapshot_file_from_dirlist(recv_file_list)
-            timestamp_file = get_timestamp_file_from_dirlist(recv_file_list)
-            timestamp_file_path = '{}/{}'.format(verify_dir, timestamp_file)
-            snapshot_file_path = '{}/{}'.format(verify_dir, snapshot_file)
-            
-            # last authentication step (preventing rollback attack)
-            if not __compare_latest_timestamp_to_verified(reponame, timestamp_file_path):
+            # the file sent has to be a folder that has been zipped, not a files that have been zipped
+            # refuse forged zips before extracting them
+            if file.stream.hexdigest() != auth_recv_dict["signed"]["hash"]:
                 return "", 401
-            
-            print(timestamp_file_path, snapshot_file_path, verify_dir)
-
-            # perform verification
-            verifier = uptane.verify.Verification(root_metadata_file_path=ROOT_METADATA_FILE_PATH, \
-                       timestamp_metadata_file_path=timestamp_file_path, \
-                       snapshot_metadata_file_path=snapshot_file_path, \
-                       targets_files_dir_path=verify_dir)
-            print("all metadata verfied \u2713")
-
-            verifier.verify()
-            # move files to downloadable repo
-            remove_timestamp_file_from_repo(reponame)
-            os.rename(timestamp_file_path,
-                      'image_repo/{}/timestamp.toml'.format(reponame))
-            for file in os.listdir(verify_dir):
-                os.rename(verify_dir + '/' + file,
-                          'image_repo/{}/{}'.format(reponame, file))
+            print("image hash compared \u2713")
+
+            # ---
+            # unzipping the file in the staging dir, every member is hashed while it is extracted
+            stage_dir = tempfile.mkdtemp(dir=PUBLISHER.staging_dir(), prefix=f'{reponame}-')
+            try:
+                try:
+                    file_hashes = uptane.crypto.hash.extract_zip_hashed(upload_file_path, stage_dir, \
+                                  uptane.crypto.hash.HashFunc.sha256, \
+                                  max_size=imagerepo.config["MAX_EXTRACT_SIZE"])
+                except uptane.error.general.FileSizeLimitExceeded:
+                    return "", 413
+                print("zipped files unzipped\u2713")
+
+                # the directory that contains all files
+                verify_dir = '{}/{}'.format(stage_dir, filename.split('.')[0])
+                recv_file_list = [os.path.basename(file_path) for file_path in file_hashes \
+                                  if os.path.dirname(file_path) == os.path.normpath(verify_dir)]
+
+                snapshot_file = get_snapshot_file_from_dirlist(recv_file_list)
+                timestamp_file = get_timestamp_file_from_dirlist(recv_file_list)
+                timestamp_file_path = '{}/{}'.format(verify_dir, timestamp_file)
+                snapshot_file_path = '{}/{}'.format(verify_dir, snapshot_file)
+
+                # last authentication step (preventing rollback attack), checked against the
+                # in memory index, and again when the upload is published
+                timestamp_expires = uptane.repository.repopublish.get_metadata_expires(timestamp_file_path)
+                snapshot_expires = uptane.repository.repopublish.get_metadata_expires(snapshot_file_path)
+                current = PUBLISHER.current(reponame)
+                if timestamp_expires <= current.timestamp_expires or \
+                        snapshot_expires < current.snapshot_expires:
+                    return "", 401
+
+                print(timestamp_file_path, snapshot_file_path, verify_dir)
+
+                # perform verification
+                verifier = uptane.verify.Verification(root_metadata_file_path=ROOT_METADATA_FILE_PATH, \
+                           timestamp_metadata_file_path=timestamp_file_path, \
+                           snapshot_metadata_file_path=snapshot_file_path, \
+                           targets_files_dir_path=verify_dir, file_hashes=file_hashes)
+                print("all metadata verfied \u2713")
+
+                verifier.verify()
+                # publish the files to the downloadable repo
+                file_paths = {"timestamp.toml": timestamp_file_path}
+                for file in recv_file_list:
+                    if file != timestamp_file:
+                        file_paths[file] = '{}/{}'.format(verify_dir, file)
+                try:
+                    publish_files(reponame, file_paths, {name: file_hashes[os.path.normpath(file_paths[name])] \
+                                  for name in file_paths}, timestamp_expires, snapshot_expires)
+                except uptane.error.general.MetadataRollback:
+                    return "", 401
+            finally:
+                shutil.rmtree(stage_dir, ignore_errors=True)
 
             return '{"status":"success"}'
 
@@ -182,13 +290,24 @@ def repo(reponame: str, filename: str):
         return json.dumps({"error": {"type": str(e)}})
 
 
-def setup_server(root_metadata_file_path: str, authpubkey: str):
-    global imagerepo
-    global ROOT_METADATA_FILE_PATH, AUTH_PUB_ED25519_KEY
+def init_server(root_metadata_file_path: str, authpubkey: str, blob_folder: typing.Optional[str] = None):
+    '''
+    Sets up the image repo dir, the blob store and the keys used for authenticating uploads
+    '''
+    global ROOT_METADATA_FILE_PATH, AUTH_PUB_ED25519_KEY, BLOB_STORE, PUBLISHER
     # make python open up a specific directory in the filesystem
     if not os.path.exists('image_repo'):
-        os.mkdir("image_repo")
+        os.makedirs("image_repo", exist_ok=True)
+
+    if blob_folder is not None:
+        imagerepo.config["BLOB_FOLDER"] = blob_folder
+    BLOB_STORE = uptane.repository.blobstore.BlobStore(imagerepo.config["BLOB_FOLDER"])
+    PUBLISHER = uptane.repository.repopublish.RepoPublisher("image_repo", BLOB_STORE)
 
     ROOT_METADATA_FILE_PATH = root_metadata_file_path
     AUTH_PUB_ED25519_KEY = authpubkey
+
+
+def setup_server(root_metadata_file_path: str, authpubkey: str, blob_folder: typing.Optional[str] = None):
+    init_server(root_metadata_file_path, authpubkey, blob_folder)
     imagerepo.run(port=8080, debug=True)
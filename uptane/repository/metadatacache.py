@@ -0,0 +1,99 @@
+# cache of signed director metadata
+#   - vehicles that resolve to the same set of images get the same targets and snapshot
+#     metadata, only the timestamp (vin, expires) is signed per request
+#   - entries are keyed by a canonical digest of the resolved update manifest and
+#     expire with the metadata they hold
+import collections
+import threading
+import time
+import typing
+import uptane.crypto.canonical
+import uptane.crypto.hash
+
+DEFAULT_MAXSIZE = 1024
+# entries are dropped this long before their metadata expires, so vehicles never get
+# metadata that is about to expire
+EXPIRY_MARGIN = 60 * 60
+
+
+class CachedMetadata(typing.NamedTuple):
+    '''
+    Signed targets and snapshot metadata for one update manifest
+        targets (Dict[str, bytes]): targets metadata file name -> signed toml bytes
+        snapshot_name (str): snapshot metadata file name
+        snapshot (bytes): signed toml bytes of the snapshot
+        expires (int): earliest expiry epoch of the targets and snapshot metadata
+    '''
+    targets: typing.Dict[str, bytes]
+    snapshot_name: str
+    snapshot: bytes
+    expires: int
+
+
+def manifest_digest(manifest: typing.Dict[str, typing.Any]) -> str:
+    '''
+    Get the canonical digest of a resolved update manifest
+    '''
+    return uptane.crypto.canonical.canonical_hash(manifest, uptane.crypto.hash.HashFunc.sha256)
+
+
+class DirectorMetadataCache:
+    '''
+    Bounded LRU cache of signed director metadata, keyed by update manifest digest
+    '''
+
+    def __init__(self, maxsize: int = DEFAULT_MAXSIZE, expiry_margin: int = EXPIRY_MARGIN) -> None:
+        self.maxsize = maxsize
+        self.expiry_margin = expiry_margin
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.__entries: collections.OrderedDict = collections.OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, digest: str) -> typing.Optional[CachedMetadata]:
+        '''
+        Get the cached metadata for a manifest digest
+            Returns:
+                CachedMetadata | None: None on a miss or when the metadata is about to expire
+        '''
+        with self.__lock:
+            entry = self.__entries.get(digest)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            if entry.expires - self.expiry_margin <= time.time():
+                del self.__entries[digest]
+                self.expired += 1
+                self.misses += 1
+                return None
+
+            self.__entries.move_to_end(digest)
+            self.hits += 1
+            return entry
+
+    def put(self, digest: str, entry: CachedMetadata) -> None:
+        '''
+        Store signed metadata for a manifest digest, evicts the least recently used entries
+        '''
+        with self.__lock:
+            self.__entries[digest] = entry
+            self.__entries.move_to_end(digest)
+            while len(self.__entries) > self.maxsize:
+                self.__entries.popitem(last=False)
+
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        '''
+        Returns the hit/miss counters and the current size of the cache
+        '''
+        with self.__lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self.__entries),
+                "maxsize": self.maxsize
+            }
@@ -0,0 +1,255 @@
+# publish transactions of the image repo
+#   - a sub repo is a symlink to an immutable version directory, <root>/<repo> ->
+#     .versions/<repo>/<version>, a publish stages the next version next to it and swaps the
+#     symlink with a rename, readers see the old or the new version, never a mix
+#   - publishes of a repo are serialized by a lock per repo in the process and a file lock
+#     across worker processes
+#   - the timestamp and snapshot expiry of the current version of every repo are kept in
+#     memory for rollback checks, the symlink tells when another process published
+#   - the version info, <version>.json next to the version directory, also records the sha256
+#     of every file of the version, the etags of its files in every worker process
+import fcntl
+import json
+import os
+import shutil
+import threading
+import time
+import typing
+import uptane.codec
+import uptane.crypto.hash
+import uptane.error.general
+import uptane.repository.blobstore
+
+VERSIONS_DIR = ".versions"
+STAGING_DIR = ".staging"
+DEFAULT_KEEP_VERSIONS = 2  # the current version and the one readers may still be using
+# older versions are removed once they were replaced this long ago, readers that resolved
+# the repo symlink before a swap finish reading them
+VERSION_GRACE = 60  # seconds
+
+
+class RepoVersion(typing.NamedTuple):
+    '''
+    Published version of a sub repo
+        version (int): number of the version directory, 0 for a repo never published
+        timestamp_expires (int): expiry epoch of its timestamp metadata
+        snapshot_expires (int): expiry epoch of its snapshot metadata
+    '''
+    version: int
+    timestamp_expires: int
+    snapshot_expires: int
+
+
+def get_metadata_expires(metadata_file_path: str) -> int:
+    '''
+    Reads the expiry epoch of a metadata file
+    '''
+    return int(uptane.codec.load(metadata_file_path)["signed"]["expires"])
+
+
+def get_version_file_hashes(version_dir: str) -> typing.Dict[str, str]:
+    '''
+    Reads the sha256 of the files of a published version directory
+        Returns:
+            Dict[str, str]: file name -> sha256, empty for a version published before hashes
+            were recorded
+    '''
+    try:
+        with open(f'{version_dir}.json', 'r') as f:
+            return json.load(f).get("files", {})
+    except FileNotFoundError:
+        return {}
+
+
+class RepoPublisher:
+    '''
+    Publishes verified uploads to the sub repos of the image repo
+    '''
+
+    def __init__(self, repo_root: str, blob_store: uptane.repository.blobstore.BlobStore,
+                 keep_versions: int = DEFAULT_KEEP_VERSIONS, version_grace: float = VERSION_GRACE) -> None:
+        '''
+            Parameters:
+                repo_root (str): directory of the sub repos, image_repo
+                blob_store (BlobStore): store of the published files, on the same filesystem
+                keep_versions (int) [Optional, Default: DEFAULT_KEEP_VERSIONS]: version
+                directories kept per repo
+                version_grace (float) [Optional, Default: VERSION_GRACE]: seconds a replaced
+                version is kept for readers
+        '''
+        self.repo_root = repo_root
+        self.blob_store = blob_store
+        self.keep_versions = keep_versions
+        self.version_grace = version_grace
+        os.makedirs(os.path.join(repo_root, VERSIONS_DIR), exist_ok=True)
+        os.makedirs(os.path.join(repo_root, STAGING_DIR), exist_ok=True)
+        # reponame -> current version, only read or written under the lock of the repo
+        self.__index: typing.Dict[str, RepoVersion] = {}
+        self.__locks: typing.Dict[str, threading.Lock] = {}
+        self.__locks_lock = threading.Lock()
+
+    def staging_dir(self) -> str:
+        '''
+        Directory for extracting uploads, never served
+        '''
+        return os.path.join(self.repo_root, STAGING_DIR)
+
+    def __repo_lock(self, reponame: str) -> threading.Lock:
+        with self.__locks_lock:
+            return self.__locks.setdefault(reponame, threading.Lock())
+
+    def __version_dir(self, reponame: str, version: int) -> str:
+        return os.path.join(self.repo_root, VERSIONS_DIR, reponame, str(version))
+
+    def __version_info_path(self, reponame: str, version: int) -> str:
+        return os.path.join(self.repo_root, VERSIONS_DIR, reponame, f'{version}.json')
+
+    def __disk_version(self, reponame: str) -> int:
+        '''
+        Version the repo symlink points at, 0 when the repo was never published
+        '''
+        repo_path = os.path.join(self.repo_root, reponame)
+        if not os.path.islink(repo_path):
+            return 0
+        return int(os.path.basename(os.readlink(repo_path)))
+
+    def __migrate(self, reponame: str) -> None:
+        '''
+        Turns a repo directory published before versioning into version 0
+        '''
+        repo_path = os.path.join(self.repo_root, reponame)
+        if os.path.isdir(repo_path) and not os.path.islink(repo_path):
+            os.makedirs(os.path.join(self.repo_root, VERSIONS_DIR, reponame), exist_ok=True)
+            os.rename(repo_path, self.__version_dir(reponame, 0))
+            os.symlink(os.path.join(VERSIONS_DIR, reponame, "0"), repo_path)
+
+    def __load_version(self, reponame: str, version: int) -> RepoVersion:
+        '''
+        Reads the version info written when a version was published
+        '''
+        try:
+            with open(self.__version_info_path(reponame, version), 'r') as f:
+                info = json.load(f)
+            return RepoVersion(info["version"], info["timestamp_expires"], info["snapshot_expires"])
+        except FileNotFoundError:
+            pass
+
+        # a repo that was never published, or published before versioning (migrated or not)
+        version_dir = self.__version_dir(reponame, version)
+        if not os.path.isdir(version_dir):
+            version_dir = os.path.join(self.repo_root, reponame)
+        timestamp_path = os.path.join(version_dir, "timestamp.toml")
+        if not os.path.exists(timestamp_path):
+            return RepoVersion(version, 0, 0)
+        return RepoVersion(version, get_metadata_expires(timestamp_path), 0)
+
+    def __current_locked(self, reponame: str) -> RepoVersion:
+        '''
+        The current version from the index, reloaded when another process published
+        '''
+        disk_version = self.__disk_version(reponame)
+        current = self.__index.get(reponame)
+        if current is None or current.version != disk_version:
+            current = self.__load_version(reponame, disk_version)
+            self.__index[reponame] = current
+        return current
+
+    def current(self, reponame: str) -> RepoVersion:
+        '''
+        Get the published version of a repo
+        '''
+        with self.__repo_lock(reponame):
+            return self.__current_locked(reponame)
+
+    def publish(self, reponame: str, file_paths: typing.Dict[str, str], file_hashes: typing.Dict[str, str],
+                timestamp_expires: int, snapshot_expires: int) -> RepoVersion:
+        '''
+        Publishes verified files as the next version of a repo, the files of the current
+        version that are not replaced are carried over
+            Parameters:
+                reponame (str): name of the sub repo
+                file_paths (Dict[str, str]): published file name -> path of the verified file,
+                the files are moved into the blob store
+                file_hashes (Dict[str, str]): published file name -> sha256 of the file
+                timestamp_expires (int): expiry epoch of the uploaded timestamp metadata
+                snapshot_expires (int): expiry epoch of the uploaded snapshot metadata
+
+            Returns:
+                RepoVersion: the published version
+
+            Raises:
+                uptane.error.general.MetadataRollback - the upload is older than the repo
+        '''
+        repo_path = os.path.join(self.repo_root, reponame)
+        os.makedirs(os.path.join(self.repo_root, VERSIONS_DIR, reponame), exist_ok=True)
+        lock_path = os.path.join(self.repo_root, VERSIONS_DIR, f'{reponame}.lock')
+
+        with self.__repo_lock(reponame), open(lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self.__migrate(reponame)
+                current = self.__current_locked(reponame)
+                # the timestamp has to be newer, the snapshot at least as new
+                if timestamp_expires <= current.timestamp_expires or \
+                        snapshot_expires < current.snapshot_expires:
+                    raise uptane.error.general.MetadataRollback
+
+                for name in file_paths:
+                    self.blob_store.put_file(file_paths[name], file_hashes[name])
+
+                version = RepoVersion(current.version + 1, timestamp_expires, snapshot_expires)
+                version_dir = self.__version_dir(reponame, version.version)
+                # left behind by a publish that did not finish
+                shutil.rmtree(version_dir, ignore_errors=True)
+                os.makedirs(version_dir)
+                current_dir = self.__version_dir(reponame, current.version)
+                version_hashes = dict(file_hashes)
+                if os.path.isdir(current_dir):
+                    current_hashes = get_version_file_hashes(current_dir)
+                    for name in os.listdir(current_dir):
+                        if name not in file_hashes and os.path.isfile(os.path.join(current_dir, name)):
+                            uptane.repository.blobstore.link_or_copy(os.path.join(current_dir, name),
+                                                                     os.path.join(version_dir, name))
+                            # files of a version migrated from before versioning are hashed once
+                            version_hashes[name] = current_hashes.get(name) or uptane.crypto.hash.get_file_hash(
+                                os.path.join(version_dir, name), uptane.crypto.hash.HashFunc.sha256)
+                for name in file_hashes:
+                    self.blob_store.materialize(file_hashes[name], os.path.join(version_dir, name))
+                with open(self.__version_info_path(reponame, version.version), 'w') as f:
+                    json.dump(dict(version._asdict(), files=version_hashes), f)
+
+                # swap the repo to the new version
+                tmp_link = os.path.join(self.repo_root, VERSIONS_DIR, f'{reponame}.{os.getpid()}.link')
+                if os.path.lexists(tmp_link):
+                    os.remove(tmp_link)
+                os.symlink(os.path.join(VERSIONS_DIR, reponame, str(version.version)), tmp_link)
+                os.replace(tmp_link, repo_path)
+                self.__index[reponame] = version
+
+                # the entries describe the served version, they are committed once it is swapped in
+                self.blob_store.publish(reponame, file_hashes)
+
+                self.__remove_old_versions(reponame, version.version)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+        self.blob_store.gc()
+        return version
+
+    def __remove_old_versions(self, reponame: str, version: int) -> None:
+        versions_dir = os.path.join(self.repo_root, VERSIONS_DIR, reponame)
+        for name in os.listdir(versions_dir):
+            old_version = int(name.split('.')[0])
+            if old_version > version - self.keep_versions:
+                continue
+            # the info of the next version is written right before the swap away from this one
+            try:
+                replaced = os.path.getmtime(self.__version_info_path(reponame, old_version + 1))
+            except FileNotFoundError:
+                replaced = 0
+            if time.time() - replaced >= self.version_grace:
+                path = os.path.join(versions_dir, name)
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
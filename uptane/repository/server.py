@@ -0,0 +1,67 @@
+# production serving of the image and director repos
+#   - runs a repo app under gunicorn with several worker processes, each with a pool of
+#     threads, instead of the flask development server
+#   - roles and keys are loaded once per worker by the init function of the repo
+import typing
+import flask
+
+DEFAULT_WORKERS = 4
+DEFAULT_THREADS = 8
+DEFAULT_KEEPALIVE = 5  # seconds
+DEFAULT_MAX_REQUEST_SIZE = 1024 * 1024 * 1024  # 1 GiB, bounds image uploads
+DEFAULT_TIMEOUT = 300  # seconds, large uploads are verified inside the request
+
+
+def serve(app: flask.Flask,
+          init: typing.Callable[[], None],
+          port: int,
+          workers: int = DEFAULT_WORKERS,
+          threads: int = DEFAULT_THREADS,
+          keepalive: int = DEFAULT_KEEPALIVE,
+          max_request_size: int = DEFAULT_MAX_REQUEST_SIZE,
+          timeout: int = DEFAULT_TIMEOUT) -> None:
+    '''
+    Serves a repo app under gunicorn
+        Parameters:
+            app (flask.Flask): the repo app
+            init (Callable[[], None]): loads the roles and keys of the repo, called once in
+            every worker before it accepts requests
+            port (int): port to listen on
+            workers (int) [Optional, Default: DEFAULT_WORKERS]: number of worker processes
+            threads (int) [Optional, Default: DEFAULT_THREADS]: threads per worker
+            keepalive (int) [Optional, Default: DEFAULT_KEEPALIVE]: seconds to keep an idle
+            connection open
+            max_request_size (int) [Optional, Default: DEFAULT_MAX_REQUEST_SIZE]: largest
+            request body accepted, larger requests get a 413
+            timeout (int) [Optional, Default: DEFAULT_TIMEOUT]: seconds before a silent worker
+            is restarted
+
+        Raises:
+            ImportError - when gunicorn is not installed
+    '''
+    try:
+        import gunicorn.app.base
+    except ImportError as e:
+        raise ImportError("production serving needs gunicorn, pip install gunicorn") from e
+
+    app.config["MAX_CONTENT_LENGTH"] = max_request_size
+
+    class RepoApplication(gunicorn.app.base.BaseApplication):
+
+        def load_config(self) -> None:
+            self.cfg.set("bind", f"0.0.0.0:{port}")
+            self.cfg.set("workers", workers)
+            self.cfg.set("threads", threads)
+            self.cfg.set("worker_class", "gthread")
+            self.cfg.set("keepalive", keepalive)
+            self.cfg.set("timeout", timeout)
+            self.cfg.set("limit_request_line", 8190)
+            self.cfg.set("limit_request_fields", 100)
+            self.cfg.set("limit_request_field_size", 8190)
+
+        def load(self) -> flask.Flask:
+            # called in every worker after the fork
+            init()
+            return app
+
+    RepoApplication().run()
@@ -3,7 +3,7 @@
 import os
 import typing
 import tomli
-import tomli_w
+import uptane.codec
 import uptane.crypto.hash
 import uptane.crypto.sign
 import uptane.time
@@ -12,6 +12,24 @@ import uptane.error.general
 URL = 'http://www.autosec.com/'
 
 
+def gen_signed_metadata(signed_dict: typing.Dict[str, typing.Any], signature_dict: typing.Dict[str, typing.Any],
+                        private_keys: typing.List[str], public_keys: typing.List[str]) -> typing.Dict[str, typing.Any]:
+    '''
+    Signs signed_dict with every key of a role, the canonical payload is hashed once
+        - the signature of the first key goes in signature_dict, as before
+        - with more than one key all signatures are listed in signatures as well
+    '''
+    signatures = uptane.crypto.sign.sign_metadata_keys(signed_dict, \
+        uptane.crypto.hash.HashFunc.sha256, uptane.crypto.sign.KeyType.ed25519, private_keys)
+
+    signature_dict["sig"] = signatures[0]
+    metadata = {"signature": signature_dict, "signed": signed_dict}
+    if len(signatures) > 1:
+        metadata["signatures"] = [{"keyid": public_key, "sig": signature, "key_type": signature_dict["key_type"]} \
+                                  for public_key, signature in zip(public_keys, signatures)]
+    return metadata
+
+
 class AutoRole:
     '''
         Automatic Role Common Functions Class
@@ -55,6 +73,16 @@ class AutoRole:
 
             self.sig_algo = toml_dict["signature"]["algorithm"]
 
+            # more keys of the role for k of n signing, paired by position
+            self.private_keys: typing.List[str] = [self.private_key] + toml_dict.get("private_keys", [])
+            self.public_keys: typing.List[str] = [self.public_key] + toml_dict.get("public_keys", [])
+            if len(self.private_keys) != len(self.public_keys):
+                raise ValueError("private_keys and public_keys of the role do not pair up")
+
+            # parse the signing keys once, every signature afterwards hits the key cache
+            for private_key in self.private_keys:
+                uptane.crypto.sign.KEY_CACHE.get(private_key)
+
             self.signed_dict: typing.Dict = {}
             self.signature_dict: typing.Dict = {}
 
@@ -64,22 +92,26 @@ class AutoRole:
         '''
         Setup base metadataclass for new metadata file generation
         '''
-        self.signed_dict: typing.Dict = {}
-        self.signature_dict: typing.Dict = {}
-        self.__gen_cfg_metadata(gen_img_metadata)
+        self.signed_dict: typing.Dict = self.new_signed_dict(gen_img_metadata)
+        self.signature_dict: typing.Dict = self.new_signature_dict()
 
-    def __gen_cfg_metadata(self, gen_img_metadata: bool = True) -> None:
+    def new_signature_dict(self) -> typing.Dict[str, typing.Any]:
         '''
-        Generates the cfg metadata for the image metadata file
+        Returns a new signature dict for the key of the role, without the signature
         '''
-        self.signature_dict["keyid"] = self.public_key
-        self.signature_dict["sig"] = ""
-        self.signature_dict["key_type"] = self.key_type
+        return {"keyid": self.public_key, "sig": "", "key_type": self.key_type}
 
+    def new_signed_dict(self, gen_img_metadata: bool = True) -> typing.Dict[str, typing.Any]:
+        '''
+        Returns a new signed dict with the cfg metadata for the image metadata file
+        '''
+        signed_dict: typing.Dict[str, typing.Any] = {}
         if gen_img_metadata:
-            self.signed_dict["image_hash_func"] = self.hash_function
-            self.signed_dict["image_buf_size"] = self.bufsize
-            self.signed_dict["image_sig_algo"] = self.sig_algo
+            signed_dict["image_hash_func"] = self.hash_function
+            signed_dict["image_buf_size"] = self.bufsize
+            signed_dict["image_sig_algo"] = self.sig_algo
+
+        return signed_dict
 
     def gen_signed_metadata_file(self, metadata_file: str) -> None:
         '''
@@ -93,17 +125,45 @@ class AutoRole:
             Raises:
                 tomli.TomlDecodeError - when toml has syntax error
         '''
-        self.signed_dict["expires"] = f'{uptane.time.get_fut24_epoch_time()}'
-        self.signature_dict["sig"] = uptane.crypto.sign.sign_metadata(self.signed_dict, \
-        uptane.crypto.hash.HashFunc.sha256, uptane.crypto.sign.KeyType.ed25519, \
-        self.private_key)
-
         with open(metadata_file, "wb") as f:
-            tomli_w.dump(
-                {
-                    "signature": self.signature_dict,
-                    "signed": self.signed_dict
-                }, f)
+            f.write(self.gen_signed_metadata_bytes(uptane.codec.get_codec(metadata_file)))
+
+    def gen_signed_metadata_bytes(self, codec: uptane.codec.Codec = uptane.codec.TOML_CODEC) -> bytes:
+        '''
+        Generates the signed metadata using self.signed_dict, self.signature_dict
+        Generates the signature using self.signed_dict and populates self.signature_dict
+
+            Parameters:
+                codec (Codec) [Optional, Default: TOML_CODEC]: encoding of the metadata
+
+            Returns:
+                bytes: the signed metadata, as it would be written to a metadata file
+        '''
+        return self.sign_signed_dict(self.signed_dict, self.signature_dict, codec)
+
+    def sign_signed_dict(self, signed_dict: typing.Dict[str, typing.Any],
+                         signature_dict: typing.Optional[typing.Dict[str, typing.Any]] = None,
+                         codec: uptane.codec.Codec = uptane.codec.TOML_CODEC) -> bytes:
+        '''
+        Signs a signed dict built by the caller and generates the signed toml metadata
+        Only reads the key material of the role, so it is safe to call from many threads as
+        long as every thread passes its own dicts
+
+            Parameters:
+                signed_dict (Dict[str, Any]): the signed portion, expires is set on it
+                signature_dict (Dict[str, Any]) [Optional]: the signature portion to populate,
+                a new one is created when not given
+                codec (Codec) [Optional, Default: TOML_CODEC]: encoding of the metadata
+
+            Returns:
+                bytes: the signed metadata, as it would be written to a metadata file
+        '''
+        if signature_dict is None:
+            signature_dict = self.new_signature_dict()
+
+        signed_dict["expires"] = f'{uptane.time.get_fut24_epoch_time()}'
+        return codec.dumps(gen_signed_metadata(signed_dict, signature_dict, self.private_keys,
+                                               self.public_keys))
 
 
 class ManualRole:
@@ -150,6 +210,16 @@ class ManualRole:
 
             self.sig_algo = toml_dict["signature"]["algorithm"]
 
+            # more keys of the role for k of n signing, paired by position
+            self.private_keys: typing.List[str] = [self.private_key] + toml_dict.get("private_keys", [])
+            self.public_keys: typing.List[str] = [self.public_key] + toml_dict.get("public_keys", [])
+            if len(self.private_keys) != len(self.public_keys):
+                raise ValueError("private_keys and public_keys of the role do not pair up")
+
+            # parse the signing keys once, every signature afterwards hits the key cache
+            for private_key in self.private_keys:
+                uptane.crypto.sign.KEY_CACHE.get(private_key)
+
             self.signed_dict: typing.Dict = {}
             self.signature_dict: typing.Dict = {}
 
@@ -181,16 +251,10 @@ class ManualRole:
                 tomli.TomlDecodeError - when toml has syntax error
         '''
         self.signed_dict["expires"] = f'{uptane.time.get_fut365y_epoch_time()}'
-        self.signature_dict["sig"] = uptane.crypto.sign.sign_metadata(self.signed_dict, \
-        uptane.crypto.hash.HashFunc.sha256, uptane.crypto.sign.KeyType.ed25519, \
-        self.private_key)
 
-        with open(metadata_file, "wb") as f:
-            tomli_w.dump(
-                {
-                    "signature": self.signature_dict,
-                    "signed": self.signed_dict
-                }, f)
+        # the codec is picked by the extension of metadata_file, toml by default
+        uptane.codec.dump(gen_signed_metadata(self.signed_dict, self.signature_dict, \
+                          self.private_keys, self.public_keys), metadata_file)
 
 
 class TarSnapManualRole(ManualRole):
@@ -223,7 +287,8 @@ class TarSnapManualRole(ManualRole):
                 self.signed_dict["image_size"] = self.__get_file_size()
                 self.signed_dict["image_hash"] = \
                 uptane.crypto.hash.get_file_hash(self.local_image_path, \
-                uptane.crypto.hash.HashFunc.sha256, self.bufsize)
+                uptane.crypto.hash.HashFunc.sha256, self.bufsize, \
+                self.signed_dict["image_size"] >= uptane.crypto.hash.MMAP_MIN_SIZE)
                 self.image_cfg_toml_dict = toml_dict  # for latter use
 
     def __get_file_size(self) -> int:
@@ -253,31 +318,22 @@ class TarSnapAutoRole(AutoRole):
     def tarsnapauto_reinit(self, image_cfg: typing.Any):
 
         if image_cfg is not None:
-
-            self.auto__reinit(True)
-            self.signed_dict["image_name"] = image_cfg["image_name"]
-            self.signed_dict["image_url"] = image_cfg["image_url"]
-            self.signed_dict["image_version"] = image_cfg["image_version"]
-            self.signed_dict["image_size"] = image_cfg["image_size"]
-            self.signed_dict["image_hash"] = image_cfg["image_hash"]
+            self.signed_dict = self.new_image_signed_dict(image_cfg)
+            self.signature_dict = self.new_signature_dict()
             self.image_cfg_toml_dict = image_cfg
 
         else:
-
             self.auto__reinit(False)
             self.image_cfg_toml_dict = {}
 
-            if self.signed_dict.get('image_name'):
-                del self.signed_dict['image_name']
-
-            if self.signed_dict.get('image_url'):
-                del self.signed_dict['image_url']
-
-            if self.signed_dict.get('image_version'):
-                del self.signed_dict['image_version']
-
-            if self.signed_dict.get('image_size'):
-                del self.signed_dict['image_size']
-
-            if self.signed_dict.get('image_hash'):
-                del self.signed_dict['image_hash']
+    def new_image_signed_dict(self, image_cfg: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+        '''
+        Returns a new signed dict with the cfg metadata and the image metadata
+        '''
+        signed_dict = self.new_signed_dict(True)
+        signed_dict["image_name"] = image_cfg["image_name"]
+        signed_dict["image_url"] = image_cfg["image_url"]
+        signed_dict["image_version"] = image_cfg["image_version"]
+        signed_dict["image_size"] = image_cfg["image_size"]
+        signed_dict["image_hash"] = image_cfg["image_hash"]
+        return signed_dict
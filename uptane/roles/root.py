@@ -2,7 +2,8 @@
 # Root service
 #   - root service keys need to be updated and used the least amongst all services
 #   - will generate root.toml file (using toml files to make it human readable)
-# NOTE: only accepts one key currenlty
+# NOTE: every role can have several keys (public_keys) and a threshold of them that has to sign
+import typing
 import uptane.roles.role
 
 
@@ -28,30 +29,38 @@ class Root(uptane.roles.role.ManualRole):
         Generate metadata for the different roles using cfg file
         '''
         self.signed_dict["keys"] = []
-        self.signed_dict["keys"].append({
-            "keytype": "ed25519",
-            "keyid": self.public_key
-        })
+        for public_key in self.public_keys:
+            self.signed_dict["keys"].append({
+                "keytype": "ed25519",
+                "keyid": public_key
+            })
+        self.signed_dict["threshold"] = self.__get_threshold(self.cfg_toml_dict, len(self.public_keys))
 
         # inserting keys for various roles
         self.signed_dict["roles"] = {}
-        self.signed_dict["roles"]["targets"] = {}
-        self.signed_dict["roles"]["targets"]["keys"] = []
-        self.signed_dict["roles"]["targets"]["keys"].append({"keytype":          \
-        self.cfg_toml_dict["targets"]["key_type"], "keyid":         \
-        self.cfg_toml_dict["targets"]["public_key"]})
-        self.signed_dict["roles"]["targets"]["threshold"] = 1
-
-        self.signed_dict["roles"]["snapshot"] = {}
-        self.signed_dict["roles"]["snapshot"]["keys"] = []
-        self.signed_dict["roles"]["snapshot"]["keys"].append({"keytype":                        \
-        self.cfg_toml_dict["snapshot"]["key_type"], "keyid":                         \
-        self.cfg_toml_dict["snapshot"]["public_key"]})
-        self.signed_dict["roles"]["snapshot"]["threshold"] = 1
-
-        self.signed_dict["roles"]["timestamp"] = {}
-        self.signed_dict["roles"]["timestamp"]["keys"] = []
-        self.signed_dict["roles"]["timestamp"]["keys"].append({"keytype":                        \
-        self.cfg_toml_dict["timestamp"]["key_type"], "keyid":                         \
-        self.cfg_toml_dict["timestamp"]["public_key"]})
-        self.signed_dict["roles"]["timestamp"]["threshold"] = 1
+        for role in ("targets", "snapshot", "timestamp"):
+            self.signed_dict["roles"][role] = self.__role_keys(self.cfg_toml_dict[role])
+
+    def __get_threshold(self, cfg: typing.Dict[str, typing.Any], keys_count: int) -> int:
+        '''
+        Returns the threshold of a role from its cfg, 1 when not given
+
+            Raises:
+                ValueError - when the threshold can not be met by the keys of the role
+        '''
+        threshold = int(cfg.get("threshold", 1))
+        if not 1 <= threshold <= keys_count:
+            raise ValueError(f"threshold {threshold} can not be met by {keys_count} keys")
+        return threshold
+
+    def __role_keys(self, cfg: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+        '''
+        Returns the keys and threshold of a role from its cfg, its public_key followed by its
+        public_keys
+
+            Raises:
+                ValueError - when the threshold can not be met by the keys of the role
+        '''
+        keys = [{"keytype": cfg["key_type"], "keyid": public_key} \
+                for public_key in [cfg["public_key"]] + cfg.get("public_keys", [])]
+        return {"keys": keys, "threshold": self.__get_threshold(cfg, len(keys))}
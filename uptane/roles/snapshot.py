@@ -1,14 +1,157 @@
 # snapshot role
+import collections
+import concurrent.futures
 import os
+import threading
+import typing
 import uptane.crypto.hash
 import uptane.time
 from uptane.roles.role import TarSnapAutoRole, TarSnapManualRole
 import tomli
+import uptane.codec
 from uptane.error.general import MetadataFileHasExpired
 
 ONLINE_SNAPSHOT_SPEC_VERSION = "0.0.1"
 OFFLINE_SNAPSHOT_SPEC_VERSION = "0.0.1"
 
+# above this many targets files to read the offline snapshot reads them on a process pool,
+# parsing does not release the GIL, the online snapshot runs in the threaded director where
+# forking is unsafe and always reads them on threads
+PROCESS_POOL_MIN_FILES = 2000
+PROCESS_POOL_CHUNKSIZE = 256
+TARGETS_ENTRIES_MAXSIZE = 65536
+# name the expires of targets metadata files is kept under in the persistent hash cache
+TARGETS_EXPIRES_ALGO = "targets_expires"
+
+
+class TargetsEntry(typing.NamedTuple):
+    '''
+    What a snapshot needs of a targets metadata file
+    '''
+    hash: str
+    expires: int
+
+
+# entries of targets metadata files already read, keyed by path, reused while the file
+# is unchanged (size, mtime, ctime, inode, device), least recently used entries are evicted
+# above TARGETS_ENTRIES_MAXSIZE, with the persistent hash cache enabled the entries are also
+# kept there, so runs of the offline cli do not read unchanged files again
+TARGETS_ENTRIES: collections.OrderedDict = collections.OrderedDict()
+TARGETS_ENTRIES_LOCK = threading.Lock()
+
+
+def get_targets_expires(targets_metadata: bytes, targets_metadata_file: str) -> int:
+    '''
+    Get the expires of targets metadata, parsed with the codec of the file, only the expires
+    is kept
+
+        Raises:
+            tomli.TOMLDecodeError
+            ValueError - error in decoding msgpack metadata
+    '''
+    return int(uptane.codec.loads(targets_metadata, targets_metadata_file)["signed"]["expires"])
+
+
+def read_targets_entry(targets_metadata_file: str) -> TargetsEntry:
+    '''
+    Reads a targets metadata file once for both its hash and its expires
+    '''
+    with open(targets_metadata_file, "rb") as f:
+        targets_metadata = f.read()
+
+    return TargetsEntry(uptane.crypto.hash.get_bytes_hash(targets_metadata, \
+                        uptane.crypto.hash.HashFunc.sha256), \
+                        get_targets_expires(targets_metadata, targets_metadata_file))
+
+
+def get_cached_targets_entry(targets_metadata_file: str, stat: os.stat_result) -> typing.Optional[TargetsEntry]:
+    '''
+    Get the entry of an unchanged targets metadata file from the persistent hash cache
+    '''
+    hash_cache = uptane.crypto.hash.HASH_CACHE
+    if hash_cache is None:
+        return None
+    digest = hash_cache.get(targets_metadata_file, stat, uptane.crypto.hash.HashFunc.sha256.name)
+    expires = hash_cache.get(targets_metadata_file, stat, TARGETS_EXPIRES_ALGO)
+    if digest is None or expires is None:
+        return None
+    return TargetsEntry(digest, int(expires))
+
+
+def build_targets_entries(targets_metadata_files: typing.List[str],
+                          workers: typing.Optional[int] = None,
+                          processes: bool = False) -> typing.Dict[str, TargetsEntry]:
+    '''
+    Get the hash and expires of many targets metadata files, files unchanged since they were
+    last read are not read again, the rest are read in parallel
+        Parameters:
+            targets_metadata_files (List[str]): paths of the targets metadata files
+            workers (int) [Optional]: size of the pool, defaults to the executor default
+            processes (bool) [Optional, Default: False]: read PROCESS_POOL_MIN_FILES or more
+            files on a process pool, only for single threaded callers
+
+        Returns:
+            Dict[str, TargetsEntry]: map of path to the entry of the file
+
+        Raises:
+            FileNotFoundError
+            tomli.TOMLDecodeError
+    '''
+    entries: typing.Dict[str, TargetsEntry] = {}
+    stats = {}
+    unread_files = []
+
+    for targets_metadata_file in dict.fromkeys(targets_metadata_files):
+        stat = os.stat(targets_metadata_file)
+        stat_key = (stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns, stat.st_ino, stat.st_dev)
+        cache_key = os.path.abspath(targets_metadata_file)
+        with TARGETS_ENTRIES_LOCK:
+            cached = TARGETS_ENTRIES.get(cache_key)
+            if cached is not None and cached[0] == stat_key:
+                TARGETS_ENTRIES.move_to_end(cache_key)
+        if cached is not None and cached[0] == stat_key:
+            entries[targets_metadata_file] = cached[1]
+            continue
+
+        entry = get_cached_targets_entry(targets_metadata_file, stat)
+        if entry is not None:
+            entries[targets_metadata_file] = entry
+            with TARGETS_ENTRIES_LOCK:
+                TARGETS_ENTRIES[cache_key] = (stat_key, entry)
+                TARGETS_ENTRIES.move_to_end(cache_key)
+        else:
+            stats[targets_metadata_file] = stat
+            unread_files.append(targets_metadata_file)
+
+    if len(unread_files) <= 1:
+        new_entries = [read_targets_entry(path) for path in unread_files]
+    elif len(unread_files) < PROCESS_POOL_MIN_FILES or not processes:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            new_entries = list(executor.map(read_targets_entry, unread_files))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            new_entries = list(executor.map(read_targets_entry, unread_files,
+                                            chunksize=PROCESS_POOL_CHUNKSIZE))
+
+    hash_cache = uptane.crypto.hash.HASH_CACHE
+    for targets_metadata_file, entry in zip(unread_files, new_entries):
+        entries[targets_metadata_file] = entry
+        if hash_cache is not None:
+            stat = stats[targets_metadata_file]
+            hash_cache.put(targets_metadata_file, stat, uptane.crypto.hash.HashFunc.sha256.name, entry.hash)
+            hash_cache.put(targets_metadata_file, stat, TARGETS_EXPIRES_ALGO, str(entry.expires))
+
+    with TARGETS_ENTRIES_LOCK:
+        for targets_metadata_file, entry in zip(unread_files, new_entries):
+            stat = stats[targets_metadata_file]
+            TARGETS_ENTRIES[os.path.abspath(targets_metadata_file)] = \
+                ((stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns, stat.st_ino, stat.st_dev), entry)
+            TARGETS_ENTRIES.move_to_end(os.path.abspath(targets_metadata_file))
+        while len(TARGETS_ENTRIES) > TARGETS_ENTRIES_MAXSIZE:
+            TARGETS_ENTRIES.popitem(last=False)
+
+    return entries
+
 
 class SnapshotOnline(TarSnapAutoRole):
     '''
@@ -34,15 +177,52 @@ class SnapshotOnline(TarSnapAutoRole):
         self.signed_dict["_type"] = "snapshot"
         self.signed_dict["bufsize"] = self.bufsize
 
-        self.targets = {}
         self.targets_metadata_files = targets_metadata_files
-        for targets_metadata_file in targets_metadata_files:
-            with open(targets_metadata_file, "rb") as f:
-                # loading toml of all targets_metadata_file
-                self.targets[targets_metadata_file] = tomli.load(f)
+        # only the hash and expires of every targets_metadata_file are kept
+        self.targets = build_targets_entries(targets_metadata_files)
 
         self.__generate_metadata()
 
+    def snapshotonline_reinit_bytes(self, targets_metadata: typing.Dict[str, bytes]) -> None:
+        '''
+        create metadata for targets metadata held in memory
+            Parameters:
+                targets_metadata (Dict[str, bytes]): targets metadata file name -> toml bytes
+        '''
+        self.tarsnapauto_reinit(None)
+        self.targets = {}
+        self.targets_metadata_files = list(targets_metadata)
+        self.signed_dict = self.build_signed_dict(targets_metadata)
+
+    def build_signed_dict(self, targets_metadata: typing.Dict[str, bytes]) -> typing.Dict[str, typing.Any]:
+        '''
+        Builds a new snapshot signed dict for targets metadata held in memory without
+        touching self.signed_dict, sign it with sign_signed_dict
+            Parameters:
+                targets_metadata (Dict[str, bytes]): targets metadata file name -> toml bytes
+
+            Raises:
+                MetadataFileHasExpired
+                tomli.TOMLDecodeError
+        '''
+        signed_dict = self.new_signed_dict(False)
+        signed_dict["targets"] = {}
+        signed_dict["spec_version"] = ONLINE_SNAPSHOT_SPEC_VERSION
+        signed_dict["_type"] = "snapshot"
+        signed_dict["bufsize"] = self.bufsize
+
+        for targets_metadata_file in targets_metadata:
+            if uptane.time.fut_is_expired(get_targets_expires(targets_metadata[targets_metadata_file], \
+                                          targets_metadata_file)):
+                raise MetadataFileHasExpired
+
+            signed_dict["targets"][targets_metadata_file] = {}
+            signed_dict["targets"][targets_metadata_file]["hash"] = \
+            uptane.crypto.hash.get_bytes_hash(targets_metadata[targets_metadata_file], \
+            uptane.crypto.hash.HashFunc.sha256)
+
+        return signed_dict
+
     def __generate_metadata(self) -> None:
         '''
         Populate the signed dict that will be converted to a toml file
@@ -51,16 +231,14 @@ class SnapshotOnline(TarSnapAutoRole):
         using anyother func will ultimately make it fail
         '''
         self.signed_dict["targets"] = {}
+
         for targets_metadata_file in self.targets_metadata_files:
-            
+
             self.signed_dict["targets"][targets_metadata_file] = {}
             self.signed_dict["targets"][targets_metadata_file]["hash"] = \
-            uptane.crypto.hash.get_file_hash(targets_metadata_file, \
-            uptane.crypto.hash.HashFunc.sha256, self.bufsize)
+            self.targets[targets_metadata_file].hash
 
-            if uptane.time.fut_is_expired(
-                    int(self.targets[targets_metadata_file]["signed"]
-                        ["expires"])):
+            if uptane.time.fut_is_expired(self.targets[targets_metadata_file].expires):
                 raise MetadataFileHasExpired
 
 
@@ -89,10 +267,8 @@ class SnapshotOffline(TarSnapManualRole):
         self.signed_dict["_type"] = "snapshot"
         self.signed_dict["bufsize"] = self.bufsize
 
-        for targets_metadata_file in targets_metadata_files:
-            with open(targets_metadata_file, "rb") as f:
-                # loading toml of all targets_metadata_file
-                self.targets[targets_metadata_file] = tomli.load(f)
+        # only the hash and expires of every targets_metadata_file are kept
+        self.targets = build_targets_entries(targets_metadata_files, processes=True)
 
         self.__generate_metadata()
 
@@ -109,10 +285,7 @@ class SnapshotOffline(TarSnapManualRole):
 
             self.signed_dict["targets"][targets_key] = {}
             self.signed_dict["targets"][targets_key]["hash"] = \
-            uptane.crypto.hash.get_file_hash(targets_metadata_file, \
-            uptane.crypto.hash.HashFunc.sha256, self.bufsize)
+            self.targets[targets_metadata_file].hash
 
-            if uptane.time.fut_is_expired(
-                    int(self.targets[targets_metadata_file]["signed"]
-                        ["expires"])):
+            if uptane.time.fut_is_expired(self.targets[targets_metadata_file].expires):
                 raise MetadataFileHasExpired
@@ -1,5 +1,7 @@
 # file for implementing targets role
 from uptane.roles.role import TarSnapManualRole, TarSnapAutoRole
+import uptane.crypto.hash
+import uptane.delta
 import typing
 
 ONLINE_TARGETS_SPEC_VERSION = "0.0.1"
@@ -18,9 +20,23 @@ class TargetsOnline(TarSnapAutoRole):
         self.signed_dict["_type"] = "targets"
 
     def targetsoneline_reinit(self, image_cfg: typing.Any):
+        self.tarsnapauto_reinit(image_cfg)
         self.signed_dict["spec_version"] = str(ONLINE_TARGETS_SPEC_VERSION)
         self.signed_dict["_type"] = "targets"
-        self.tarsnapauto_reinit(image_cfg)
+
+    def build_signed_dict(self, image_cfg: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+        '''
+        Builds a new targets signed dict for an image without touching self.signed_dict,
+        sign it with sign_signed_dict
+            Parameters:
+                image_cfg (Dict[str, Any]): image metadata from the update manifest
+        '''
+        signed_dict = self.new_image_signed_dict(image_cfg)
+        signed_dict["spec_version"] = str(ONLINE_TARGETS_SPEC_VERSION)
+        signed_dict["_type"] = "targets"
+        if "image_deltas" in image_cfg:
+            signed_dict["image_deltas"] = image_cfg["image_deltas"]
+        return signed_dict
 
 
 # verification function to verify the image toml file
@@ -44,9 +60,66 @@ class TargetsOffline(TarSnapManualRole):
         Populate the signed_dict that will be converted to a toml file
         '''
         # adding vendor specific metadata to signed metadata
-        reserved_metadata_keys = {'local_path', '_name', '_url', '_version'}
+        reserved_metadata_keys = {'local_path', '_name', '_url', '_version', '_delta_base_path',
+                                  '_delta_base_version', '_delta_path', '_delta_url', '_chunk_size',
+                                  '_chunks_path', '_chunks_url'}
+
+        if "_delta_base_path" in self.image_cfg_toml_dict:
+            self.__generate_delta()
+
+        if "_chunk_size" in self.image_cfg_toml_dict:
+            self.__generate_merkle()
 
         for key in self.image_cfg_toml_dict:
             if not key in reserved_metadata_keys:
                 self.signed_dict["imetadata"][key] = self.image_cfg_toml_dict[
                     key]
+
+    def __generate_delta(self) -> None:
+        '''
+        Generates the delta from the previous image version given in the image cfg and
+        signs its hash and size, so vehicles on that version can download only the delta
+        Image Cfg:
+            - _delta_base_path: the previous image
+            - _delta_base_version: version of the previous image
+            - _delta_path [Optional]: where to write the delta, default <local_path>.<base version>.delta
+            - _delta_url [Optional]: url of the delta, default <_url>.<base version>.delta
+        '''
+        base_version = self.image_cfg_toml_dict["_delta_base_version"]
+        delta_path = self.image_cfg_toml_dict.get("_delta_path",
+                                                  f'{self.local_image_path}.{base_version}.delta')
+        delta_url = self.image_cfg_toml_dict.get("_delta_url",
+                                                 f'{self.signed_dict["image_url"]}.{base_version}.delta')
+
+        delta_size = uptane.delta.gen_delta(self.image_cfg_toml_dict["_delta_base_path"],
+                                            self.local_image_path, delta_path)
+        self.signed_dict["image_deltas"] = {
+            base_version: {
+                "delta_url": delta_url,
+                "delta_size": delta_size,
+                "delta_hash": uptane.crypto.hash.get_file_hash(delta_path, \
+                              uptane.crypto.hash.HashFunc.sha256, self.bufsize)
+            }
+        }
+
+    def __generate_merkle(self) -> None:
+        '''
+        Signs the merkle root over fixed size chunks of the image and writes the chunk hashes
+        next to it, so vehicles can verify the image chunk by chunk while downloading it
+        Image Cfg:
+            - _chunk_size: size of the chunks in bytes
+            - _chunks_path [Optional]: where to write the chunk hashes, default <local_path>.chunks
+            - _chunks_url [Optional]: url of the chunk hashes, default <_url>.chunks
+        '''
+        chunk_size = int(self.image_cfg_toml_dict["_chunk_size"])
+        chunks_path = self.image_cfg_toml_dict.get("_chunks_path", f'{self.local_image_path}.chunks')
+
+        merkle_root, chunk_hashes = uptane.crypto.hash.get_file_merkle(self.local_image_path, \
+                                    uptane.crypto.hash.HashFunc.sha256, chunk_size)
+        with open(chunks_path, "w") as f:
+            f.write("\n".join(chunk_hashes))
+
+        self.signed_dict["image_chunk_size"] = chunk_size
+        self.signed_dict["image_merkle_root"] = merkle_root
+        self.signed_dict["image_chunks_url"] = self.image_cfg_toml_dict.get("_chunks_url", \
+                                               f'{self.signed_dict["image_url"]}.chunks')
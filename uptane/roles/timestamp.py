@@ -4,6 +4,8 @@ from uptane.roles.role import AutoRole, ManualRole
 from uptane.error.general import MetadataFileHasExpired
 import uptane.crypto.hash
 import tomli
+import uptane.codec
+import typing
 import uptane.time
 
 OFFLINE_TIMESTAMP_SPEC_VERSION = "0.0.1"
@@ -27,12 +29,49 @@ class TimestampOnline(AutoRole):
         self.auto__reinit(False)
         self.snapshot_metadata_file = snapshot_metadata_file
 
-        with open(snapshot_metadata_file, "rb") as f:
-            self.snapshot_metadata_file_dict = tomli.load(f)
+        self.snapshot_metadata_file_dict = uptane.codec.load(snapshot_metadata_file)
 
         self.__generate_metadata()
         self.signed_dict["vin"] = id
 
+    def timestamponline_reinit_bytes(self, snapshot_metadata: bytes, id: str,
+                                     snapshot_expires: int) -> None:
+        '''
+        create metadata for snapshot metadata held in memory
+            Parameters:
+                snapshot_metadata (bytes): toml bytes of the snapshot metadata
+                id (str): vin of the vehicle
+                snapshot_expires (int): expiry epoch of the snapshot metadata
+        '''
+        self.auto__reinit(False)
+        self.snapshot_metadata_file = None
+        self.signed_dict = self.build_signed_dict(snapshot_metadata, id, snapshot_expires)
+
+    def build_signed_dict(self, snapshot_metadata: bytes, id: str,
+                          snapshot_expires: int) -> typing.Dict[str, typing.Any]:
+        '''
+        Builds a new timestamp signed dict for snapshot metadata held in memory without
+        touching self.signed_dict, sign it with sign_signed_dict
+            Parameters:
+                snapshot_metadata (bytes): toml bytes of the snapshot metadata
+                id (str): vin of the vehicle
+                snapshot_expires (int): expiry epoch of the snapshot metadata, known to the
+                caller that signed it, so the snapshot is not parsed again
+
+            Raises:
+                MetadataFileHasExpired
+        '''
+        if uptane.time.fut_is_expired(snapshot_expires):
+            raise MetadataFileHasExpired
+
+        signed_dict = self.new_signed_dict(False)
+        signed_dict["bufsize"] = self.bufsize
+        signed_dict["_type"] = "timestamp"
+        signed_dict["snapshot_metadata_file_hash"] = uptane.crypto.hash.get_bytes_hash( \
+            snapshot_metadata, uptane.crypto.hash.HashFunc.sha256)
+        signed_dict["vin"] = id
+        return signed_dict
+
     def __generate_metadata(self):
 
         self.signed_dict["bufsize"] = self.bufsize
@@ -64,8 +103,7 @@ class TimestampOffline(ManualRole):
         ManualRole.__init__(self, cfg, gen_img_metadata=False)
         self.snapshot_metadata_file = snapshot_metadata_file
 
-        with open(snapshot_metadata_file, "rb") as f:
-            self.snapshot_metadata_file_dict = tomli.load(f)
+        self.snapshot_metadata_file_dict = uptane.codec.load(snapshot_metadata_file)
 
         self.signed_dict["bufsize"] = self.bufsize
         self.signed_dict["_type"] = "timestamp"
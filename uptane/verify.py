@@ -1,16 +1,331 @@
 import os
 import tomli
+import uptane.codec
 import uptane.time
 import uptane.error.general
 import uptane.crypto.hash
 import uptane.crypto.sign
 import typing
 import json
+import threading
+import fcntl
 from Crypto.Cipher import AES
 from Crypto.Cipher._mode_eax import EaxMode
 from typing import Any
 
 
+class RoleKeys(typing.NamedTuple):
+    '''
+    The keys root trusts for a role and how many of them have to sign its metadata
+    '''
+    keys: typing.List[str]
+    threshold: int
+
+
+def role_keys(role_dict: typing.Dict[str, typing.Any]) -> RoleKeys:
+    '''
+    Returns the keys of a role entry of root metadata (or of the signed root itself), a key
+    listed more than once (in any pem form) is kept once
+
+        Raises:
+            uptane.error.general.InvalidThreshold - the threshold is lower than 1
+            ValueError - a key is not a valid public key
+    '''
+    threshold = int(role_dict.get("threshold", 1))
+    if threshold < 1:
+        raise uptane.error.general.InvalidThreshold
+
+    keys = {}
+    for key in role_dict["keys"]:
+        keys.setdefault(__raw_key(key["keyid"]), key["keyid"])
+    return RoleKeys(list(keys.values()), threshold)
+
+
+def __raw_key(pub_key: str) -> bytes:
+    '''
+    Returns the raw bytes of a key in pem format, the same key has one raw form whatever
+    its pem encoding
+
+        Raises:
+            ValueError - the key can not be parsed
+    '''
+    return uptane.crypto.sign.KEY_CACHE.get(pub_key).public_key().export_key(format='raw')
+
+
+def verify_signatures(groups: typing.List[uptane.crypto.sign.ThresholdGroup]) -> None:
+    '''
+    Verifies a batch of signed metadata, each against the threshold of its role, all
+    signatures are checked in parallel
+
+        Raises:
+            uptane.error.general.MetadataFileInvalidSignature
+    '''
+    for result in uptane.crypto.sign.verify_threshold_batch(groups, \
+        uptane.crypto.hash.HashFunc.sha256, uptane.crypto.sign.KeyType.ed25519):
+        if not result.valid:
+            raise uptane.error.general.MetadataFileInvalidSignature from result.error
+
+
+def metadata_signatures(toml_dict: typing.Dict[str, typing.Any]) -> typing.List[typing.Tuple[str, str]]:
+    '''
+    Returns the (key, signature) of every signature of metadata, metadata signed by one key
+    only has the signature table
+    '''
+    signatures = toml_dict.get("signatures") or [toml_dict["signature"]]
+    return [(signature["keyid"], signature["sig"]) for signature in signatures]
+
+
+def authorized_signatures(toml_dict: typing.Dict[str, typing.Any], keys: RoleKeys) -> typing.List[typing.Tuple[str, str]]:
+    '''
+    Returns the signatures of metadata made by keys of the role, one per key, keys are
+    compared by their raw bytes so a key in another pem form is not counted twice
+    '''
+    role_raw_keys = {__raw_key(pub_key) for pub_key in keys.keys}
+    signatures = {}
+    for pub_key, signature in metadata_signatures(toml_dict):
+        try:
+            raw_key = __raw_key(pub_key)
+        except ValueError:
+            continue  # not a key, can not be a key of the role
+        if raw_key in role_raw_keys and raw_key not in signatures:
+            signatures[raw_key] = (pub_key, signature)
+    return list(signatures.values())
+
+
+def check_role_metadata(toml_dict: typing.Dict[str, typing.Any], keys: RoleKeys) -> None:
+    '''
+    Checks that role metadata was signed by enough keys of the role in root and has not expired
+
+        Raises:
+            uptane.error.general.PublicKeysNoMatch
+            uptane.error.general.MetadataFileHasExpired
+    '''
+    if len(authorized_signatures(toml_dict, keys)) < keys.threshold:
+        raise uptane.error.general.PublicKeysNoMatch
+
+    if uptane.time.fut_is_expired(int(toml_dict["signed"]["expires"])):
+        raise uptane.error.general.MetadataFileHasExpired
+
+
+def signature_item(toml_dict: typing.Dict[str, typing.Any], keys: RoleKeys) -> uptane.crypto.sign.ThresholdGroup:
+    '''
+    Returns the signatures of role metadata by keys of the role, for verify_signatures
+    '''
+    return uptane.crypto.sign.ThresholdGroup(toml_dict['signed'], authorized_signatures(toml_dict, keys),
+                                             keys.threshold)
+
+
+def verify_images(targets_toml_dicts: typing.List[typing.Dict[str, typing.Any]], targets_files_dir_path: str,
+                  hash_files: typing.Callable[[typing.Iterable[str], int], typing.Dict[str, str]],
+                  other_image_names: typing.Collection[str] = ()) -> None:
+    '''
+    Verifies the hash of the image of every targets metadata against the hash in it, images
+    are grouped by the buf size of their own targets metadata and hashed in parallel
+        Parameters:
+            targets_toml_dicts (List[Dict[str, Any]]): the verified targets metadata
+            targets_files_dir_path (str): directory where the images exist
+            hash_files (Callable[[Iterable[str], int], Dict[str, str]]): hashes files with a buf
+            size, returns the sha256 of every file
+            other_image_names (Collection[str]) [Optional]: images of trusted targets metadata
+            that is not verified again, no targets metadata may name one of them
+
+        Raises:
+            FileNotFoundError - when file is not found
+            uptane.error.general.FileHashNoMatch
+            uptane.error.general.DuplicateImageName
+    '''
+    image_hashes: typing.Dict[int, typing.Dict[str, str]] = {}
+    image_names = set()
+    for toml_dict in targets_toml_dicts:
+        image_name = toml_dict["signed"]["image_name"]
+        # two targets files for one image would overwrite each other's hash
+        if image_name in image_names or image_name in other_image_names:
+            raise uptane.error.general.DuplicateImageName(image_name)
+        image_names.add(image_name)
+        buf_size = int(toml_dict["signed"]["image_buf_size"])
+        image_file = f'{targets_files_dir_path}/' + image_name
+        image_hashes.setdefault(buf_size, {})[image_file] = toml_dict["signed"]["image_hash"]
+
+    for buf_size in image_hashes:
+        if hash_files(image_hashes[buf_size], buf_size) != image_hashes[buf_size]:
+            raise uptane.error.general.FileHashNoMatch
+
+
+# file where verified root states are persisted between runs, None keeps them in memory only
+TRUSTED_STATE_FILE_PATH: typing.Optional[str] = None
+TRUSTED_STATES: typing.Dict[str, "TrustedState"] = {}
+TRUSTED_STATES_LOCK = threading.Lock()
+
+
+class RootState(typing.NamedTuple):
+    '''
+    A verified root, the keys of all roles are read from one RootState so they always come
+    from the same root version
+    '''
+    root_hash: typing.Optional[str]
+    root_expires: int
+    root_keys: RoleKeys
+    targets_keys: RoleKeys
+    snapshot_keys: RoleKeys
+    timestamp_keys: RoleKeys
+
+
+class TrustedState:
+    '''
+    The verified root of a root metadata file, the root is parsed and its signature is
+    verified once and the role keys are kept (and parsed into the key cache) until the
+    content of the root metadata file changes.
+    With TRUSTED_STATE_FILE_PATH set the hash and expiry of the last verified root are
+    persisted, a root expiring before it is refused as a rollback. The file is not signed,
+    so it is only a hint: the keys always come from the verified root itself.
+    The verified root is swapped in as a whole once it is verified, read it with snapshot().
+    '''
+
+    def __init__(self, root_metadata_file_path: str) -> None:
+        self.root_metadata_file_path = os.path.abspath(root_metadata_file_path)
+        self.__state = RootState(None, 0, RoleKeys([], 1), RoleKeys([], 1), RoleKeys([], 1),
+                                 RoleKeys([], 1))
+        self.__stat_key: typing.Optional[typing.Tuple[int, int, int]] = None
+        self.__lock = threading.Lock()
+
+    def refresh(self) -> "TrustedState":
+        '''
+        Reloads the root when the root metadata file has changed since the last call, a
+        call with an unchanged root file only costs a stat
+
+            Returns:
+                TrustedState: self
+
+            Raises:
+                FileNotFoundError - file not found
+                tomli.TomlDecodeError - error in decoding toml file
+                uptane.error.general.MetadataFileHasExpired
+                uptane.error.general.MetadataFileInvalidSignature
+                uptane.error.general.MetadataRollback
+        '''
+        with self.__lock:
+            stat = os.stat(self.root_metadata_file_path)
+            stat_key = (stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns)
+            if stat_key != self.__stat_key:
+                with open(self.root_metadata_file_path, 'rb') as f:
+                    root_metadata = f.read()
+                root_hash = uptane.crypto.hash.get_bytes_hash(root_metadata, \
+                            uptane.crypto.hash.HashFunc.sha256)
+                # only a new root version invalidates the state, touching the file does not
+                if root_hash != self.__state.root_hash:
+                    self.__state = self.__load(root_metadata, root_hash)
+                self.__stat_key = stat_key
+            state = self.__state
+
+        if uptane.time.fut_is_expired(state.root_expires):
+            raise uptane.error.general.MetadataFileHasExpired
+        return self
+
+    def snapshot(self) -> RootState:
+        '''
+        Returns the current verified root, call refresh first to pick up a new root file
+        '''
+        with self.__lock:
+            return self.__state
+
+    def __load(self, root_metadata: bytes, root_hash: str) -> RootState:
+        '''
+        Parses the root and verifies its signature with the keys of the root itself, nothing
+        of the root is kept when it does not verify
+        '''
+        toml_dict = uptane.codec.loads(root_metadata, self.root_metadata_file_path)
+        root_signed = toml_dict["signed"]
+        root_state = RootState(root_hash, int(root_signed["expires"]), role_keys(root_signed),
+                               *(role_keys(root_signed["roles"][role]) for role in ("targets", "snapshot", "timestamp")))
+
+        if uptane.time.fut_is_expired(root_state.root_expires):
+            raise uptane.error.general.MetadataFileHasExpired
+        check_role_metadata(toml_dict, root_state.root_keys)
+        verify_signatures([signature_item(toml_dict, root_state.root_keys)])
+        self.__persist(root_state)
+
+        # parse all role keys once, the signature checks of the roles hit the key cache
+        for keys in (root_state.root_keys, root_state.targets_keys, root_state.snapshot_keys,
+                     root_state.timestamp_keys):
+            for pub_key in keys.keys:
+                uptane.crypto.sign.KEY_CACHE.get(pub_key)
+        return root_state
+
+    def __persist(self, root_state: RootState) -> None:
+        '''
+        Records a verified root in the state file, the file is locked while it is read and
+        replaced, so runs sharing it do not drop each other's roots
+
+            Raises:
+                uptane.error.general.MetadataRollback - the root expires before the last root
+                verified for the same file
+        '''
+        if TRUSTED_STATE_FILE_PATH is None:
+            return
+
+        with open(f'{TRUSTED_STATE_FILE_PATH}.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                states = self.__read_persisted()
+                persisted = states.get(self.root_metadata_file_path)
+                if isinstance(persisted, dict):
+                    if int(persisted.get("root_expires", 0)) > root_state.root_expires:
+                        raise uptane.error.general.MetadataRollback
+                    if persisted.get("root_hash") == root_state.root_hash:
+                        return
+
+                states[self.root_metadata_file_path] = {"root_hash": root_state.root_hash,
+                                                        "root_expires": root_state.root_expires}
+                tmp_file_path = f'{TRUSTED_STATE_FILE_PATH}.{os.getpid()}.{threading.get_ident()}.tmp'
+                with open(tmp_file_path, 'w') as f:
+                    json.dump(states, f)
+                os.replace(tmp_file_path, TRUSTED_STATE_FILE_PATH)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def __read_persisted(self) -> typing.Dict[str, typing.Any]:
+        if not os.path.exists(TRUSTED_STATE_FILE_PATH):
+            return {}
+        try:
+            with open(TRUSTED_STATE_FILE_PATH, 'r') as f:
+                states = json.load(f)
+        except ValueError:
+            # a corrupt state file only loses the rollback check of the roots in it
+            return {}
+        return states if isinstance(states, dict) else {}
+
+
+def enable_trusted_state(state_file_path: str) -> None:
+    '''
+    Persists the last verified root of every root file, so a root older than one verified
+    by an earlier run is refused
+    '''
+    global TRUSTED_STATE_FILE_PATH
+    TRUSTED_STATE_FILE_PATH = state_file_path
+
+
+def get_trusted_state(root_metadata_file_path: str) -> TrustedState:
+    '''
+    Returns the trusted state of a root metadata file, the state is shared by all
+    verifications of the same root and reloaded only when the root file changes
+
+        Raises:
+            FileNotFoundError - file not found
+            tomli.TomlDecodeError - error in decoding toml file
+            uptane.error.general.MetadataFileHasExpired
+            uptane.error.general.MetadataFileInvalidSignature
+            uptane.error.general.MetadataRollback
+    '''
+    root_metadata_file_path = os.path.abspath(root_metadata_file_path)
+    with TRUSTED_STATES_LOCK:
+        trusted_state = TRUSTED_STATES.get(root_metadata_file_path)
+        if trusted_state is None:
+            trusted_state = TrustedState(root_metadata_file_path)
+            TRUSTED_STATES[root_metadata_file_path] = trusted_state
+
+    return trusted_state.refresh()
+
+
 class Verification:
     '''
     This is the verification class of uptane, for verification, you would need access to 
@@ -29,7 +344,8 @@ class Verification:
             Checks hash of Snapshot metadata file against hash in Timestamp metadata file 
     '''
 
-    def __init__(self, root_metadata_file_path: str, targets_files_dir_path: str, snapshot_metadata_file_path, timestamp_metadata_file_path) -> None:
+    def __init__(self, root_metadata_file_path: str, targets_files_dir_path: str, snapshot_metadata_file_path, timestamp_metadata_file_path,
+                 file_hashes: typing.Optional[typing.Dict[str, str]] = None) -> None:
         '''
         Inits the verification class with the root metadata file
             Parameters:
@@ -38,51 +354,49 @@ class Verification:
                 targets_files_dir_path (str): directory where all target files exist
                 snapshot_metadata_file_path (str):
                 timestamp_metadata_file_path (str):
+                file_hashes (Dict[str, str]) [Optional]: sha256 hashes of files already computed
+                by the caller (e.g. while extracting them), these files are not read again
 
             Raises:
                 FileNotFoundError - file not found
                 tomli.TomlDecodeError - error in decoding toml file
                 uptane.error.general.MetadataFileHasExpired
+                uptane.error.general.MetadataFileInvalidSignature
 
             Note:
+                The root is verified once per root file version (see TrustedState)
                 As of now only configured to handle key type ed25519 (only one key)
         '''
-        with open(root_metadata_file_path, 'rb') as f:
-            toml_dict = tomli.load(f)
-
-            self.root_pub_key: str = toml_dict["signed"]["keys"][0]["keyid"]
-            self.root_signed = toml_dict["signed"]
-            self.root_signature: str = toml_dict["signature"]["sig"]
-
-            self.targets_pub_key: str = toml_dict["signed"]["roles"]["targets"][
-                "keys"][0]["keyid"]
-
-            self.snapshot_pub_key: str = toml_dict["signed"]["roles"][
-                "snapshot"]["keys"][0]["keyid"]
-
-            self.timestamp_pub_key: str = toml_dict["signed"]["roles"][
-                "timestamp"]["keys"][0]["keyid"]
+        # one snapshot, the keys and expiry all come from the same root version
+        root_state = get_trusted_state(root_metadata_file_path).snapshot()
+        self.root_keys: RoleKeys = root_state.root_keys
+        self.targets_keys: RoleKeys = root_state.targets_keys
+        self.snapshot_keys: RoleKeys = root_state.snapshot_keys
+        self.timestamp_keys: RoleKeys = root_state.timestamp_keys
+        self.root_expires: int = root_state.root_expires
 
         self.targets_files_dir_path = targets_files_dir_path
         self.snapshot_metadata_file_path = snapshot_metadata_file_path
         self.timestamp_metadata_file_path = timestamp_metadata_file_path
+        self.file_hashes: typing.Dict[str, str] = {}
+        for file_path in (file_hashes or {}):
+            self.file_hashes[os.path.normpath(file_path)] = file_hashes[file_path]
 
-    def __verify_root(self):
+    def __hash_files(self, file_paths: typing.Iterable[str], bufsize: int) -> typing.Dict[str, str]:
         '''
-        Verifies whether the root has signed with his key or not
-
-            Raises:
-                uptane.error.general.MetadataFileHasExpired
-                uptane.error.general.MetadataFileInvalidSignature
+        Hashes files in parallel, files with a hash given at init are not read
         '''
-
-        if uptane.time.fut_is_expired(int(self.root_signed["expires"])):
-            raise uptane.error.general.MetadataFileHasExpired
-
-        if not uptane.crypto.sign.verify_sig_metadata(self.root_signed, \
-            uptane.crypto.hash.HashFunc.sha256, uptane.crypto.sign.KeyType.ed25519, \
-            self.root_pub_key, self.root_signature):
-            raise uptane.error.general.MetadataFileInvalidSignature
+        hashes = {}
+        unknown_file_paths = []
+        for file_path in file_paths:
+            if os.path.normpath(file_path) in self.file_hashes:
+                hashes[file_path] = self.file_hashes[os.path.normpath(file_path)]
+            else:
+                unknown_file_paths.append(file_path)
+
+        hashes.update(uptane.crypto.hash.hash_files(unknown_file_paths, \
+                      uptane.crypto.hash.HashFunc.sha256, bufsize))
+        return hashes
 
     def __targets_metadata_file_filter(self, value) -> bool:
         '''
@@ -90,139 +404,85 @@ class Verification:
         '''
         return "targets" in value
 
-    def __verify_all_targets_files(self) -> None:
+    def __load_targets_files(self) -> typing.List[typing.Dict[str, typing.Any]]:
         '''
-        Verifies whether target files came from trusted source or not
+        Loads all targets metadata files in the targets dir and checks their key and expiry
 
             Raises:
-                uptane.error.general.MetadataFileHasExpired 
-                uptane.error.general.MetadataFileInvalidSignature
                 FileNotFoundError - when file is not found
                 toml.TOMLDecodeError
+                uptane.error.general.MetadataFileHasExpired 
                 uptane.error.general.PublicKeysNoMatch
         '''
-
         targets_metadata_files = os.listdir(self.targets_files_dir_path)
         targets_metadata_files = filter(self.__targets_metadata_file_filter,
                                         targets_metadata_files)
 
+        targets_toml_dicts = []
         for targets_metadata_file in targets_metadata_files:
 
-            with open(f'{self.targets_files_dir_path}/' + targets_metadata_file,
-                      'rb') as f:
-                toml_dict = tomli.load(f)
-                cur_sig = toml_dict["signature"]["sig"]
-                cur_public_key = toml_dict['signature']['keyid']
-                cur_image_hash = toml_dict['signed']['image_hash']
-                cur_signed = toml_dict['signed']
-                buf_size = int(toml_dict["signed"]["image_buf_size"])
-                cur_image_file = toml_dict["signed"]["image_name"]
-
-            if self.targets_pub_key != cur_public_key:
-                raise uptane.error.general.PublicKeysNoMatch
-
-            if uptane.time.fut_is_expired(int(toml_dict["signed"]["expires"])):
-                raise uptane.error.general.MetadataFileHasExpired
+            toml_dict = uptane.codec.load(f'{self.targets_files_dir_path}/' + targets_metadata_file)
 
-            if not uptane.crypto.sign.verify_sig_metadata(cur_signed, \
-                uptane.crypto.hash.HashFunc.sha256, uptane.crypto.sign.KeyType.ed25519, \
-                cur_public_key, cur_sig):
-                raise uptane.error.general.MetadataFileInvalidSignature
+            check_role_metadata(toml_dict, self.targets_keys)
+            targets_toml_dicts.append(toml_dict)
 
-            if uptane.crypto.hash.get_file_hash(cur_image_file, uptane.crypto.hash.HashFunc.sha256, \
-                                            buf_size) != cur_image_hash:
-                raise uptane.error.general.FileHashNoMatch
+        return targets_toml_dicts
 
-    def __verify_snapshot(self) -> None:
+    def __load_role_file(self, metadata_file_path: str, keys: RoleKeys) -> typing.Dict[str, typing.Any]:
         '''
-        Verifies whether target file came from trusted source or not
-            Throws:
-                uptane.error.general.MetadataFileHasExpired 
-                uptane.error.general.MetadataFileInvalidSignature
+        Loads snapshot or timestamp metadata file and checks its key and expiry
+
+            Raises:
                 FileNotFoundError - when file is not found
                 toml.TOMLDecodeError
-                uptane.error.general.PublicKeysNoMatch 
+                uptane.error.general.MetadataFileHasExpired 
+                uptane.error.general.PublicKeysNoMatch
         '''
-        cur_sig: str = ''
-        cur_public_key: str = ''
-        cur_signed: typing.Dict[str, typing.Any] = {}
-        bufsize: int = 0
-
-        with open(self.snapshot_metadata_file_path, 'rb') as f:
-            toml_dict = tomli.load(f)
-            cur_sig = toml_dict["signature"]["sig"]
-            cur_public_key = toml_dict['signature']['keyid']
-            cur_signed = toml_dict['signed']
-            bufsize = int(toml_dict["signed"]["bufsize"])
+        toml_dict = uptane.codec.load(metadata_file_path)
 
-        if self.snapshot_pub_key != cur_public_key:
-            raise uptane.error.general.PublicKeysNoMatch
+        check_role_metadata(toml_dict, keys)
+        return toml_dict
 
-        if uptane.time.fut_is_expired(int(toml_dict["signed"]["expires"])):
-            raise uptane.error.general.MetadataFileHasExpired
+    def __verify_snapshot_hashes(self, snapshot_toml_dict: typing.Dict[str, typing.Any]) -> None:
+        '''
+        Verifies the hash of each targets metadata file against the snapshot, the targets
+        metadata files are hashed in parallel
 
-        if not uptane.crypto.sign.verify_sig_metadata(cur_signed, \
-            uptane.crypto.hash.HashFunc.sha256, uptane.crypto.sign.KeyType.ed25519, cur_public_key, cur_sig):
-            raise uptane.error.general.MetadataFileInvalidSignature
+            Raises:
+                FileNotFoundError - when file is not found
+                uptane.error.general.FileHashNoMatch
+        '''
+        cur_signed = snapshot_toml_dict['signed']
+        bufsize = int(cur_signed["bufsize"])
 
-        # check hash of each metadata file
+        targets_hashes = {}
         for targets_metadata_file_k in cur_signed["targets"]:
-
             targets_metadata_file = self.targets_files_dir_path + '/' + targets_metadata_file_k
-            targets_metadata_file_hash = cur_signed["targets"][
+            targets_hashes[targets_metadata_file] = cur_signed["targets"][
                 targets_metadata_file_k]["hash"]
 
-            if uptane.crypto.hash.get_file_hash(targets_metadata_file, \
-                uptane.crypto.hash.HashFunc.sha256, bufsize) != targets_metadata_file_hash:
-                raise uptane.error.general.FileHashNoMatch
+        if self.__hash_files(targets_hashes, bufsize) != targets_hashes:
+            raise uptane.error.general.FileHashNoMatch
 
-    def __verify_timestamp(self) -> None:
+    def __verify_timestamp_hash(self, timestamp_toml_dict: typing.Dict[str, typing.Any]) -> None:
         '''
-        Verifies whether target file came from trusted source or not Parameters:
-                path (str): path to targets metadata file
-            
-            Throws:
-                    FileNotFoundError
-                    tomli.TOMLDecodeError
-                    uptane.error.general.FileHashNoMatch
-                    uptane.error.general.PublicKeysNoMatch
-                    uptane.error.general.MetadataFileHasExpired
-                    uptane.error.general.MetadataFileInvalidSignature
-       '''
-        cur_sig: str = ''
-        cur_public_key: str = ''
-        cur_signed: typing.Dict[str, typing.Any] = {}
-        bufsize: int = 0
-
-        with open(self.timestamp_metadata_file_path, 'rb') as f:
-            toml_dict = tomli.load(f)
-            cur_sig = toml_dict["signature"]["sig"]
-            cur_public_key = toml_dict['signature']['keyid']
-
-            snapshot_metadata_file_hash = toml_dict["signed"][
-                "snapshot_metadata_file_hash"]
-
-            cur_signed = toml_dict['signed']
-            bufsize = int(toml_dict["signed"]["bufsize"])
-
-        if self.timestamp_pub_key != cur_public_key:
-            raise uptane.error.general.PublicKeysNoMatch
+        Verifies the hash of the snapshot metadata file against the timestamp
 
-        if uptane.time.fut_is_expired(int(toml_dict["signed"]["expires"])):
-            raise uptane.error.general.MetadataFileHasExpired
-
-        if not uptane.crypto.sign.verify_sig_metadata(cur_signed, \
-            uptane.crypto.hash.HashFunc.sha256, uptane.crypto.sign.KeyType.ed25519, \
-            cur_public_key, cur_sig):
-            raise uptane.error.general.MetadataFileInvalidSignature
+            Raises:
+                FileNotFoundError - when file is not found
+                uptane.error.general.FileHashNoMatch
+        '''
+        snapshot_metadata_file_hash = timestamp_toml_dict["signed"]["snapshot_metadata_file_hash"]
+        bufsize = int(timestamp_toml_dict["signed"]["bufsize"])
 
-        if uptane.crypto.hash.get_file_hash(self.snapshot_metadata_file_path, \
-                uptane.crypto.hash.HashFunc.sha256, bufsize) != snapshot_metadata_file_hash:
+        if self.__hash_files([self.snapshot_metadata_file_path], bufsize)[ \
+                self.snapshot_metadata_file_path] != snapshot_metadata_file_hash:
             raise uptane.error.general.FileHashNoMatch
 
     def verify(self) -> None:
         '''
-            Verifies metadata for an image file 
+            Verifies metadata for an image file, the signatures of all targets, snapshot and
+            timestamp metadata are checked together in one batch (root was verified at init)
                 Parameters:
                    url (str): path to the file
 
@@ -234,18 +494,180 @@ class Verification:
                     uptane.error.general.MetadataFileHasExpired
                     uptane.error.general.MetadataFileInvalidSignature
         '''
+        if uptane.time.fut_is_expired(self.root_expires):
+            raise uptane.error.general.MetadataFileHasExpired
 
-        self.__verify_root()
-        print("root metadata verified \u2713")
-        self.__verify_all_targets_files()
+        targets_toml_dicts = self.__load_targets_files()
+        snapshot_toml_dict = self.__load_role_file(self.snapshot_metadata_file_path,
+                                                   self.snapshot_keys)
+        timestamp_toml_dict = self.__load_role_file(self.timestamp_metadata_file_path,
+                                                    self.timestamp_keys)
+
+        verify_signatures([signature_item(toml_dict, self.targets_keys) for toml_dict in targets_toml_dicts] + \
+            [signature_item(snapshot_toml_dict, self.snapshot_keys), \
+             signature_item(timestamp_toml_dict, self.timestamp_keys)])
+        print("metadata signatures verified \u2713")
+
+        verify_images(targets_toml_dicts, self.targets_files_dir_path, self.__hash_files)
         print("all targets metadata verified \u2713")
-        self.__verify_snapshot()
+        self.__verify_snapshot_hashes(snapshot_toml_dict)
         print("snapshot metadata verified \u2713")
-        self.__verify_timestamp()
+        self.__verify_timestamp_hash(timestamp_toml_dict)
         print("timestamp metadata verified \u2713")
     
     def verify_target_file(self) -> None:
-        self.__verify_all_targets_files()
+        '''
+        Verifies all targets metadata files and their images, signatures are checked in one batch
+        '''
+        targets_toml_dicts = self.__load_targets_files()
+        verify_signatures([signature_item(toml_dict, self.targets_keys) for toml_dict in targets_toml_dicts])
+        verify_images(targets_toml_dicts, self.targets_files_dir_path, self.__hash_files)
+
+
+class IncrementalVerification:
+    '''
+    Verifier for polling ECUs that keeps the last trusted state between calls:
+        - the root is verified once, at init
+        - every poll checks the timestamp signature, when the snapshot hash in it has not
+          changed nothing else is read or verified
+        - otherwise the snapshot is verified, and only the targets metadata files (and
+          their images) whose hash in the snapshot changed are verified
+        - metadata expiring before the metadata it replaces is a rollback (or a freeze with
+          an old, still valid, timestamp) and is refused
+    '''
+
+    def __init__(self, root_metadata_file_path: str) -> None:
+        '''
+        Inits the verifier with the root metadata file, verifies the root
+            Parameters:
+                root_metadata_file_path (str): path to the root metadata file
+
+            Raises:
+                FileNotFoundError - file not found
+                tomli.TomlDecodeError - error in decoding toml file
+                uptane.error.general.MetadataFileHasExpired
+                uptane.error.general.MetadataFileInvalidSignature
+        '''
+        self.trusted_state = get_trusted_state(root_metadata_file_path)
+        self.root_hash = self.trusted_state.snapshot().root_hash
+
+        # last trusted state
+        self.snapshot_hash: typing.Optional[str] = None
+        self.targets_hashes: typing.Dict[str, str] = {}
+        self.targets_expires: typing.Dict[str, int] = {}
+        self.image_names: typing.Dict[str, str] = {}  # image of every trusted targets file
+        self.timestamp_expires: int = 0
+        self.snapshot_expires: int = 0
+        self.expires: int = 0  # earliest expiry of the trusted snapshot and targets
+
+    def verify(self, targets_files_dir_path: str, snapshot_metadata_file_path: str,
+               timestamp_metadata_file_path: str) -> bool:
+        '''
+        Verifies new metadata against the last trusted state and updates it
+            Parameters:
+                targets_files_dir_path (str): directory where all target files and images exist
+                snapshot_metadata_file_path (str):
+                timestamp_metadata_file_path (str):
+
+            Returns:
+                bool: True when new metadata was verified, False when nothing has changed
+
+            Raises:
+                FileNotFoundError
+                tomli.TOMLDecodeError
+                uptane.error.general.FileHashNoMatch
+                uptane.error.general.PublicKeysNoMatch
+                uptane.error.general.MetadataFileHasExpired
+                uptane.error.general.MetadataFileInvalidSignature
+                uptane.error.general.MetadataRollback
+                uptane.error.general.DuplicateImageName
+        '''
+        # a new root version invalidates everything trusted under the old one
+        # one snapshot for the whole call, the keys of all roles come from the same root version
+        root_state = self.trusted_state.refresh().snapshot()
+        if root_state.root_hash != self.root_hash:
+            self.root_hash = root_state.root_hash
+            self.snapshot_hash = None
+            self.targets_hashes = {}
+            self.targets_expires = {}
+            self.image_names = {}
+            self.timestamp_expires = 0
+            self.snapshot_expires = 0
+
+        timestamp_toml_dict = uptane.codec.load(timestamp_metadata_file_path)
+        check_role_metadata(timestamp_toml_dict, root_state.timestamp_keys)
+        verify_signatures([signature_item(timestamp_toml_dict, root_state.timestamp_keys)])
+        timestamp_expires = int(timestamp_toml_dict["signed"]["expires"])
+        if timestamp_expires < self.timestamp_expires:
+            raise uptane.error.general.MetadataRollback
+
+        snapshot_hash = timestamp_toml_dict["signed"]["snapshot_metadata_file_hash"]
+        if snapshot_hash == self.snapshot_hash:
+            # trusted metadata is only as good as its earliest expiry
+            if uptane.time.fut_is_expired(self.expires):
+                raise uptane.error.general.MetadataFileHasExpired
+            self.timestamp_expires = timestamp_expires
+            return False
+
+        # snapshot
+        with open(snapshot_metadata_file_path, 'rb') as f:
+            snapshot_metadata = f.read()
+        if uptane.crypto.hash.get_bytes_hash(snapshot_metadata, \
+                uptane.crypto.hash.HashFunc.sha256) != snapshot_hash:
+            raise uptane.error.general.FileHashNoMatch
+
+        snapshot_toml_dict = uptane.codec.loads(snapshot_metadata, snapshot_metadata_file_path)
+        check_role_metadata(snapshot_toml_dict, root_state.snapshot_keys)
+        verify_signatures([signature_item(snapshot_toml_dict, root_state.snapshot_keys)])
+        snapshot_expires = int(snapshot_toml_dict["signed"]["expires"])
+        if snapshot_expires < self.snapshot_expires:
+            raise uptane.error.general.MetadataRollback
+
+        # targets, only those whose hash in the snapshot has changed
+        snapshot_targets = snapshot_toml_dict["signed"]["targets"]
+        targets_hashes = {name: snapshot_targets[name]["hash"] for name in snapshot_targets}
+        changed_targets = [name for name in targets_hashes \
+                           if self.targets_hashes.get(name) != targets_hashes[name]]
+
+        targets_expires = {name: self.targets_expires[name] for name in targets_hashes \
+                           if name not in changed_targets}
+        targets_toml_dicts = []
+        for name in changed_targets:
+            with open(f'{targets_files_dir_path}/{name}', 'rb') as f:
+                targets_metadata = f.read()
+            if uptane.crypto.hash.get_bytes_hash(targets_metadata, \
+                    uptane.crypto.hash.HashFunc.sha256) != targets_hashes[name]:
+                raise uptane.error.general.FileHashNoMatch
+
+            toml_dict = uptane.codec.loads(targets_metadata, name)
+            check_role_metadata(toml_dict, root_state.targets_keys)
+            targets_toml_dicts.append(toml_dict)
+            targets_expires[name] = int(toml_dict["signed"]["expires"])
+            if targets_expires[name] < self.targets_expires.get(name, 0):
+                raise uptane.error.general.MetadataRollback
+
+        verify_signatures([signature_item(toml_dict, root_state.targets_keys) \
+                           for toml_dict in targets_toml_dicts])
+
+        # the images of unchanged targets files were verified before, but their names are taken
+        image_names = {name: self.image_names[name] for name in targets_hashes \
+                       if name not in changed_targets}
+        verify_images(targets_toml_dicts, targets_files_dir_path, \
+            lambda file_paths, buf_size: uptane.crypto.hash.hash_files(file_paths, \
+                uptane.crypto.hash.HashFunc.sha256, buf_size), set(image_names.values()))
+        for name, toml_dict in zip(changed_targets, targets_toml_dicts):
+            image_names[name] = toml_dict["signed"]["image_name"]
+
+        # all checks passed, trust the new state
+        self.snapshot_hash = snapshot_hash
+        self.targets_hashes = targets_hashes
+        self.targets_expires = targets_expires
+        self.image_names = image_names
+        self.timestamp_expires = timestamp_expires
+        self.snapshot_expires = snapshot_expires
+        self.expires = min([snapshot_expires] + list(targets_expires.values()))
+        return True
+
 
 # RITUL
 class ECUVerification: